@@ -1,24 +1,28 @@
-from flask import Flask, render_template, request, session, redirect, url_for, flash
+from flask import (
+    Flask,
+    abort,
+    flash,
+    jsonify,
+    redirect,
+    render_template,
+    request,
+    session,
+    url_for,
+)
 import os
-import pandas as pd
-
-from time import time
-
-import polars as pl
 
 from base.general import Filter, FilterOperator
 from base.insights import MetricsInsight
+from base.jobs import JobStatus
 from base.metrics import DualColumnMetric, SingleColumnMetric
-from calculations.anomaly.metric_anomaly import MetricAnomaly
-from calculations.subgroup_insights.periodic_subgroup_insights_trend import (
-    PeriodicSubgroupMetricsTrend,
-)
+from calculations.subgroup_insights.cube_cache import subgroup_cube_cache
 from calculations.subgroup_insights.segment_subgroup_insights import (
     SegmentSubgroupInsights,
 )
-from calculations.trend.periodic_metrics_trend import PeriodicMetricsTrend
 from calculations.trend.segment_comparision import SegmentComparison
-from data_source import utils as data_source_utils
+from data_source.registry import dataset_registry
+from jobs.job_queue import JobQueueFull, insight_job_queue
+from jobs.result_store import insight_result_store
 
 app = Flask(__name__)
 app.secret_key = "your_secret_key"  # Replace with a secure random key
@@ -32,12 +36,12 @@ def index():
         # Validate the file path
         if os.path.isfile(file_path) and file_path.endswith(".csv"):
             try:
-                # Read the CSV file
-                df = pd.read_csv(file_path)
-                # Extract the columns
-                columns = df.columns.tolist()
+                # Inspect the header and a sample of rows only, the schema stays in
+                # the registry as the session cookie is limited to about 4KB
+                schema = dataset_registry.get_schema(file_path, date_column=date_column)
                 # Store the columns in the session
-                session["columns"] = columns
+                session["columns"] = schema["columns"]
+                session["file_path"] = file_path
                 session["date_column"] = date_column
                 return redirect(url_for("define_metric"))
             except Exception as e:
@@ -228,31 +232,65 @@ def initialize_metric(metric_data):
 
     return metric
 
-def get_insight_results(insights):
 
-    file_path = session["file_path"]
-    date_column = session["date_column"]
-    df = data_source_utils.load_df_from_csv(
-    file_path,
-    date_column=date_column,
-)
+def get_insight_results(job, insights, file_path, date_column, top_k=None):
+    # runs on a worker of the job queue, outside of the request and its session
+    job.report(0.05, "Loading the dataset")
+    schema = dataset_registry.get_schema(file_path, date_column=date_column)
+    # the dataset is served from the registry, parsed once and kept in memory
+    # across the insights over the same file, or scanned when over its budget
+    df = dataset_registry.get_or_scan(
+        file_path,
+        date_column=date_column,
+        dtypes=schema["dtypes"],
+        date_format=schema["date_format"],
+    )
+    job.report(0.2, "Comparing the segments")
     # calculate overall trends based on period
-    trend_calculator = SegmentComparison(insights=insights)
+    trend_calculator = SegmentComparison(insights=insights, single_pass=True)
     trend_df = trend_calculator.calculate(
         df,
     )
-    print("--------------------------------")
-    trend_df[1].head()
+    job.report(0.4, "Calculating the subgroup insights")
+
+    def report_combinations(done, total):
+        # a checkpoint of the cancellation before every combination
+        job.report(
+            max(job.progress, 0.4 + 0.5 * done / max(total, 1)),
+            f"Calculating the subgroup insights, {done} of {total} combinations",
+        )
+
     # calculate trends for subgroups based on period
-    subgroup_trend_calculator = SegmentSubgroupInsights(insights=insights)
+    subgroup_trend_calculator = SegmentSubgroupInsights(
+        insights=insights,
+        cube=True,
+        top_k=top_k,
+        cube_cache=subgroup_cube_cache,
+        progress=report_combinations,
+    )
     subgroup_trend_df = subgroup_trend_calculator.calculate(
         trend_df=trend_df[0],
-        baseline_filtered_df = trend_df[1],
-        comparison_filtered_df = trend_df[2],
+        baseline_filtered_df=trend_df[1],
+        comparison_filtered_df=trend_df[2],
+        # the cube partials are reused by the insights over the same dataset
+        data_fingerprint=dataset_registry.get_key(
+            file_path, date_column, schema["dtypes"], schema["date_format"]
+        ),
+        # the partials are aggregated from the dataset whatever the segments
+        dataframe=df,
+    )
+    job.report(0.9, "Rendering the results")
+    # the subgroups are keyed by integers, rendered as JSON for the output only
+    subgroup_trend_df = subgroup_trend_calculator.subgroup_dictionary.render(
+        subgroup_trend_df
+    )
+    # the results stay on the server, the job and the session only hold their id,
+    # a cancelled job stores none, the queue discards one stored while cancelling
+    job.check_cancelled()
+    return insight_result_store.put(
+        subgroup_trend_df,
+        {"name": insights.name, "pruned_subgroups": insights.pruned_subgroups},
     )
-    subgroup_trend_df.head()
-    subgroup_trend_df.write_csv("test_data_2.csv")
-    return subgroup_trend_df.to_dicts()
 
 
 @app.route("/define_insight", methods=["GET", "POST"])
@@ -318,16 +356,39 @@ def define_insight():
             name=insight_name,
             metrics=metric,
             group_by_columns=group_by_columns,
+            max_rca_depth=request.form.get("max_rca_depth", default=3, type=int),
+            min_subgroup_support=request.form.get("min_subgroup_support", type=int),
+            min_subgroup_impact=request.form.get("min_subgroup_impact", type=float),
             baseline_segment=baseline_segment,
             comparison_segment=comparison_segment,
         )
-        insight_results = get_insight_results(insights)
-
-        # Store insights in the session or process it further
-        session["insights"] = insight_results
+        # the insight runs as a background job, the page polls its status
+        try:
+            job = insight_job_queue.submit(
+                get_insight_results,
+                insights,
+                file_path=session["file_path"],
+                date_column=session["date_column"],
+                # only the top subgroups by absolute_impact_diff are shown
+                top_k=request.form.get("top_k", type=int),
+                name=insight_name,
+                # the result of a job cancelled once stored is dropped
+                discard=insight_result_store.delete,
+            )
+        except JobQueueFull as e:
+            return (
+                render_template(
+                    "define_insight.html",
+                    columns=columns,
+                    metric=metric_data,
+                    error=str(e),
+                ),
+                429,
+            )
 
-        # Proceed with analysis or further processing
-        return render_template("insight_result.html", insights=insight_results)
+        session["job_id"] = job.id
+        session.pop("result_id", None)
+        return redirect(url_for("insight_job", job_id=job.id))
     else:
         return render_template(
             "define_insight.html", columns=columns, metric=metric_data
@@ -336,10 +397,64 @@ def define_insight():
 
 @app.route("/insight_result")
 def insight_result():
-    insights = session.get("insights", None)
-    if not insights:
-        return redirect(url_for("index"))
-    return render_template("insight_result.html", insights=insights)
+    result_id = session.get("result_id", None)
+    if result_id:
+        return redirect(url_for("insight_result_by_id", result_id=result_id))
+    job_id = session.get("job_id", None)
+    if job_id:
+        return redirect(url_for("insight_job_result", job_id=job_id))
+    return redirect(url_for("index"))
+
+
+@app.route("/insight_result/<result_id>")
+def insight_result_by_id(result_id):
+    result = insight_result_store.get(result_id)
+    if result is None:
+        # unknown, or expired and evicted from the store
+        abort(404)
+    result_df, metadata = result
+    return render_template(
+        "insight_result.html",
+        insights=result_df.to_dicts(),
+        pruned_subgroups=metadata.get("pruned_subgroups"),
+    )
+
+
+@app.route("/jobs/<job_id>")
+def insight_job(job_id):
+    job = insight_job_queue.get(job_id)
+    if job is None:
+        abort(404)
+    return render_template("insight_job.html", job=job.to_dict())
+
+
+@app.route("/jobs/<job_id>/status")
+def insight_job_status(job_id):
+    job = insight_job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": f"Unknown job {job_id}"}), 404
+    return jsonify(job.to_dict())
+
+
+@app.route("/jobs/<job_id>/cancel", methods=["POST"])
+def insight_job_cancel(job_id):
+    job = insight_job_queue.cancel(job_id)
+    if job is None:
+        return jsonify({"error": f"Unknown job {job_id}"}), 404
+    return jsonify(job.to_dict())
+
+
+@app.route("/jobs/<job_id>/result")
+def insight_job_result(job_id):
+    job = insight_job_queue.get(job_id)
+    if job is None:
+        abort(404)
+    if job.status != JobStatus.SUCCEEDED:
+        # still running, failed or cancelled, the job page shows which
+        return redirect(url_for("insight_job", job_id=job_id))
+    # the result of a succeeded job is the id of its result in the store
+    session["result_id"] = job.result
+    return redirect(url_for("insight_result_by_id", result_id=job.result))
 
 
 if __name__ == "__main__":
@@ -1,6 +1,41 @@
 from abc import ABC, abstractmethod
 
 import polars as pl
+from aenum import StrEnum
+
+
+class YoYMethod(StrEnum):
+    """Method to find the value of the same period in the previous year"""
+
+    # left join of the trend to itself on the period of the previous year
+    JOIN = "join"
+    # shift of the trend sorted on a dense period grid, by the periods of a year
+    SHIFT = "shift"
+    # binary search of the period of the previous year in the time sorted trend
+    SEARCH = "search"
+
+
+class AnomalyEngine(StrEnum):
+    """Engine computing the anomalies of a trend"""
+
+    # polars window expressions over the long format trend
+    POLARS = "polars"
+    # numpy operations over the trend pivoted into a subgroups x periods matrix
+    MATRIX = "matrix"
+
+
+class AnomalyDetector(StrEnum):
+    """Center and scale of the values the anomaly scores are standardized with"""
+
+    # rolling mean and standard deviation
+    ZSCORE = "zscore"
+    # rolling median and median absolute deviation, robust to spikes in the window
+    MAD = "mad"
+    # exponentially weighted mean and standard deviation of the previous periods
+    EWMA = "ewma"
+    # seasonal profile of each series, then rolling mean and standard deviation of
+    # the residuals from it
+    SEASONAL = "seasonal"
 
 
 class Anomaly(ABC):
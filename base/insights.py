@@ -46,6 +46,10 @@ class MetricsInsight(BaseModel):
     metrics: SingleColumnMetric | DualColumnMetric
     group_by_columns: List[str]
     max_rca_depth: int = 3
+    # subgroups under either threshold are dropped and not expanded to deeper levels,
+    # the support is the minimum size and the impact the minimum |absolute_impact|
+    min_subgroup_support: Optional[int] = None
+    min_subgroup_impact: Optional[float] = None
     baseline_time_period: Tuple[date, date] = None
     baseline_segment: List[Filter] = None
     comparison_time_period: Tuple[date, date] = None
@@ -57,6 +61,8 @@ class MetricsInsight(BaseModel):
     # comparision related outputss
     comparison_number_of_row: int = None
     comparison_value: float = None
+    # number of subgroups pruned by the support and impact thresholds
+    pruned_subgroups: int = None
     # List of all data cuts
     # data_cut_info: List[Dict[str, DataCutInfo]] = None
 
@@ -0,0 +1,13 @@
+from aenum import StrEnum
+
+
+class JobStatus(StrEnum):
+    """Status of a background job"""
+
+    # waiting for a free worker
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    # cancelled while queued, or stopped at a checkpoint while running
+    CANCELLED = "cancelled"
@@ -3,7 +3,7 @@ from abc import abstractmethod
 from aenum import StrEnum
 from polars import DataFrame
 from base.insights import MetricsInsight
-from base.metrics import Metric
+from base.metrics import DualColumnMetric, Metric, SingleColumnMetric
 
 
 class MetricsTrendType(StrEnum):
@@ -43,3 +43,32 @@ class BaseMetricsTrend:
         if metric_details.metrics.dimensions:
             columns_to_combine.extend(metric_details.metrics.dimensions)
         return list(set(columns_to_combine))
+
+    def get_columns_to_load(self, metric_details: MetricsInsight):
+        """Get all columns referenced by the insight, used to prune the columns
+        read from the source
+
+        Args:
+            metric_details (MetricsInsight): Metrics details
+        """
+        columns_to_load = set(self.get_columns_to_combine(metric_details))
+
+        metrics = [metric_details.metrics]
+        if isinstance(metric_details.metrics, DualColumnMetric):
+            metrics.extend(
+                [
+                    metric_details.metrics.numerator_metric,
+                    metric_details.metrics.denominator_metric,
+                ]
+            )
+
+        filters = []
+        for metric in metrics:
+            if isinstance(metric, SingleColumnMetric):
+                columns_to_load.update([metric.column, metric.date_column])
+            filters.extend(metric.filters or [])
+        filters.extend(metric_details.baseline_segment or [])
+        filters.extend(metric_details.comparison_segment or [])
+
+        columns_to_load.update(_filter.column for _filter in filters)
+        return list(columns_to_load)
@@ -0,0 +1,81 @@
+"""Benchmark of the detectors of MetricAnomaly
+
+Times the anomalies of the monthly time series of many subgroups standardized with
+the rolling mean and standard deviation, the rolling median and median absolute
+deviation, and the exponentially weighted mean and standard deviation. Two spikes
+are added two months apart to some subgroups, and the share of second spikes each
+detector flags shows how much the first spike in the window hides the second.
+
+Run from the repository root:
+    python -m benchmarks.bench_anomaly_detectors --subgroups 27778 --periods 36
+"""
+
+import argparse
+from time import perf_counter
+
+import numpy as np
+import polars as pl
+
+from base.anomaly import AnomalyDetector
+from base.insights import MetricsInsight
+from base.metrics import SingleColumnMetric
+from benchmarks.bench_anomaly_pipeline import build_subgroup_trend
+from calculations.anomaly.metric_anomaly import MetricAnomaly
+
+
+def add_spikes(subgroup_df: pl.DataFrame, periods: int, spiked: int) -> pl.DataFrame:
+    """Multiply the revenue of the spiked first subgroups by 10 in two periods two
+    months apart, near the end of their trend"""
+    first_period = subgroup_df.get_column("PeriodIndex").min()
+    spike_periods = [first_period + periods - 4, first_period + periods - 2]
+    return subgroup_df.with_columns(
+        pl.when(
+            (pl.col("sub_group") < spiked) & pl.col("PeriodIndex").is_in(spike_periods)
+        )
+        .then(pl.col("revenue") * 10)
+        .otherwise(pl.col("revenue"))
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--subgroups", type=int, default=27_778)
+    parser.add_argument("--periods", type=int, default=36)
+    parser.add_argument("--spiked", type=int, default=1_000)
+    parser.add_argument("--threshold", type=float, default=1.0)
+    args = parser.parse_args()
+
+    subgroup_df = add_spikes(
+        build_subgroup_trend(args.subgroups, args.periods), args.periods, args.spiked
+    )
+    second_spike = subgroup_df.get_column("PeriodIndex").max() - 1
+    metric = SingleColumnMetric(
+        name="revenue", column="revenue", date_column="date", aggregation_method="sum"
+    )
+    insight = MetricsInsight(name=metric.name, metrics=metric, group_by_columns=[])
+    print(
+        f"subgroups: {args.subgroups}  periods: {args.periods}"
+        f"  rows: {subgroup_df.height}"
+    )
+
+    timings = {}
+    for detector in AnomalyDetector:
+        start = perf_counter()
+        anomalies_df = MetricAnomaly().calculate_subgroups(
+            subgroup_df, "monthly", insight, args.threshold, detector=detector
+        )
+        timings[detector] = perf_counter() - start
+        second_spikes_flagged = anomalies_df.filter(
+            (pl.col("sub_group") < args.spiked)
+            & (pl.col("PeriodIndex") == second_spike)
+        )["is_anomalous"].mean()
+        print(
+            f"{detector.value:8} {timings[detector]:8.3f}s"
+            f"  x{timings[detector] / timings[AnomalyDetector.ZSCORE]:5.2f} zscore"
+            f"  {anomalies_df['is_anomalous'].sum():8} anomalies"
+            f"  {second_spikes_flagged:6.1%} second spikes flagged"
+        )
+
+
+if __name__ == "__main__":
+    main()
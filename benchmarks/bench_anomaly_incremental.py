@@ -0,0 +1,93 @@
+"""Benchmark of the incremental anomalies of MetricAnomaly
+
+Times the anomalies of a new day of the daily time series of many subgroups,
+recomputed over the whole history by the matrix engine, against the incremental
+anomalies of the new day only from the state of the history, and checks both give
+the same anomalies for the new day.
+
+Run from the repository root:
+    python -m benchmarks.bench_anomaly_incremental --subgroups 10000 --days 730
+"""
+
+import argparse
+import tempfile
+from time import perf_counter
+
+import numpy as np
+import polars as pl
+from polars.testing import assert_frame_equal
+
+from base.anomaly import AnomalyEngine
+from base.insights import MetricsInsight
+from base.metrics import SingleColumnMetric
+from calculations.anomaly.incremental import AnomalyStateStore
+from calculations.anomaly.metric_anomaly import MetricAnomaly
+
+
+def build_daily_subgroup_trend(subgroups: int, days: int) -> pl.DataFrame:
+    rng = np.random.default_rng(0)
+    # daily period index of January 1st 2023 onwards
+    first_period = 19358
+    return pl.DataFrame(
+        {
+            "sub_group": np.repeat(np.arange(subgroups, dtype=np.uint64), days),
+            "PeriodIndex": np.tile(
+                np.arange(first_period, first_period + days, dtype=np.int32),
+                subgroups,
+            ),
+            "revenue": rng.gamma(2.0, 50.0, subgroups * days),
+        }
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--subgroups", type=int, default=10_000)
+    parser.add_argument("--days", type=int, default=730)
+    parser.add_argument("--threshold", type=float, default=1.0)
+    args = parser.parse_args()
+
+    subgroup_df = build_daily_subgroup_trend(args.subgroups, args.days + 1)
+    last_period = subgroup_df.get_column("PeriodIndex").max()
+    history_df = subgroup_df.filter(pl.col("PeriodIndex") < last_period)
+    new_day_df = subgroup_df.filter(pl.col("PeriodIndex") == last_period)
+    metric = SingleColumnMetric(
+        name="revenue", column="revenue", date_column="date", aggregation_method="sum"
+    )
+    insight = MetricsInsight(name=metric.name, metrics=metric, group_by_columns=[])
+    print(
+        f"subgroups: {args.subgroups}  days: {args.days}" f"  rows: {history_df.height}"
+    )
+
+    start = perf_counter()
+    full_df = MetricAnomaly(engine=AnomalyEngine.MATRIX).calculate_subgroups(
+        subgroup_df, "daily", insight, args.threshold
+    )
+    full_time = perf_counter() - start
+
+    anomaly = MetricAnomaly(state_store=AnomalyStateStore(tempfile.mkdtemp()))
+    start = perf_counter()
+    anomaly.calculate_incremental(
+        history_df, "daily", insight, "bench", args.threshold, sub_group=True
+    )
+    history_time = perf_counter() - start
+    start = perf_counter()
+    incremental_df = anomaly.calculate_incremental(
+        new_day_df, "daily", insight, "bench", args.threshold, sub_group=True
+    )
+    incremental_time = perf_counter() - start
+
+    assert_frame_equal(
+        full_df.filter(pl.col("PeriodIndex") == last_period),
+        incremental_df.sort("sub_group"),
+    )
+    print(
+        f"full recompute {full_time:8.3f}s  incremental new day {incremental_time:8.3f}s"
+        f"  speedup {full_time / incremental_time:8.1f}x"
+        f"  (history state built in {history_time:.3f}s,"
+        f" {incremental_df['is_anomalous'].sum()} anomalies on the new day)"
+    )
+
+
+if __name__ == "__main__":
+    main()
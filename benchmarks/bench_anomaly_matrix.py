@@ -0,0 +1,79 @@
+"""Benchmark of the matrix engine of MetricAnomaly
+
+Times the anomalies of the monthly time series of many subgroups found by the polars
+engine, window expressions over the long format trend, against the matrix engine
+pivoting the trend into a subgroups x periods matrix, with every row and with only
+the flagged rows, and checks both engines give the same anomalies.
+
+Run from the repository root:
+    python -m benchmarks.bench_anomaly_matrix --subgroups 100000 --periods 36
+"""
+
+import argparse
+from time import perf_counter
+
+from polars.testing import assert_frame_equal
+
+from base.anomaly import AnomalyEngine
+from base.insights import MetricsInsight
+from base.metrics import SingleColumnMetric
+from benchmarks.bench_anomaly_pipeline import build_subgroup_trend
+from calculations.anomaly import repository as anomaly_repository
+from calculations.anomaly.metric_anomaly import MetricAnomaly
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--subgroups", type=int, default=100_000)
+    parser.add_argument("--periods", type=int, default=36)
+    parser.add_argument("--threshold", type=float, default=1.0)
+    args = parser.parse_args()
+
+    subgroup_df = build_subgroup_trend(args.subgroups, args.periods)
+    metric = SingleColumnMetric(
+        name="revenue", column="revenue", date_column="date", aggregation_method="sum"
+    )
+    insight = MetricsInsight(name=metric.name, metrics=metric, group_by_columns=[])
+    print(
+        f"subgroups: {args.subgroups}  periods: {args.periods}"
+        f"  rows: {subgroup_df.height}"
+    )
+
+    timings = {}
+    results = {}
+    for engine, flagged_only in [
+        (AnomalyEngine.POLARS, False),
+        (AnomalyEngine.MATRIX, False),
+        (AnomalyEngine.MATRIX, True),
+    ]:
+        start = perf_counter()
+        results[engine, flagged_only] = MetricAnomaly(
+            engine=engine
+        ).calculate_subgroups(
+            subgroup_df,
+            "monthly",
+            insight,
+            args.threshold,
+            flagged_only=flagged_only,
+        )
+        timings[engine, flagged_only] = perf_counter() - start
+
+    polars_df = results[AnomalyEngine.POLARS, False]
+    assert_frame_equal(polars_df, results[AnomalyEngine.MATRIX, False])
+    assert_frame_equal(
+        anomaly_repository.filter_polars_flagged_anomalies(polars_df),
+        results[AnomalyEngine.MATRIX, True],
+    )
+    polars_time = timings[AnomalyEngine.POLARS, False]
+    print(
+        f"polars {polars_time:8.3f}s"
+        f"  matrix {timings[AnomalyEngine.MATRIX, False]:8.3f}s"
+        f"  speedup {polars_time / timings[AnomalyEngine.MATRIX, False]:8.1f}x"
+        f"  flagged only {timings[AnomalyEngine.MATRIX, True]:8.3f}s"
+        f"  speedup {polars_time / timings[AnomalyEngine.MATRIX, True]:8.1f}x"
+        f"  ({results[AnomalyEngine.MATRIX, True].height} flagged rows)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Benchmark of the seasonal detector of MetricAnomaly
+
+Times the seasonal baselines of the daily time series of many subgroups with a
+weekly seasonality, estimated for every subgroup at once by grouped aggregations,
+against a loop estimating them series by series on a sample of the subgroups, and
+checks both give the same baselines up to rounding. Then compares the share of
+periods the zscore and seasonal detectors flag on a part of the subgroups, every
+flag being a false positive of the seasonality.
+
+Run from the repository root:
+    python -m benchmarks.bench_anomaly_seasonal --subgroups 50000 --days 730
+"""
+
+import argparse
+from time import perf_counter
+
+import numpy as np
+import polars as pl
+from polars.testing import assert_frame_equal
+
+from base.anomaly import AnomalyDetector
+from base.insights import MetricsInsight
+from base.metrics import SingleColumnMetric
+from calculations.anomaly import repository as anomaly_repository
+from calculations.anomaly.metric_anomaly import MetricAnomaly
+
+# revenue of the days of the week from thursday, the weekday of period index 0
+WEEKDAY_FACTORS = np.array([1.0, 1.1, 0.4, 0.3, 1.2, 1.0, 1.0])
+WEEKEND_PERIODS = [2, 3]
+
+
+def build_seasonal_daily_trend(subgroups: int, days: int) -> pl.DataFrame:
+    rng = np.random.default_rng(0)
+    # daily period index of January 1st 2023 onwards
+    periods = np.arange(19358, 19358 + days, dtype=np.int32)
+    return pl.DataFrame(
+        {
+            "sub_group": np.repeat(np.arange(subgroups, dtype=np.uint64), days),
+            "PeriodIndex": np.tile(periods, subgroups),
+            "revenue": rng.normal(100.0, 5.0, subgroups * days)
+            * np.tile(WEEKDAY_FACTORS[periods % 7], subgroups),
+        }
+    )
+
+
+def add_seasonal_baseline(subgroup_df: pl.DataFrame, sub_group: bool) -> pl.DataFrame:
+    return anomaly_repository.add_polars_seasonal_baseline(
+        subgroup_df.lazy(),
+        "revenue",
+        "daily",
+        "seasonal_baseline",
+        "seasonal_stddev",
+        sub_group,
+    ).collect()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--subgroups", type=int, default=50_000)
+    parser.add_argument("--days", type=int, default=730)
+    parser.add_argument("--sample", type=int, default=200)
+    parser.add_argument("--detected", type=int, default=2_000)
+    parser.add_argument("--threshold", type=float, default=1.5)
+    args = parser.parse_args()
+
+    subgroup_df = build_seasonal_daily_trend(args.subgroups, args.days)
+    print(f"subgroups: {args.subgroups}  days: {args.days}  rows: {subgroup_df.height}")
+
+    start = perf_counter()
+    batched_df = add_seasonal_baseline(subgroup_df, True)
+    batched_time = perf_counter() - start
+    sample_df = batched_df.filter(pl.col("sub_group") < args.sample)
+    del batched_df
+
+    start = perf_counter()
+    looped_df = pl.concat(
+        [
+            add_seasonal_baseline(series_df, False)
+            for series_df in subgroup_df.filter(
+                pl.col("sub_group") < args.sample
+            ).partition_by("sub_group", maintain_order=True)
+        ]
+    )
+    looped_time = (perf_counter() - start) * args.subgroups / args.sample
+    assert_frame_equal(sample_df, looped_df, rtol=1e-9, atol=1e-9)
+    print(
+        f"batched {batched_time:8.3f}s"
+        f"  ({subgroup_df.height / batched_time / 1e6:.1f}M rows/s)"
+        f"  per series loop {looped_time:8.3f}s"
+        f" (extrapolated from {args.sample} subgroups)"
+        f"  speedup {looped_time / batched_time:8.1f}x"
+    )
+
+    metric = SingleColumnMetric(
+        name="revenue", column="revenue", date_column="date", aggregation_method="sum"
+    )
+    insight = MetricsInsight(name=metric.name, metrics=metric, group_by_columns=[])
+    detected_df = subgroup_df.filter(pl.col("sub_group") < args.detected)
+    for detector in [AnomalyDetector.ZSCORE, AnomalyDetector.SEASONAL]:
+        start = perf_counter()
+        anomalies_df = MetricAnomaly().calculate_subgroups(
+            detected_df, "daily", insight, args.threshold, detector=detector
+        )
+        detector_time = perf_counter() - start
+        weekend_df = anomalies_df.filter(
+            pl.col("PeriodIndex").mod(7).is_in(WEEKEND_PERIODS)
+        )
+        print(
+            f"{detector.value:8} {detector_time:8.3f}s"
+            f"  {anomalies_df['is_anomalous'].mean():6.1%} of the days"
+            f"  {weekend_df['is_anomalous'].mean():6.1%} of the weekend days flagged"
+            f" over {args.detected} subgroups"
+        )
+
+
+if __name__ == "__main__":
+    main()
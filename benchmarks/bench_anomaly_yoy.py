@@ -0,0 +1,61 @@
+"""Benchmark of the YoY methods of the anomaly detectors
+
+Times the detectors of MetricAnomaly over the dense monthly time series of many
+subgroups, the prior year values looked up with a left join of the trend to itself
+against shifts over the period grid and a binary search of the sorted trend, and
+checks all give the same anomalies.
+
+Run from the repository root:
+    python -m benchmarks.bench_anomaly_yoy --subgroups 100000 --periods 36
+"""
+
+import argparse
+from time import perf_counter
+
+from polars.testing import assert_frame_equal
+
+from base.anomaly import YoYMethod
+from benchmarks.bench_anomaly_pipeline import build_subgroup_trend
+from calculations.anomaly import services as anomaly_services
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--subgroups", type=int, default=100_000)
+    parser.add_argument("--periods", type=int, default=36)
+    parser.add_argument("--threshold", type=float, default=1.0)
+    args = parser.parse_args()
+
+    subgroup_df = build_subgroup_trend(args.subgroups, args.periods)
+    print(
+        f"subgroups: {args.subgroups}  periods: {args.periods}"
+        f"  rows: {subgroup_df.height}"
+    )
+
+    timings = {}
+    results = {}
+    for yoy_method in YoYMethod:
+        start = perf_counter()
+        results[yoy_method] = anomaly_services.calculate_anomalies(
+            subgroup_df,
+            "revenue",
+            "monthly",
+            args.threshold,
+            "in_memory",
+            True,
+            yoy_method=yoy_method,
+        )
+        timings[yoy_method] = perf_counter() - start
+
+    for yoy_method in [YoYMethod.SHIFT, YoYMethod.SEARCH]:
+        assert_frame_equal(results[YoYMethod.JOIN], results[yoy_method])
+        print(
+            f"join {timings[YoYMethod.JOIN]:8.3f}s"
+            f"  {yoy_method} {timings[yoy_method]:8.3f}s"
+            f"  speedup {timings[YoYMethod.JOIN] / timings[yoy_method]:8.1f}x"
+            f"  ({results[yoy_method]['is_anomalous_YoY_diff'].sum()} YoY anomalies)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Benchmark of the DateLabel parsing in calculations.utils.get_date_from_date_label
+
+Labels random dates with get_time_period_date_label and render_date_label, parses
+them back, checks the round trip (the parsed date carries the original label, or
+its ISO week number for the calendar year weekly labels) and reports the throughput
+against a per row datetime.strptime parser.
+
+Run from the repository root:
+    python -m benchmarks.bench_date_label_parsing --rows 10000000
+"""
+
+import argparse
+from datetime import date, datetime
+from time import perf_counter
+
+import polars as pl
+
+from benchmarks.common import build_dates_dataframe
+from calculations import utils as calculation_utils
+
+PERIODS = ["daily", "weekly", "monthly", "quarterly"]
+
+
+def parse_date_label_per_row(label: str, period: str) -> date:
+    """Per row parser with the same semantic as the native one"""
+    year = int(label[:4])
+    if period == "weekly":
+        week = int(label[6:8])
+        if (
+            week == 53
+            and date(year, 1, 1).weekday() != 3
+            and date(year, 12, 31).weekday() != 3
+        ):
+            year_iso = year - 1
+        else:
+            year_iso = year
+        return datetime.strptime(f"{year_iso}-W{week:02d}-1", "%G-W%V-%u").date()
+    elif period == "monthly":
+        return date(year, int(label[5:7]), 1)
+    elif period == "quarterly":
+        return date(year, (int(label[5]) - 1) * 3 + 1, 1)
+    return datetime.strptime(label, "%Y%m%d").date()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--per-row-rows", type=int, default=200_000)
+    args = parser.parse_args()
+
+    dataframe = build_dates_dataframe(args.rows, date(2000, 1, 1), 365 * 30)
+    print(f"rows: {args.rows}")
+    for period in PERIODS:
+        labelled_df = calculation_utils.get_time_period_date_label(
+            "date", dataframe, period
+        )
+        rendered_df = calculation_utils.render_date_label(
+            calculation_utils.get_time_period_index("date", dataframe, period),
+            period,
+        ).select("DateLabel")
+
+        start = perf_counter()
+        parsed_df = calculation_utils.get_date_from_date_label(labelled_df, period)
+        native_time = perf_counter() - start
+
+        for label_df in [labelled_df, rendered_df]:
+            round_trip_df = calculation_utils.get_date_from_date_label(
+                label_df, period
+            ).select(
+                pl.col("DateLabel"),
+                calculation_utils.build_date_label_expr(
+                    pl.col("parsed_date"), period
+                ).alias("labelled"),
+                calculation_utils.build_date_label_from_period_index_expr(
+                    calculation_utils.build_period_index_expr(
+                        pl.col("parsed_date"), period
+                    ),
+                    period,
+                ).alias("rendered"),
+            )
+            if label_df is labelled_df and period == "weekly":
+                # calendar year labels resolve to the monday of their ISO week
+                # number, which may be in the neighbouring year
+                round_trip_expr = pl.col("DateLabel").str.slice(6, 2) == pl.col(
+                    "labelled"
+                ).str.slice(6, 2)
+            else:
+                label_column = "labelled" if label_df is labelled_df else "rendered"
+                round_trip_expr = pl.col("DateLabel") == pl.col(label_column)
+            assert round_trip_df.select(
+                round_trip_expr.all()
+            ).item(), f"round trip failed for {period}"
+
+        per_row_labels = labelled_df.get_column("DateLabel").head(args.per_row_rows)
+        start = perf_counter()
+        per_row_dates = [
+            parse_date_label_per_row(label, period) for label in per_row_labels
+        ]
+        per_row_time = perf_counter() - start
+        assert (
+            per_row_dates
+            == parsed_df.get_column("parsed_date").head(args.per_row_rows).to_list()
+        ), f"parsers differ for {period}"
+
+        native_rate = args.rows / native_time
+        per_row_rate = len(per_row_labels) / per_row_time
+        print(
+            f"{period:>10}: native {native_rate / 1e6:8.2f}M labels/s"
+            f"  per row {per_row_rate / 1e6:8.2f}M labels/s"
+            f"  speedup {native_rate / per_row_rate:8.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
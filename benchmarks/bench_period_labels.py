@@ -0,0 +1,77 @@
+"""Benchmark of the period labelling in calculations.utils.get_time_period_date_label
+
+Compares the native expression labelling against the previous per row pandas
+Timestamp labelling and checks both produce identical labels. The weekly labels
+of both take the ISO year of the week, the previous one took the calendar year.
+
+Run from the repository root:
+    python -m benchmarks.bench_period_labels --rows 2000000
+"""
+
+import argparse
+from datetime import date
+from time import perf_counter
+
+import polars as pl
+from pandas import Timestamp
+
+from benchmarks.common import build_dates_dataframe
+from calculations import utils as calculation_utils
+
+PERIODS = ["daily", "weekly", "monthly", "quarterly"]
+
+
+def get_time_period_date_label_per_row(
+    date_column: str, dataframe: pl.DataFrame, period: str
+):
+    """Previous labelling, one pandas Timestamp per row"""
+    if period == "weekly":
+        label = lambda date: "{:04d}WK{:02d}".format(
+            Timestamp(date).isocalendar()[0], Timestamp(date).week
+        )
+    elif period == "monthly":
+        label = lambda date: "{:04d}M{:02d}({:s})".format(
+            Timestamp(date).year, Timestamp(date).month, Timestamp(date).month_name()
+        )
+    elif period == "quarterly":
+        label = lambda date: "{:04d}Q{:d}".format(
+            Timestamp(date).year, Timestamp(date).quarter
+        )
+    else:
+        label = lambda date: "{:04d}{:02d}{:02d}".format(
+            Timestamp(date).year, Timestamp(date).month, Timestamp(date).day
+        )
+    return dataframe.with_columns(
+        DateLabel=pl.col(date_column).map_elements(label, return_dtype=pl.Utf8)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    dataframe = build_dates_dataframe(args.rows, date(2015, 1, 1), 365 * 10)
+    print(f"rows: {args.rows}")
+    for period in PERIODS:
+        start = perf_counter()
+        per_row_df = get_time_period_date_label_per_row("date", dataframe, period)
+        per_row_time = perf_counter() - start
+
+        start = perf_counter()
+        native_df = calculation_utils.get_time_period_date_label(
+            "date", dataframe, period
+        )
+        native_time = perf_counter() - start
+
+        assert per_row_df.get_column("DateLabel").equals(
+            native_df.get_column("DateLabel")
+        ), f"labels differ for {period}"
+        print(
+            f"{period:>10}: per row {per_row_time:8.3f}s  native {native_time:8.3f}s"
+            f"  speedup {per_row_time / native_time:8.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Benchmark of the subgroup cube in PeriodicSubgroupMetricsTrend
+
+Aggregates every dimension combination up to the rca depth once per combination
+from the rows, and through the cube rolling the coarser combinations up from the
+partials of the maximal ones, and checks both give the same subgroups.
+
+Run from the repository root:
+    python -m benchmarks.bench_subgroup_cube --rows 1000000 --dimensions 12
+"""
+
+import argparse
+from time import perf_counter
+
+from polars.testing import assert_frame_equal
+
+from benchmarks.common import (
+    build_dataframe,
+    build_insight,
+    build_metrics,
+    get_dimensions,
+    quiet,
+)
+from calculations.subgroup_insights.periodic_subgroup_insights_trend import (
+    PeriodicSubgroupMetricsTrend,
+)
+from calculations.trend.periodic_metrics_trend import PeriodicMetricsTrend
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--dimensions", type=int, default=12)
+    parser.add_argument("--depth", type=int, default=3)
+    args = parser.parse_args()
+
+    dataframe = build_dataframe(
+        args.rows, [3 + index % 5 for index in range(args.dimensions)]
+    )
+    dimensions = get_dimensions(dataframe)
+    print(f"rows: {args.rows}  dimensions: {args.dimensions}  depth: {args.depth}")
+    for metric in build_metrics():
+        insight = build_insight(dimensions, args.depth, metric=metric)
+        timings = {}
+        results = {}
+        with quiet():
+            trend_df, filtered_df = PeriodicMetricsTrend().calculate(dataframe, metric)
+            for cube in [False, True]:
+                start = perf_counter()
+                results[cube] = PeriodicSubgroupMetricsTrend(cube=cube).calculate(
+                    trend_df=trend_df,
+                    dataframe=filtered_df,
+                    metric_details=insight,
+                )
+                timings[cube] = perf_counter() - start
+
+        assert_frame_equal(
+            results[False].sort("sub_group"),
+            results[True].sort("sub_group"),
+            rtol=1e-9,
+        )
+        print(
+            f"{metric.name:>20}: per combination {timings[False]:8.3f}s"
+            f"  cube {timings[True]:8.3f}s"
+            f"  speedup {timings[False] / timings[True]:8.1f}x"
+            f"  subgroups {results[True].height}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Benchmark of the cube cache of SegmentSubgroupInsights
+
+Times the subgroups of a segment comparison aggregated through the subgroup cube
+with an empty cube cache, then again for the same insight and for an insight over
+a subset of its dimensions, both reusing the cached partials, and checks the cached
+runs give the subgroups of the uncached ones.
+
+Run from the repository root:
+    python -m benchmarks.bench_subgroup_cube_cache --rows 1000000
+"""
+
+import argparse
+import tempfile
+from time import perf_counter
+
+from polars.testing import assert_frame_equal
+
+from benchmarks.common import build_dataframe, build_insight, get_dimensions, quiet
+from calculations.subgroup_insights.cube_cache import SubgroupCubeCache
+from calculations.subgroup_insights.segment_subgroup_insights import (
+    SegmentSubgroupInsights,
+)
+from calculations.trend.segment_comparision import SegmentComparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--dimensions", type=int, default=6)
+    parser.add_argument("--depth", type=int, default=3)
+    args = parser.parse_args()
+
+    dataframe = build_dataframe(
+        args.rows, [4 + 6 * index for index in range(args.dimensions)], segments=True
+    )
+    dimensions = get_dimensions(dataframe)
+    insights = {
+        "cold": dimensions,
+        "warm": dimensions,
+        "subset": dimensions[: args.dimensions // 2 + 1],
+    }
+    cube_cache = SubgroupCubeCache(spill_dir=tempfile.mkdtemp())
+    print(f"rows: {args.rows}  dimensions: {args.dimensions}  depth: {args.depth}")
+
+    lines = []
+    with quiet():
+        for run, group_by_columns in insights.items():
+            insight = build_insight(group_by_columns, args.depth, segments=True)
+            trend_dfs = SegmentComparison(insights=insight, single_pass=True).calculate(
+                dataframe
+            )
+            timings, results = [], []
+            for calculator in [
+                SegmentSubgroupInsights(insights=insight, cube=True),
+                SegmentSubgroupInsights(
+                    insights=insight, cube=True, cube_cache=cube_cache
+                ),
+            ]:
+                start = perf_counter()
+                result = calculator.calculate(*trend_dfs, data_fingerprint="bench")
+                timings.append(perf_counter() - start)
+                results.append(calculator.subgroup_dictionary.render(result))
+
+            assert_frame_equal(
+                results[0].sort("sub_group"), results[1].sort("sub_group"), rtol=1e-9
+            )
+            lines.append(
+                f"{run:8s} uncached {timings[0]:8.3f}s  cube cache {timings[1]:8.3f}s"
+                f"  speedup {timings[0] / timings[1]:8.1f}x"
+                f"  ({results[1].height} subgroups)"
+            )
+    print("\n".join(lines))
+
+
+if __name__ == "__main__":
+    main()
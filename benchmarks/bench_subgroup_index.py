@@ -0,0 +1,103 @@
+"""Benchmark of the subgroup lookups by dimension value pairs
+
+Looks up the subgroups of random dimension value pairs in a subgroup impact result
+by searching the JSON of the sub_group keys, as the lookups used to, and through
+the SubgroupIndex built once over the result, and checks both give the same rows.
+
+Run from the repository root:
+    python -m benchmarks.bench_subgroup_index --rows 200000 --lookups 200
+"""
+
+import argparse
+import random
+from time import perf_counter
+
+from base.insights import DimensionValuePair
+from benchmarks.common import (
+    build_dataframe,
+    build_insight,
+    build_revenue_metric,
+    get_dimensions,
+    quiet,
+)
+from calculations.subgroup_insights import services as subgroup_trend_services
+from calculations.subgroup_insights.periodic_subgroup_insights_trend import (
+    PeriodicSubgroupMetricsTrend,
+)
+from calculations.trend.periodic_metrics_trend import PeriodicMetricsTrend
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--dimensions", type=int, default=6)
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--lookups", type=int, default=200)
+    args = parser.parse_args()
+
+    dataframe = build_dataframe(
+        args.rows, [3 + 4 * index for index in range(args.dimensions)]
+    )
+    dimensions = get_dimensions(dataframe)
+    metric = build_revenue_metric()
+    insight = build_insight(dimensions, args.depth, metric=metric)
+    with quiet():
+        trend_df, filtered_df = PeriodicMetricsTrend().calculate(dataframe, metric)
+        calculator = PeriodicSubgroupMetricsTrend()
+        subgroup_df = calculator.calculate(
+            trend_df=trend_df, dataframe=filtered_df, metric_details=insight
+        )
+    subgroup_dictionary = calculator.subgroup_dictionary
+    rendered_df = subgroup_dictionary.render(subgroup_df)
+
+    rng = random.Random(0)
+    lookups = []
+    for _ in range(args.lookups):
+        combination = rng.sample(dimensions, rng.randint(1, args.depth))
+        row = dataframe.row(rng.randrange(dataframe.height), named=True)
+        lookups.append(
+            [
+                DimensionValuePair(dimension=dimension, value=row[dimension])
+                for dimension in combination
+            ]
+        )
+    print(
+        f"rows: {args.rows}  subgroups: {subgroup_df.height}"
+        f"  lookups: {args.lookups}"
+    )
+
+    start = perf_counter()
+    json_results = [
+        subgroup_trend_services.apply_filter_on_subgroup_impact_df(
+            rendered_df, dimension_value_pairs
+        )
+        for dimension_value_pairs in lookups
+    ]
+    json_time = perf_counter() - start
+
+    start = perf_counter()
+    subgroup_index = subgroup_trend_services.build_subgroup_index(
+        subgroup_df, subgroup_dictionary
+    )
+    build_time = perf_counter() - start
+    start = perf_counter()
+    index_results = [
+        subgroup_trend_services.apply_filter_on_subgroup_impact_df(
+            subgroup_df, dimension_value_pairs, subgroup_index=subgroup_index
+        )
+        for dimension_value_pairs in lookups
+    ]
+    index_time = perf_counter() - start
+
+    for json_result, index_result in zip(json_results, index_results):
+        assert json_result.height == 1
+        assert subgroup_dictionary.render(index_result).equals(json_result)
+    print(
+        f"json search {json_time:8.3f}s  index build {build_time:8.3f}s"
+        f"  index lookups {index_time:8.3f}s"
+        f"  speedup {json_time / index_time:8.1f}x"
+    )
+
+
+if __name__ == "__main__":
+    main()
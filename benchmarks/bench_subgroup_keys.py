@@ -0,0 +1,79 @@
+"""Benchmark of the sub_group keys of the subgroup insights
+
+Keys the subgroups of every dimension combination up to the rca depth with
+json.dumps of the dimension values of each row, as the subgroups used to be keyed,
+and with the integer keys of SubgroupDictionary, and checks the rendered keys are
+the same JSON.
+
+Run from the repository root:
+    python -m benchmarks.bench_subgroup_keys --rows 200000 --dimensions 6
+"""
+
+import argparse
+import itertools
+import json
+from time import perf_counter
+
+import polars as pl
+
+from benchmarks.common import build_dataframe, get_dimensions
+from calculations.subgroup_insights.subgroup_dictionary import SubgroupDictionary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--dimensions", type=int, default=6)
+    parser.add_argument("--depth", type=int, default=3)
+    args = parser.parse_args()
+
+    dataframe = build_dataframe(
+        args.rows, [5 + 10 * index for index in range(args.dimensions)]
+    )
+    dimensions = get_dimensions(dataframe)
+    combinations = [
+        combination
+        for depth in range(1, args.depth + 1)
+        for combination in itertools.combinations(dimensions, depth)
+    ]
+    subgroup_dfs = [
+        dataframe.select(combination).unique(maintain_order=True)
+        for combination in combinations
+    ]
+    print(
+        f"rows: {args.rows}  dimensions: {args.dimensions}  depth: {args.depth}"
+        f"  subgroups: {sum(subgroup_df.height for subgroup_df in subgroup_dfs)}"
+    )
+
+    start = perf_counter()
+    json_keys = [
+        subgroup_df.select(
+            pl.Series(
+                [json.dumps(item) for item in subgroup_df.to_dicts()], dtype=pl.Utf8
+            ).alias("sub_group")
+        )
+        for subgroup_df in subgroup_dfs
+    ]
+    json_time = perf_counter() - start
+
+    start = perf_counter()
+    subgroup_dictionary = SubgroupDictionary.from_dataframes([dataframe], dimensions)
+    keys = [
+        subgroup_df.select(subgroup_dictionary.build_key_exp(combination))
+        for combination, subgroup_df in zip(combinations, subgroup_dfs)
+    ]
+    key_time = perf_counter() - start
+
+    start = perf_counter()
+    rendered_keys = subgroup_dictionary.render(pl.concat(keys))
+    render_time = perf_counter() - start
+
+    assert rendered_keys.equals(pl.concat(json_keys))
+    print(
+        f"json.dumps {json_time:8.3f}s  integer keys {key_time:8.3f}s"
+        f"  speedup {json_time / key_time:8.1f}x  rendering {render_time:8.3f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
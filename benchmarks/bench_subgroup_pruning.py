@@ -0,0 +1,78 @@
+"""Benchmark of the subgroup pruning of SegmentSubgroupInsights
+
+Times the subgroups of a segment comparison over many dimensions and a deep rca,
+every combination aggregated through the cube, against the apriori pruning of the
+subgroups under a minimum support semi-joined on the same cube partials, and checks
+every subgroup kept by the pruning has the values it has among all the subgroups.
+
+Run from the repository root:
+    python -m benchmarks.bench_subgroup_pruning --rows 200000 --dimensions 12
+"""
+
+import argparse
+from time import perf_counter
+
+import polars as pl
+from polars.testing import assert_frame_equal
+
+from benchmarks.common import build_dataframe, build_insight, get_dimensions, quiet
+from calculations.subgroup_insights.segment_subgroup_insights import (
+    SegmentSubgroupInsights,
+)
+from calculations.trend.segment_comparision import SegmentComparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--dimensions", type=int, default=12)
+    parser.add_argument("--depth", type=int, default=5)
+    parser.add_argument("--support", type=int, default=2_000)
+    args = parser.parse_args()
+
+    dataframe = build_dataframe(
+        args.rows, [3 + index % 5 for index in range(args.dimensions)], segments=True
+    )
+    dimensions = get_dimensions(dataframe)
+    print(
+        f"rows: {args.rows}  dimensions: {args.dimensions}  depth: {args.depth}"
+        f"  support: {args.support}"
+    )
+
+    timings = {}
+    results = {}
+    insights = {
+        "all": build_insight(dimensions, args.depth, segments=True),
+        "pruned": build_insight(
+            dimensions, args.depth, segments=True, min_subgroup_support=args.support
+        ),
+    }
+    with quiet():
+        for run, insight in insights.items():
+            trend_dfs = SegmentComparison(insights=insight, single_pass=True).calculate(
+                dataframe
+            )
+            start = perf_counter()
+            calculator = SegmentSubgroupInsights(insights=insight, cube=True)
+            subgroup_df = calculator.calculate(*trend_dfs)
+            results[run] = calculator.subgroup_dictionary.render(subgroup_df)
+            timings[run] = perf_counter() - start
+
+    pruned_df = results["pruned"].sort("sub_group")
+    assert_frame_equal(
+        results["all"]
+        .filter(pl.col("sub_group").is_in(pruned_df.get_column("sub_group")))
+        .sort("sub_group"),
+        pruned_df,
+        rtol=1e-9,
+    )
+    print(
+        f"all subgroups {timings['all']:8.3f}s ({results['all'].height} rows)"
+        f"  pruned {timings['pruned']:8.3f}s ({pruned_df.height} rows,"
+        f" {insights['pruned'].pruned_subgroups} pruned)"
+        f"  speedup {timings['all'] / timings['pruned']:8.1f}x"
+    )
+
+
+if __name__ == "__main__":
+    main()
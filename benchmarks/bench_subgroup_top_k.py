@@ -0,0 +1,68 @@
+"""Benchmark of the top_k option of SegmentSubgroupInsights
+
+Times the subgroups of a segment comparison up to the records returned by the app,
+every subgroup merged, rendered and converted to dicts, against the top_k option
+keeping the top subgroups while the combinations are aggregated, and checks the
+top_k subgroups are the top of all the subgroups.
+
+Run from the repository root:
+    python -m benchmarks.bench_subgroup_top_k --rows 1000000 --top-k 50
+"""
+
+import argparse
+from time import perf_counter
+
+import polars as pl
+from polars.testing import assert_frame_equal
+
+from benchmarks.common import build_dataframe, build_insight, get_dimensions, quiet
+from calculations.subgroup_insights.segment_subgroup_insights import (
+    SegmentSubgroupInsights,
+)
+from calculations.trend.segment_comparision import SegmentComparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--dimensions", type=int, default=6)
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--top-k", type=int, default=50)
+    args = parser.parse_args()
+
+    dataframe = build_dataframe(
+        args.rows, [4 + 20 * index for index in range(args.dimensions)], segments=True
+    )
+    insight = build_insight(get_dimensions(dataframe), args.depth, segments=True)
+    print(f"rows: {args.rows}  dimensions: {args.dimensions}  top_k: {args.top_k}")
+
+    timings = {}
+    results = {}
+    with quiet():
+        trend_dfs = SegmentComparison(insights=insight, single_pass=True).calculate(
+            dataframe
+        )
+        for top_k in [None, args.top_k]:
+            start = perf_counter()
+            calculator = SegmentSubgroupInsights(insights=insight, top_k=top_k)
+            results[top_k] = calculator.calculate(*trend_dfs)
+            records = calculator.subgroup_dictionary.render(results[top_k]).to_dicts()
+            timings[top_k] = perf_counter() - start
+            del records
+
+    all_subgroups = results[None]
+    expected = all_subgroups.sort(
+        [pl.col("absolute_impact_diff").abs(), pl.col("sub_group")],
+        descending=[True, False],
+        nulls_last=True,
+    ).head(args.top_k)
+    assert_frame_equal(expected, results[args.top_k], rtol=1e-9)
+    print(
+        f"all subgroups {timings[None]:8.3f}s ({all_subgroups.height} rows)"
+        f"  top_k {timings[args.top_k]:8.3f}s ({results[args.top_k].height} rows)"
+        f"  speedup {timings[None] / timings[args.top_k]:8.1f}x"
+    )
+
+
+if __name__ == "__main__":
+    main()
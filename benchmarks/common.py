@@ -0,0 +1,120 @@
+"""Synthetic datasets and insights shared by the benchmarks and the tests"""
+
+import contextlib
+import io
+from datetime import date
+from typing import List, Sequence
+
+import numpy as np
+import polars as pl
+
+from base.general import CombineMethod, Filter, FilterOperator
+from base.insights import MetricsInsight
+from base.metrics import DualColumnMetric, Metric, SingleColumnMetric
+
+
+def build_dataframe(
+    rows: int, cardinalities: Sequence[int], segments: bool = False
+) -> pl.DataFrame:
+    """Rows of random string dimensions dim_0, dim_1... with the given number of
+    distinct values each, revenue and orders measures and a single date
+
+    Args:
+        rows (int): number of rows
+        cardinalities (Sequence[int]): distinct values of each dimension
+        segments (bool, optional): whether to add a segment column, north or south
+    """
+    rng = np.random.default_rng(0)
+    columns = {
+        f"dim_{index}": rng.integers(0, cardinality, rows).astype(str)
+        for index, cardinality in enumerate(cardinalities)
+    }
+    if segments:
+        columns["segment"] = rng.choice(["north", "south"], rows)
+    columns["revenue"] = rng.gamma(2.0, 50.0, rows)
+    columns["orders"] = rng.integers(1, 5, rows)
+    columns["date"] = np.full(rows, np.datetime64("2024-01-01"))
+    return pl.DataFrame(columns)
+
+
+def build_dates_dataframe(rows: int, first_date: date, days: int) -> pl.DataFrame:
+    """Rows of random dates from first_date over the given number of days"""
+    offsets = np.random.default_rng(0).integers(0, days, rows)
+    return pl.DataFrame({"date": offsets}).select(
+        (pl.lit(first_date) + pl.duration(days=pl.col("date"))).alias("date")
+    )
+
+
+def get_dimensions(dataframe: pl.DataFrame) -> List[str]:
+    """Dimension columns of a dataframe from build_dataframe"""
+    return [column for column in dataframe.columns if column.startswith("dim_")]
+
+
+def build_revenue_metric() -> SingleColumnMetric:
+    return SingleColumnMetric(
+        name="revenue", column="revenue", date_column="date", aggregation_method="sum"
+    )
+
+
+def build_metrics() -> List[Metric]:
+    """The revenue, a single column metric, and the revenue per order, a ratio"""
+    return [
+        build_revenue_metric(),
+        DualColumnMetric(
+            name="revenue_per_order",
+            combine_method=CombineMethod.RATIO,
+            numerator_metric=SingleColumnMetric(
+                name="total_revenue",
+                column="revenue",
+                date_column="date",
+                aggregation_method="sum",
+            ),
+            denominator_metric=SingleColumnMetric(
+                name="total_orders",
+                column="orders",
+                date_column="date",
+                aggregation_method="sum",
+            ),
+        ),
+    ]
+
+
+def build_insight(
+    group_by_columns: List[str],
+    max_rca_depth: int,
+    metric: Metric = None,
+    segments: bool = False,
+    **kwargs,
+) -> MetricsInsight:
+    """Insight of the metric, the revenue by default, over the dimensions
+
+    Args:
+        group_by_columns (List[str]): dimensions of the subgroups
+        max_rca_depth (int): maximum number of dimensions of a subgroup
+        metric (Metric, optional): metric of the insight. Defaults to the revenue.
+        segments (bool, optional): whether to compare the north segment, the
+            baseline, with the south one
+        kwargs: extra fields of the MetricsInsight
+    """
+    metric = metric or build_revenue_metric()
+    if segments:
+        kwargs["baseline_segment"] = [
+            Filter(column="segment", operator=FilterOperator.EQ, values=["north"])
+        ]
+        kwargs["comparison_segment"] = [
+            Filter(column="segment", operator=FilterOperator.EQ, values=["south"])
+        ]
+    return MetricsInsight(
+        name=metric.name,
+        metrics=metric,
+        group_by_columns=group_by_columns,
+        max_rca_depth=max_rca_depth,
+        **kwargs,
+    )
+
+
+@contextlib.contextmanager
+def quiet():
+    """Silence the progress the calculators print"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
@@ -0,0 +1,412 @@
+"""Anomalies of the new periods of a trend from the state of the previous periods"""
+
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import polars as pl
+
+from base.metrics_trend import MetricsTrendType
+from calculations.anomaly import matrix as anomaly_matrix
+from calculations.utils import (
+    PERIOD_WINDOW_SIZE,
+    PERIODS_PER_YEAR,
+    build_yoy_period_index_expr,
+)
+from data_source import utils as data_source_utils
+
+ANOMALY_STATE_DIR = os.environ.get(
+    "INSIGHTS_ANOMALY_STATE_DIR", os.path.join(data_source_utils.CACHE_DIR, "anomaly")
+)
+LAST_ROWS_FILE = "last_rows.parquet"
+
+
+def get_state_periods(metric_trend_type: MetricsTrendType) -> int:
+    """Periods kept in the state before the last one, the rolling windows and the
+    periods of the previous year of the next periods never look further back"""
+    return max(
+        max(PERIODS_PER_YEAR[metric_trend_type]),
+        PERIOD_WINDOW_SIZE[metric_trend_type] - 1,
+    )
+
+
+def get_required_state_periods(
+    trend_df: pl.DataFrame, metric_trend_type: MetricsTrendType
+) -> list[int]:
+    """Previous periods whose state the anomalies of the new periods of a trend need,
+    the periods of the rolling windows ending at the first new period and the
+    periods of the previous year of the new periods"""
+    periods = anomaly_matrix.get_period_index(trend_df, metric_trend_type)
+    if periods.size == 0:
+        return []
+    first_period = int(periods.min())
+    window_size = PERIOD_WINDOW_SIZE[metric_trend_type]
+    yoy_periods = (
+        pl.Series("PeriodIndex", np.unique(periods), dtype=pl.Int32)
+        .to_frame()
+        .select(build_yoy_period_index_expr(pl.col("PeriodIndex"), metric_trend_type))
+        .to_series()
+        .drop_nulls()
+    )
+    return sorted(
+        set(range(first_period - window_size + 1, first_period))
+        | {period for period in yoy_periods.to_list() if period < first_period}
+    )
+
+
+def build_empty_state(
+    trend_df: pl.DataFrame, metric_name: str, sub_group: bool = False
+) -> pl.DataFrame:
+    """State of a trend without any previous period"""
+    schema = {}
+    if sub_group:
+        schema["sub_group"] = trend_df.schema["sub_group"]
+    schema["PeriodIndex"] = pl.Int32
+    schema[metric_name] = trend_df.schema[metric_name]
+    for column in [
+        f"{metric_name}_diff",
+        f"{metric_name}_YoY_diff",
+        f"{metric_name}_filled",
+    ]:
+        schema[column] = pl.Float64
+    return pl.DataFrame(schema=schema)
+
+
+def calculate_incremental_anomalies(
+    trend_df: pl.DataFrame,
+    metric_name: str,
+    metric_trend_type: MetricsTrendType,
+    threshold: float,
+    state_df: pl.DataFrame = None,
+    sub_group: bool = False,
+) -> tuple[pl.DataFrame, pl.DataFrame]:
+    """
+    Find the zscore, previous period difference and YoY difference anomalies of the
+    new periods of a trend, the previous periods only known from their state. The
+    state of a period holds per sub_group the metric, the values of the detectors
+    and the metric forward filled, so the work is bound by the new periods and the
+    few previous periods their rolling windows and YoY values look back to, never by
+    the whole history. The anomalies match calculate_matrix_anomalies over the whole
+    history.
+
+    Args:
+        trend_df (pl.DataFrame): new periods of the trend, after the last period of
+            the state, with one row per sub_group and period in any order
+        metric_name (str): name of the metric column
+        metric_trend_type (MetricsTrendType): time period of the trend
+        threshold (float): The z-score threshold over which are considered anomalies
+        state_df (pl.DataFrame, optional): state of the previous periods, at least of
+            get_required_state_periods and the last period of every sub_group, None
+            for the first periods of the trend
+        sub_group (bool, optional): whether the trend holds the subgroups, their
+            sub_group key must identify them across runs
+
+    Returns:
+        the anomalies of the new periods and the state of the new periods
+    """
+    diff_col_name = f"{metric_name}_diff"
+    yoy_col_name = f"{metric_name}_YoY_diff"
+    filled_col_name = f"{metric_name}_filled"
+    if state_df is None:
+        state_df = build_empty_state(trend_df, metric_name, sub_group)
+    if trend_df.height == 0:
+        anomalies_df = anomaly_matrix.calculate_matrix_anomalies(
+            trend_df, metric_name, metric_trend_type, threshold, sub_group
+        )
+        return anomalies_df, state_df.clear()
+
+    periods = anomaly_matrix.get_period_index(trend_df, metric_trend_type)
+    state_periods = state_df.get_column("PeriodIndex").to_numpy().astype(np.int64)
+    if state_df.height and periods.min() <= state_periods.max():
+        raise ValueError(
+            "The periods of the trend should be after the last period of the anomaly "
+            f"state, {state_periods.max()}"
+        )
+
+    if sub_group:
+        rows = (
+            pl.concat(
+                [state_df.get_column("sub_group"), trend_df.get_column("sub_group")]
+            )
+            .rank("dense")
+            .to_numpy()
+            .astype(np.int64)
+            - 1
+        )
+    else:
+        rows = np.zeros(state_df.height + trend_df.height, dtype=np.int64)
+    state_rows, rows = rows[: state_df.height], rows[state_df.height :]
+
+    # the grid spans the new periods and the periods of the windows ending at them
+    window_size = PERIOD_WINDOW_SIZE[metric_trend_type]
+    first_period = periods.min() - (window_size - 1)
+    shape = (
+        int(max(rows.max(), state_rows.max(initial=-1))) + 1,
+        int(periods.max() - first_period) + 1,
+    )
+    cells = rows * shape[1] + periods - first_period
+    in_grid = np.flatnonzero(state_periods >= first_period)
+    state_cells = state_rows[in_grid] * shape[1] + state_periods[in_grid] - first_period
+
+    def build_matrix(
+        new_values: np.ndarray, new_valid: np.ndarray, state_column: str = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        values = np.zeros(shape)
+        valid = np.zeros(shape, dtype=bool)
+        np.put(values, cells, new_values)
+        np.put(valid, cells, new_valid)
+        if state_column is not None:
+            state_series = state_df.get_column(state_column).gather(in_grid)
+            np.put(
+                values,
+                state_cells,
+                state_series.cast(pl.Float64).fill_null(0).to_numpy(),
+            )
+            np.put(valid, state_cells, state_series.is_not_null().to_numpy())
+        return values, valid
+
+    metric = trend_df.get_column(metric_name)
+    metric_values = metric.cast(pl.Float64).fill_null(0).to_numpy()
+    metric_valid = metric.is_not_null().to_numpy()
+    matrices = anomaly_matrix.build_detector_matrices(
+        *build_matrix(metric_values, metric_valid, metric_name),
+        window_size,
+        threshold,
+    )
+
+    # the new periods forward filled from the last filled value of the state
+    last_state_rows = (
+        state_df.with_columns(pl.Series("row", state_rows))
+        .group_by("row")
+        .agg(pl.col(filled_col_name).sort_by("PeriodIndex").last())
+    )
+    seed_values = np.zeros((shape[0], 1))
+    seed_valid = np.zeros((shape[0], 1), dtype=bool)
+    seed_rows = last_state_rows.get_column("row").to_numpy()
+    seed_values[seed_rows, 0] = (
+        last_state_rows.get_column(filled_col_name).fill_null(0).to_numpy()
+    )
+    seed_valid[seed_rows, 0] = (
+        last_state_rows.get_column(filled_col_name).is_not_null().to_numpy()
+    )
+    values, valid = build_matrix(metric_values, metric_valid)
+    present = np.zeros(shape, dtype=bool)
+    np.put(present, cells, True)
+    seeded = (
+        np.hstack([seed_values, values]),
+        np.hstack([seed_valid, valid]),
+    )
+    diff_values, diff_valid = anomaly_matrix.calculate_pct_change(
+        *seeded, np.hstack([np.zeros_like(seed_valid), present])
+    )
+    filled, filled_valid = anomaly_matrix.forward_fill(*seeded)
+    diff_matrix = build_matrix(
+        diff_values[:, 1:].take(cells), diff_valid[:, 1:].take(cells), diff_col_name
+    )
+    matrices[diff_col_name] = diff_matrix
+    matrices.update(
+        anomaly_matrix.build_detector_matrices(
+            *diff_matrix, window_size, threshold, "_diff"
+        )
+    )
+
+    # the rows of the periods of the previous year, in the state or in the trend,
+    # found by a binary search of their sub_group and period
+    all_metric = pl.concat(
+        [state_df.get_column(metric_name).cast(metric.dtype), metric]
+    )
+    all_periods = np.concatenate([state_periods, periods])
+    base_period = all_periods.min()
+    span = int(all_periods.max() - base_period) + 1
+    all_codes = np.concatenate([state_rows, rows]) * span + all_periods - base_period
+    order = np.argsort(all_codes, kind="stable")
+    sorted_codes = all_codes[order]
+    yoy_period_index = anomaly_matrix.build_yoy_period_index(
+        first_period, shape[1], metric_trend_type
+    ).gather(periods - first_period)
+    yoy_periods = yoy_period_index.fill_null(base_period - 1).to_numpy()
+    yoy_codes = rows * span + yoy_periods - base_period
+    positions = np.minimum(np.searchsorted(sorted_codes, yoy_codes), len(order) - 1)
+    found = (yoy_periods >= base_period) & (sorted_codes[positions] == yoy_codes)
+    yoy_rows = np.where(found, order[positions], -1)
+    yoy_metric = all_metric.gather(
+        anomaly_matrix.build_series("yoy_row", yoy_rows, found)
+    )
+    yoy_values = yoy_metric.cast(pl.Float64).fill_null(0).to_numpy()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        yoy_diff = (metric_values - yoy_values) / yoy_values
+    yoy_diff_valid = metric_valid & yoy_metric.is_not_null().to_numpy()
+    yoy_diff_valid &= yoy_values != 0
+    yoy_matrix = build_matrix(yoy_diff, yoy_diff_valid, yoy_col_name)
+    matrices[yoy_col_name] = yoy_matrix
+    matrices.update(
+        anomaly_matrix.build_detector_matrices(
+            *yoy_matrix, window_size, threshold, "_YoY_diff"
+        )
+    )
+
+    anomalies_df = anomaly_matrix.render_anomalies(
+        trend_df,
+        metric_name,
+        metric_trend_type,
+        matrices,
+        cells,
+        yoy_period_index,
+        yoy_metric,
+    )
+
+    # the state of the new periods, with the filled value the next periods are
+    # filled from
+    new_state_df = pl.DataFrame(
+        {
+            **({"sub_group": trend_df.get_column("sub_group")} if sub_group else {}),
+            "PeriodIndex": pl.Series(periods, dtype=pl.Int32),
+            metric_name: metric,
+            diff_col_name: anomalies_df.get_column(diff_col_name),
+            yoy_col_name: anomalies_df.get_column(yoy_col_name),
+            filled_col_name: anomaly_matrix.build_series(
+                filled_col_name,
+                filled[:, 1:].take(cells),
+                filled_valid[:, 1:].take(cells),
+            ),
+        }
+    )
+    return anomalies_df, new_state_df
+
+
+class AnomalyStateStore:
+    """Store of the states of the incremental anomalies. The state of a trend is a
+    directory of a Parquet file per period, of the last year of periods, and a file
+    of the last row of every sub_group, written last so a state is only extended by
+    periods whose files are complete."""
+
+    def __init__(self, state_dir: str = ANOMALY_STATE_DIR) -> None:
+        self.state_dir = state_dir
+
+    @staticmethod
+    def get_key(
+        prefix: str,
+        metric_name: str,
+        metric: dict,
+        metric_trend_type: MetricsTrendType,
+        sub_group: bool = False,
+    ) -> str:
+        """Key of the state of a trend
+
+        Args:
+            prefix (str): identifier of the data the trend is computed from
+            metric_name (str): name of the metric column
+            metric (dict): JSON dump of the metric of the trend
+            metric_trend_type (MetricsTrendType): time period of the trend
+            sub_group (bool, optional): whether the trend holds the subgroups
+        """
+        key = json.dumps(
+            [prefix, metric_name, metric, metric_trend_type, sub_group], sort_keys=True
+        )
+        return hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+
+    def get_state_dir(self, key: str) -> str:
+        """Directory of the files of a state"""
+        return os.path.join(self.state_dir, key)
+
+    def get_period_file(self, key: str, period: int) -> str:
+        """Path of the Parquet file of the state of a period"""
+        return os.path.join(self.get_state_dir(key), f"{period}.parquet")
+
+    def get_last_rows_file(self, key: str) -> str:
+        """Path of the Parquet file of the last row of every sub_group"""
+        return os.path.join(self.get_state_dir(key), LAST_ROWS_FILE)
+
+    def load(self, key: str, periods: list[int]) -> pl.DataFrame | None:
+        """Load the state of the periods of a key and the last row of every sub_group,
+        None when no state was saved
+
+        Args:
+            key (str): state key from get_key
+            periods (list[int]): periods of the state, from get_required_state_periods
+        """
+        try:
+            last_rows_df = pl.read_parquet(self.get_last_rows_file(key))
+        except FileNotFoundError:
+            return None
+        last_period = last_rows_df.get_column("PeriodIndex").max()
+        period_dfs = []
+        for period in periods:
+            if last_period is None or period > last_period:
+                continue
+            try:
+                period_dfs.append(pl.read_parquet(self.get_period_file(key, period)))
+            except FileNotFoundError:
+                # no sub_group has a row in the period
+                continue
+        keys = [
+            column
+            for column in ("sub_group", "PeriodIndex")
+            if column in last_rows_df.columns
+        ]
+        return pl.concat(period_dfs + [last_rows_df], how="vertical_relaxed").unique(
+            subset=keys, keep="first", maintain_order=True
+        )
+
+    def save(
+        self, key: str, state_df: pl.DataFrame, metric_trend_type: MetricsTrendType
+    ):
+        """Extend the state of a key with the state of new periods and evict the
+        periods the next periods do not look back to
+
+        Args:
+            key (str): state key from get_key
+            state_df (pl.DataFrame): state of the new periods from
+                calculate_incremental_anomalies
+            metric_trend_type (MetricsTrendType): time period of the trend
+        """
+        if state_df.height == 0:
+            return
+        state_dir = self.get_state_dir(key)
+        os.makedirs(state_dir, exist_ok=True)
+        keep_from = state_df.get_column("PeriodIndex").max() - get_state_periods(
+            metric_trend_type
+        )
+        for (period,), period_df in (
+            state_df.filter(pl.col("PeriodIndex") >= keep_from)
+            .partition_by("PeriodIndex", as_dict=True, maintain_order=False)
+            .items()
+        ):
+            data_source_utils.write_file_atomic(
+                self.get_period_file(key, period), period_df.write_parquet
+            )
+
+        last_rows_file = self.get_last_rows_file(key)
+        state_df = state_df.sort("PeriodIndex")
+        if os.path.isfile(last_rows_file):
+            state_df = pl.concat(
+                [pl.read_parquet(last_rows_file), state_df], how="vertical_relaxed"
+            )
+        if "sub_group" in state_df.columns:
+            last_rows_df = state_df.unique(
+                subset="sub_group", keep="last", maintain_order=True
+            )
+        else:
+            last_rows_df = state_df.tail(1)
+        data_source_utils.write_file_atomic(last_rows_file, last_rows_df.write_parquet)
+
+        for file_name in os.listdir(state_dir):
+            period = file_name.removesuffix(".parquet")
+            if period.lstrip("-").isdigit() and int(period) < keep_from:
+                try:
+                    os.remove(os.path.join(state_dir, file_name))
+                except FileNotFoundError:
+                    pass
+
+    def delete(self, key: str):
+        """Delete the state of a key, the next periods start a new trend
+
+        Args:
+            key (str): state key from get_key
+        """
+        shutil.rmtree(self.get_state_dir(key), ignore_errors=True)
+
+
+anomaly_state_store = AnomalyStateStore()
@@ -0,0 +1,367 @@
+"""Anomaly detectors over the trend pivoted into a dense subgroups x periods matrix"""
+
+import os
+
+import numpy as np
+import polars as pl
+
+from base.metrics_trend import MetricsTrendType
+from calculations.anomaly import repository as anomaly_repository
+from calculations.anomaly.utils import build_yoy_time_expr
+from calculations.utils import (
+    PERIOD_WINDOW_SIZE,
+    build_period_index_expr,
+    build_yoy_period_index_expr,
+    get_date_from_date_label,
+    get_time_column,
+)
+
+# cells of the subgroups x periods matrix over which the matrix engine refuses the
+# trend, the detectors hold about 15 matrices of 8 bytes per cell
+ANOMALY_MATRIX_MAX_CELLS = int(
+    os.environ.get("INSIGHTS_ANOMALY_MATRIX_MAX_CELLS", 10_000_000)
+)
+
+
+def get_period_index(
+    trend_df: pl.DataFrame, metric_trend_type: MetricsTrendType
+) -> np.ndarray:
+    """Period index of every row, parsed from the DateLabel when the trend has no
+    PeriodIndex"""
+    if "PeriodIndex" in trend_df.columns:
+        return trend_df.get_column("PeriodIndex").to_numpy().astype(np.int64)
+    return (
+        get_date_from_date_label(trend_df.select("DateLabel"), metric_trend_type)
+        .select(build_period_index_expr(pl.col("parsed_date"), metric_trend_type))
+        .to_series()
+        .to_numpy()
+        .astype(np.int64)
+    )
+
+
+def build_series(name: str, values: np.ndarray, valid: np.ndarray) -> pl.Series:
+    """Series of the values, null where they are not valid"""
+    series = pl.Series(name, values)
+    invalid = np.flatnonzero(~valid)
+    if invalid.size:
+        series = series.scatter(invalid, None)
+    return series
+
+
+def calculate_rolling_mean_stddev(
+    values: np.ndarray, valid: np.ndarray, window_size: int
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Rolling mean and sample standard deviation along the periods of every
+    subgroup, summed over the lags of the window as the fused polars pipeline does.
+    A window is valid when it holds window_size valid values, a gap of the period
+    grid invalidates the windows over it.
+
+    Args:
+        values (np.ndarray): subgroups x periods values, anything where not valid
+        valid (np.ndarray): subgroups x periods mask of the valid values
+        window_size (int): periods of the window ending at each period
+
+    Returns:
+        rolling mean, rolling standard deviation and the mask of the valid windows
+    """
+    n_periods = values.shape[1]
+    mean = np.zeros_like(values)
+    stddev = np.zeros_like(values)
+    window_valid = np.zeros_like(valid)
+    if n_periods < window_size:
+        return mean, stddev, window_valid
+
+    # the periods ending a full window, and the periods lag periods before them
+    end = slice(window_size - 1, None)
+    lags = [slice(window_size - 1 - lag, n_periods - lag) for lag in range(window_size)]
+    total = values[:, lags[0]].copy()
+    window_valid[:, end] = valid[:, lags[0]]
+    for lag in lags[1:]:
+        total += values[:, lag]
+        window_valid[:, end] &= valid[:, lag]
+    # polars divides by a literal as a product with its inverse
+    mean[:, end] = total * (1 / window_size)
+
+    with np.errstate(invalid="ignore"):
+        squared_deviation = np.square(values[:, lags[0]] - mean[:, end])
+        deviation = np.empty_like(squared_deviation)
+        for lag in lags[1:]:
+            np.subtract(values[:, lag], mean[:, end], out=deviation)
+            squared_deviation += np.square(deviation, out=deviation)
+        np.multiply(squared_deviation, 1 / (window_size - 1), out=squared_deviation)
+        np.sqrt(squared_deviation, out=stddev[:, end])
+    return mean, stddev, window_valid
+
+
+def calculate_z_score(
+    values: np.ndarray,
+    mean: np.ndarray,
+    stddev: np.ndarray,
+    window_valid: np.ndarray,
+) -> np.ndarray:
+    """Z-score of the values, 0 where the standard deviation is null or 0 as
+    build_z_score_agg_expr"""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(window_valid & (stddev != 0), (values - mean) / stddev, 0.0)
+
+
+def calculate_anomaly_flags(z_score: np.ndarray, threshold: float) -> np.ndarray:
+    """Tag the z-scores beyond threshold as tag_polars_anomalies, which orders NaN
+    above any value so a NaN z-score is over the threshold"""
+    return (z_score > threshold) | (z_score < -threshold) | np.isnan(z_score)
+
+
+def forward_fill(
+    values: np.ndarray, valid: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """Forward fill the values along the periods of every subgroup
+
+    Returns:
+        filled values and the mask of the valid ones, invalid before the first
+        valid value
+    """
+    filled_period = np.where(valid, np.arange(values.shape[1]), -1)
+    np.maximum.accumulate(filled_period, axis=1, out=filled_period)
+    filled = np.take_along_axis(values, np.maximum(filled_period, 0), axis=1)
+    return filled, filled_period >= 0
+
+
+def calculate_pct_change(
+    values: np.ndarray, valid: np.ndarray, present: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """Percentage change from the previous row of every subgroup, the null values
+    forward filled as pct_change does and the infinite changes nulled
+
+    Args:
+        values (np.ndarray): subgroups x periods values, anything where not valid
+        valid (np.ndarray): subgroups x periods mask of the valid values
+        present (np.ndarray): subgroups x periods mask of the periods with a row
+
+    Returns:
+        percentage change and the mask of the valid ones, only on rows
+    """
+    filled, filled_valid = forward_fill(values, valid)
+    pct_change = np.zeros_like(values)
+    pct_change_valid = np.zeros_like(valid)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pct_change[:, 1:] = (filled[:, 1:] - filled[:, :-1]) / filled[:, :-1]
+    pct_change_valid[:, 1:] = (
+        present[:, 1:]
+        & filled_valid[:, 1:]
+        & filled_valid[:, :-1]
+        & ~np.isinf(pct_change[:, 1:])
+    )
+    return pct_change, pct_change_valid
+
+
+def build_detector_matrices(
+    values: np.ndarray,
+    valid: np.ndarray,
+    window_size: int,
+    threshold: float,
+    suffix: str = "",
+) -> dict[str, tuple[np.ndarray, np.ndarray | None]]:
+    """Rolling statistics, z-score and anomaly flags of the values of a detector
+
+    Args:
+        values (np.ndarray): subgroups x periods values, anything where not valid
+        valid (np.ndarray): subgroups x periods mask of the valid values
+        window_size (int): periods of the rolling window
+        threshold (float): The z-score threshold over which are considered anomalies
+        suffix (str, optional): suffix of the columns of the detector
+
+    Returns:
+        matrix and mask of the valid cells, None when all are, by column name
+    """
+    mean, stddev, window_valid = calculate_rolling_mean_stddev(
+        values, valid, window_size
+    )
+    z_score = calculate_z_score(values, mean, stddev, window_valid)
+    return {
+        f"rolling_mean{suffix}": (mean, window_valid),
+        f"rolling_stddev{suffix}": (stddev, window_valid),
+        f"z_score{suffix}": (z_score, None),
+        f"is_anomalous{suffix}": (calculate_anomaly_flags(z_score, threshold), None),
+    }
+
+
+def build_yoy_period_index(
+    first_period: int, n_periods: int, metric_trend_type: MetricsTrendType
+) -> pl.Series:
+    """PeriodIndexYoY of the periods of a grid, null where the period does not exist
+    in the previous year"""
+    return (
+        pl.Series("PeriodIndex", np.arange(n_periods) + first_period, dtype=pl.Int32)
+        .to_frame()
+        .select(
+            build_yoy_period_index_expr(pl.col("PeriodIndex"), metric_trend_type)
+            .cast(pl.Int32)
+            .alias("PeriodIndexYoY")
+        )
+        .to_series()
+    )
+
+
+def render_anomalies(
+    trend_df: pl.DataFrame,
+    metric_name: str,
+    metric_trend_type: MetricsTrendType,
+    matrices: dict[str, tuple[np.ndarray, np.ndarray | None]],
+    cells: np.ndarray,
+    yoy_period_index: pl.Series,
+    yoy_metric: pl.Series,
+) -> pl.DataFrame:
+    """Add the anomaly columns of the cells of the rows of the trend, in the order of
+    calculate_polars_anomalies
+
+    Args:
+        trend_df (pl.DataFrame): trend the anomalies are found on
+        metric_name (str): name of the metric column
+        metric_trend_type (MetricsTrendType): time period of the trend
+        matrices (dict): matrix and mask of the valid cells of the anomaly columns
+        cells (np.ndarray): cell of every row of the trend in the flattened matrices
+        yoy_period_index (pl.Series): PeriodIndexYoY of every row
+        yoy_metric (pl.Series): metric value in the period of the previous year of
+            every row
+    """
+    time_column = get_time_column(trend_df)
+    anomaly_series = [
+        (
+            pl.Series(name, matrix.take(cells))
+            if matrix_valid is None
+            else build_series(name, matrix.take(cells), matrix_valid.take(cells))
+        )
+        for name, (matrix, matrix_valid) in matrices.items()
+    ]
+    anomaly_series.append(yoy_metric.alias(f"{metric_name}_YoY"))
+    if time_column == "PeriodIndex":
+        anomaly_series.append(yoy_period_index.alias("PeriodIndexYoY"))
+
+    anomalies_df = trend_df.with_columns(anomaly_series)
+    if time_column != "PeriodIndex":
+        anomalies_df = anomalies_df.with_columns(
+            build_yoy_time_expr(time_column, metric_trend_type).alias(
+                f"{time_column}YoY"
+            )
+        )
+    anomaly_columns = anomaly_repository.get_anomaly_columns(metric_name, time_column)
+    trend_columns = [
+        column for column in trend_df.columns if column not in anomaly_columns
+    ]
+    return anomalies_df.select(trend_columns + anomaly_columns)
+
+
+def calculate_matrix_anomalies(
+    trend_df: pl.DataFrame,
+    metric_name: str,
+    metric_trend_type: MetricsTrendType,
+    threshold: float,
+    sub_group: bool = False,
+    flagged_only: bool = False,
+) -> pl.DataFrame:
+    """
+    Find the zscore, previous period difference and YoY difference anomalies over
+    the trend pivoted into a dense subgroups x periods matrix, every detector being
+    a few numpy operations over the whole matrix. The columns match
+    calculate_polars_anomalies.
+
+    The periods missing from a subgroup are gaps of the matrix: the rolling windows
+    span periods rather than rows, a window over a gap is null, and the YoY value is
+    the one of the same period of the previous year. On a trend with a row for
+    every period of every subgroup the anomalies match calculate_polars_anomalies.
+    A trend over ANOMALY_MATRIX_MAX_CELLS cells raises a ValueError.
+
+    Args:
+        trend_df (pl.DataFrame): trend with one row per sub_group and period, in
+            any order
+        metric_name (str): name of the metric column
+        metric_trend_type (MetricsTrendType): time period of the trend
+        threshold (float): The z-score threshold over which are considered anomalies
+        sub_group (bool, optional): whether the trend holds the subgroups
+        flagged_only (bool, optional): only return the rows tagged by a detector
+    """
+    periods = get_period_index(trend_df, metric_trend_type)
+    if sub_group:
+        rows = (
+            trend_df.select(pl.col("sub_group").rank("dense") - 1)
+            .to_series()
+            .to_numpy()
+            .astype(np.int64)
+        )
+    else:
+        rows = np.zeros(trend_df.height, dtype=np.int64)
+    first_period = periods.min() if periods.size else 0
+    columns = periods - first_period
+    shape = (
+        int(rows.max(initial=-1)) + 1,
+        int(columns.max(initial=-1)) + 1,
+    )
+    if shape[0] * shape[1] > ANOMALY_MATRIX_MAX_CELLS:
+        # the polars engine windows over rows rather than periods, falling back to
+        # it would change the anomalies of the gapped subgroups with the trend size
+        raise ValueError(
+            f"The trend spans {shape[0]} x {shape[1]} subgroups x periods, over the "
+            f"{ANOMALY_MATRIX_MAX_CELLS} cells of the matrix engine, use the "
+            "polars engine or raise INSIGHTS_ANOMALY_MATRIX_MAX_CELLS"
+        )
+
+    # cells of the rows of the trend in the flattened matrix, and rows of the trend
+    # in the matrix, -1 in the gaps of the period grid
+    cells = rows * shape[1] + columns
+    row_at = np.full(shape, -1, dtype=np.int64)
+    np.put(row_at, cells, np.arange(trend_df.height))
+    present = row_at >= 0
+    metric = trend_df.get_column(metric_name)
+    values = np.zeros(shape)
+    np.put(values, cells, metric.cast(pl.Float64).fill_null(0).to_numpy())
+    valid = np.zeros(shape, dtype=bool)
+    np.put(valid, cells, metric.is_not_null().to_numpy())
+    window_size = PERIOD_WINDOW_SIZE[metric_trend_type]
+    matrices = build_detector_matrices(values, valid, window_size, threshold)
+    diff_values, diff_valid = calculate_pct_change(values, valid, present)
+    matrices[f"{metric_name}_diff"] = (diff_values, diff_valid)
+    matrices.update(
+        build_detector_matrices(
+            diff_values, diff_valid, window_size, threshold, "_diff"
+        )
+    )
+
+    # the period of the previous year of every period of the grid, -1 before it
+    yoy_period_index = build_yoy_period_index(first_period, shape[1], metric_trend_type)
+    yoy_columns = (yoy_period_index - first_period).fill_null(-1).to_numpy()
+    yoy_columns = np.where(yoy_columns >= 0, yoy_columns, -1)
+    in_grid = yoy_columns >= 0
+    yoy_row_at = np.where(in_grid, row_at[:, np.maximum(yoy_columns, 0)], -1)
+    yoy_values = values[:, np.maximum(yoy_columns, 0)]
+    yoy_valid = valid[:, np.maximum(yoy_columns, 0)] & in_grid
+    with np.errstate(divide="ignore", invalid="ignore"):
+        yoy_diff = (values - yoy_values) / yoy_values
+    yoy_diff_valid = valid & yoy_valid & (yoy_values != 0)
+    matrices[f"{metric_name}_YoY_diff"] = (yoy_diff, yoy_diff_valid)
+    matrices.update(
+        build_detector_matrices(
+            yoy_diff, yoy_diff_valid, window_size, threshold, "_YoY_diff"
+        )
+    )
+
+    if flagged_only:
+        flagged = (
+            matrices["is_anomalous"][0]
+            | matrices["is_anomalous_diff"][0]
+            | matrices["is_anomalous_YoY_diff"][0]
+        )
+        keep = np.flatnonzero(flagged.take(cells))
+        trend_df = trend_df[keep]
+        cells = cells[keep]
+        columns = columns[keep]
+
+    yoy_rows = yoy_row_at.take(cells)
+    return render_anomalies(
+        trend_df,
+        metric_name,
+        metric_trend_type,
+        matrices,
+        cells,
+        yoy_period_index.gather(columns),
+        metric.gather(build_series("yoy_row", yoy_rows, yoy_rows >= 0)),
+    )
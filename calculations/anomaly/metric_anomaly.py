@@ -2,12 +2,15 @@
 
 import polars as pl
 
-from base.anomaly import Anomaly
+from base.anomaly import Anomaly, AnomalyDetector, AnomalyEngine, YoYMethod
 from base.general import ProcessingType
 from base.insights import MetricsInsight
 from base.metrics import Metric
 from base.metrics_trend import MetricsTrendType
+from calculations import utils as calculation_utils
+from calculations.anomaly import incremental as anomaly_incremental
 from calculations.anomaly import services as anomaly_services
+from calculations.anomaly.incremental import AnomalyStateStore, anomaly_state_store
 
 
 class MetricAnomaly(Anomaly):
@@ -15,10 +18,21 @@ class MetricAnomaly(Anomaly):
         self,
         processing_type: ProcessingType = "in_memory",
         time_intervals: int = None,
+        yoy_method: YoYMethod = "search",
+        engine: AnomalyEngine = "polars",
+        state_store: AnomalyStateStore = anomaly_state_store,
     ) -> None:
         super().__init__()
         self.processing_type = processing_type
         self.time_intervals = time_intervals
+        # the shift method needs a row for every period of every subgroup, the
+        # search finds the periods across gaps as the join does, without joining
+        self.yoy_method = yoy_method
+        # the matrix engine pivots the subgroups into a subgroups x periods matrix,
+        # it raises a ValueError over ANOMALY_MATRIX_MAX_CELLS cells
+        self.engine = engine
+        # states of the trends of calculate_incremental
+        self.state_store = state_store
 
     def calculate(
         self,
@@ -27,6 +41,7 @@ class MetricAnomaly(Anomaly):
         metric_trend_type: str,
         metric_details: MetricsInsight,
         threshold=1.0,
+        detector: AnomalyDetector = "zscore",
     ) -> dict[str, pl.DataFrame]:
         """
         Calculate the anomalies based on z-score
@@ -36,32 +51,27 @@ class MetricAnomaly(Anomaly):
             trend_df (polars.DataFrame): The trend df calculated using the metric and the period
             metric (SingleColumnMetric|DualColumnMetric): The metric to find anomalies on
             threshold (float): The z-score threshold over which are considered anomalies
+            detector (AnomalyDetector, optional): center and scale the z-scores
+                standardize the values with, the rolling mean and standard deviation,
+                the rolling median and median absolute deviation, the
+                exponentially weighted mean and standard deviation or the seasonal
+                baseline and standard deviation of the residuals
         """
 
-        trend_df = trend_df.sort(["DateLabel"], descending=False)
-
-        trend_df = anomaly_services.calculate_anomaly(
-            trend_df,
-            metric_details.name,
-            metric_trend_type,
-            threshold,
-            self.processing_type,
+        trend_df = trend_df.sort(
+            [calculation_utils.get_time_column(trend_df)], descending=False
         )
 
-        trend_df = anomaly_services.calculate_row_diff_anomaly(
-            trend_df,
-            metric_details.name,
-            metric_trend_type,
-            threshold,
-            self.processing_type,
-        )
-
-        trend_df = anomaly_services.calculate_yoy_diff_anomaly(
+        # the three detectors run as one fused pipeline
+        trend_df = anomaly_services.calculate_anomalies(
             trend_df,
             metric_details.name,
             metric_trend_type,
             threshold,
             self.processing_type,
+            yoy_method=self.yoy_method,
+            engine=self.engine,
+            detector=detector,
         )
 
         return trend_df
@@ -72,41 +82,89 @@ class MetricAnomaly(Anomaly):
         metric_trend_type: MetricsTrendType,
         metric_details: MetricsInsight,
         threshold=1.0,
+        flagged_only: bool = False,
+        detector: AnomalyDetector = "zscore",
     ):
         """
         Calculate anomalies based on z-score for subgroups
+
+        Args:
+            subgroup_df (polars.DataFrame): The trend of the subgroups
+            metric_trend_type (MetricsTrendType): time period of the trend
+            metric_details (MetricsInsight): The insight of the metric
+            threshold (float): The z-score threshold over which are considered anomalies
+            flagged_only (bool, optional): only return the rows tagged as anomalous
+            detector (AnomalyDetector, optional): center and scale the z-scores
+                standardize the values with, as in calculate
         """
 
         # sort based on subgroup and datelabel
         subgroup_df = subgroup_df.sort(
-            ["sub_group", "DateLabel"], descending=[False, False]
+            ["sub_group", calculation_utils.get_time_column(subgroup_df)],
+            descending=[False, False],
         )
 
-        subgroup_df = anomaly_services.calculate_anomaly(
+        subgroup_df = anomaly_services.calculate_anomalies(
             subgroup_df,
             metric_details.name,
             metric_trend_type,
             threshold,
             self.processing_type,
             True,
+            yoy_method=self.yoy_method,
+            engine=self.engine,
+            flagged_only=flagged_only,
+            detector=detector,
         )
 
-        subgroup_df = anomaly_services.calculate_row_diff_anomaly(
-            subgroup_df,
+        return subgroup_df
+
+    def calculate_incremental(
+        self,
+        trend_df: pl.DataFrame,
+        metric_trend_type: MetricsTrendType,
+        metric_details: MetricsInsight,
+        data_key: str,
+        threshold=1.0,
+        sub_group: bool = False,
+    ):
+        """
+        Calculate anomalies based on z-score for the new periods of a trend only, from
+        the state of its previous periods in the state store, updated with them
+
+        Args:
+            trend_df (polars.DataFrame): The new periods of the trend, after the
+                periods of the previous calls
+            metric_trend_type (MetricsTrendType): time period of the trend
+            metric_details (MetricsInsight): The insight of the metric
+            data_key (str): identifier of the data the trend is computed from, the
+                states of different data are kept apart
+            threshold (float): The z-score threshold over which are considered anomalies
+            sub_group (bool, optional): whether the trend holds the subgroups, their
+                sub_group key must identify them across calls, as the keys rendered
+                by the SubgroupDictionary do
+        """
+        state_key = self.state_store.get_key(
+            data_key,
             metric_details.name,
+            metric_details.metrics.model_dump(mode="json"),
             metric_trend_type,
-            threshold,
-            self.processing_type,
-            True,
+            sub_group,
         )
-
-        subgroup_df = anomaly_services.calculate_yoy_diff_anomaly(
-            subgroup_df,
+        anomalies_df, state_df = anomaly_services.calculate_incremental_anomalies(
+            trend_df,
             metric_details.name,
             metric_trend_type,
             threshold,
             self.processing_type,
-            True,
+            self.state_store.load(
+                state_key,
+                anomaly_incremental.get_required_state_periods(
+                    trend_df, metric_trend_type
+                ),
+            ),
+            sub_group,
         )
+        self.state_store.save(state_key, state_df, metric_trend_type)
 
-        return subgroup_df
+        return anomalies_df
@@ -1,14 +1,37 @@
 import polars as pl
 
+from base.anomaly import AnomalyDetector, YoYMethod
 from base.metrics import Metric
 from base.metrics_trend import MetricsTrendType
 from calculations.anomaly.utils import (
+    build_ewm_mean_agg_expr,
+    build_ewm_stddev_agg_expr,
     build_pct_change_agg_expr,
     build_rolling_mean_agg_expr,
     build_rolling_stddev_agg_expr,
+    build_search_yoy_value_expr,
+    build_season_expr,
+    build_seasonal_mean_agg_expr,
+    build_shift_yoy_value_expr,
+    build_sorted_window_mad_expr,
+    build_sorted_window_median_expr,
+    build_sorted_window_stages,
+    build_sub_group_pct_change_agg_expr,
+    build_sub_group_rolling_mean_agg_expr,
+    build_sub_group_rolling_stddev_agg_expr,
+    build_sub_group_season_expr,
+    build_yoy_time_expr,
     build_z_score_agg_expr,
 )
-from calculations.utils import PERIOD_WINDOW_SIZE
+from calculations.utils import PERIOD_WINDOW_SIZE, get_time_column
+
+# columns of the center and scale of the values of each detector
+DETECTOR_COLUMNS = {
+    AnomalyDetector.ZSCORE: ("rolling_mean", "rolling_stddev"),
+    AnomalyDetector.MAD: ("rolling_median", "rolling_mad"),
+    AnomalyDetector.EWMA: ("ewm_mean", "ewm_stddev"),
+    AnomalyDetector.SEASONAL: ("seasonal_baseline", "seasonal_stddev"),
+}
 
 
 def calculate_polars_anomaly(
@@ -67,7 +90,7 @@ def calculate_polars_rowdiff_anomaly(
         pl.when(pl.col(diff_col_name).is_infinite())
         .then(None)
         .otherwise(pl.col(diff_col_name))
-        .keep_name()
+        .name.keep()
     )
 
     # calculate rolling mean and rolling stddev for previous period difference
@@ -95,32 +118,181 @@ def calculate_polars_rowdiff_anomaly(
     return trend_df, z_score_col
 
 
-def calculate_polars_yoy_diff_anomaly(
-    trend_df: pl.DataFrame,
+def add_polars_yoy_values(
+    trend_df: pl.DataFrame | pl.LazyFrame,
     metric_name: str,
     metric_trend_type: str,
     sub_group: bool = False,
+    yoy_method: YoYMethod = "join",
 ):
+    """
+    Add the period of the previous year of every row and the metric value in that
+    period, suffixed YoY
+
+    Args:
+        trend_df (pl.DataFrame | pl.LazyFrame): trend sorted by time, by sub_group
+            first for subgroups
+        metric_name (str): name of the metric column
+        metric_trend_type (str): time period of the trend
+        sub_group (bool, optional): whether the trend holds the subgroups
+        yoy_method (YoYMethod, optional): join the trend to itself on the period of
+            the previous year, shift the trend by the periods of a year when
+            every sub_group has a row for every period, or search the period of
+            the previous year in the sorted trend
+    """
+    time_column = get_time_column(trend_df)
+    yoy_time_column = f"{time_column}YoY"
     trend_df = trend_df.with_columns(
-        pl.col("DateLabel")
-        .apply(lambda x: f"{int(x[:4])-1}{x[4:]}")
-        .alias("DateLabelYoY")
+        build_yoy_time_expr(time_column, metric_trend_type).alias(yoy_time_column)
+    )
+
+    if yoy_method == YoYMethod.SHIFT:
+        return trend_df.with_columns(
+            build_shift_yoy_value_expr(
+                metric_name,
+                time_column,
+                yoy_time_column,
+                metric_trend_type,
+                sub_group,
+            ).alias(f"{metric_name}_YoY")
+        )
+    elif yoy_method == YoYMethod.SEARCH:
+        return trend_df.with_columns(
+            build_search_yoy_value_expr(
+                metric_name, time_column, yoy_time_column, sub_group
+            ).alias(f"{metric_name}_YoY")
+        )
+    elif yoy_method == YoYMethod.JOIN:
+        select_cols = [time_column, metric_name]
+        left_on = [yoy_time_column]
+        right_on = [time_column]
+        if sub_group:
+            select_cols.append("sub_group")
+            left_on.append("sub_group")
+            right_on.append("sub_group")
+
+        return trend_df.join(
+            trend_df.select(select_cols),
+            how="left",
+            left_on=left_on,
+            right_on=right_on,
+            suffix="_YoY",
+        )
+    else:
+        accepted_values = [method.value for method in YoYMethod]
+        raise ValueError(f"yoy_method should be either of {accepted_values}")
+
+
+def add_polars_rolling_median_mad(
+    trend_df: pl.DataFrame | pl.LazyFrame,
+    column_name: str,
+    metric_trend_type: MetricsTrendType,
+    median_col: str,
+    mad_col: str,
+    sub_group: bool = False,
+):
+    """
+    Add the rolling median and median absolute deviation of a column, from the
+    values of each window sorted into temporary columns
+
+    Args:
+        trend_df (pl.DataFrame | pl.LazyFrame): trend sorted by time, by sub_group
+            first for subgroups
+        column_name (str): column of the values
+        metric_trend_type (MetricsTrendType): time period of the trend
+        median_col (str): column of the rolling median
+        mad_col (str): column of the rolling median absolute deviation
+        sub_group (bool, optional): whether the trend holds the subgroups
+    """
+    window_size = PERIOD_WINDOW_SIZE[metric_trend_type]
+    sorted_cols = [f"{median_col}_window_{rank}" for rank in range(window_size)]
+    for stage in build_sorted_window_stages(
+        column_name, window_size, sorted_cols, sub_group
+    ):
+        trend_df = trend_df.with_columns(stage)
+    return (
+        trend_df.with_columns(
+            build_sorted_window_median_expr(sorted_cols).alias(median_col)
+        )
+        .with_columns(
+            build_sorted_window_mad_expr(sorted_cols, median_col).alias(mad_col)
+        )
+        .drop(sorted_cols)
     )
 
-    select_cols = ["DateLabel", metric_name]
-    left_on = ["DateLabelYoY"]
-    right_on = ["DateLabel"]
+
+def add_polars_seasonal_baseline(
+    trend_df: pl.DataFrame | pl.LazyFrame,
+    column_name: str,
+    metric_trend_type: MetricsTrendType,
+    baseline_col: str,
+    stddev_col: str,
+    sub_group: bool = False,
+):
+    """
+    Add the seasonal baseline of a column, its seasonal profile plus the rolling
+    mean of the residuals from the profile, and the rolling standard deviation of
+    the residuals. The z-scores of the values from the baseline are the z-scores of
+    the residuals, so the recurring highs and lows of the seasons are not flagged.
+
+    Args:
+        trend_df (pl.DataFrame | pl.LazyFrame): trend sorted by time, by sub_group
+            first for subgroups
+        column_name (str): column of the values
+        metric_trend_type (MetricsTrendType): time period of the trend
+        baseline_col (str): column of the seasonal baseline
+        stddev_col (str): column of the rolling standard deviation of the residuals
+        sub_group (bool, optional): whether the trend holds the subgroups
+    """
+    season_col = f"{baseline_col}_season"
+    seasonal_col = f"{baseline_col}_seasonal"
+    residual_col = f"{baseline_col}_residual"
+    residual_mean_col = f"{baseline_col}_residual_mean"
+    time_column = get_time_column(trend_df)
     if sub_group:
-        select_cols.append("sub_group")
-        left_on.append("sub_group")
-        right_on.append("sub_group")
+        season_expr = build_sub_group_season_expr(time_column, metric_trend_type)
+    else:
+        season_expr = build_season_expr(time_column, metric_trend_type)
+    trend_df = (
+        trend_df.with_columns(season_expr.alias(season_col))
+        .with_columns(
+            build_seasonal_mean_agg_expr(column_name, season_col).alias(seasonal_col)
+        )
+        .with_columns((pl.col(column_name) - pl.col(seasonal_col)).alias(residual_col))
+    )
+    if sub_group:
+        trend_df = trend_df.with_columns(
+            build_sub_group_rolling_mean_agg_expr(
+                residual_col, metric_trend_type
+            ).alias(residual_mean_col)
+        ).with_columns(
+            build_sub_group_rolling_stddev_agg_expr(
+                residual_col, metric_trend_type, residual_mean_col
+            ).alias(stddev_col)
+        )
+    else:
+        trend_df = trend_df.with_columns(
+            build_rolling_mean_agg_expr(residual_col, metric_trend_type).alias(
+                residual_mean_col
+            ),
+            build_rolling_stddev_agg_expr(residual_col, metric_trend_type).alias(
+                stddev_col
+            ),
+        )
+    return trend_df.with_columns(
+        (pl.col(seasonal_col) + pl.col(residual_mean_col)).alias(baseline_col)
+    ).drop(season_col, seasonal_col, residual_col, residual_mean_col)
+
 
-    trend_df = trend_df.join(
-        trend_df.select(select_cols),
-        how="left",
-        left_on=left_on,
-        right_on=right_on,
-        suffix="_YoY",
+def calculate_polars_yoy_diff_anomaly(
+    trend_df: pl.DataFrame,
+    metric_name: str,
+    metric_trend_type: str,
+    sub_group: bool = False,
+    yoy_method: YoYMethod = "join",
+):
+    trend_df = add_polars_yoy_values(
+        trend_df, metric_name, metric_trend_type, sub_group, yoy_method
     )
 
     yoy_col_name = f"{metric_name}_YoY_diff"
@@ -180,6 +352,216 @@ def tag_polars_anomalies(
     return df
 
 
+def build_polars_anomaly_flag_expr(z_score_col: str, threshold: float) -> pl.Expr:
+    """Build the expression tagging z-score values beyond threshold as true"""
+    return (pl.col(z_score_col) > pl.lit(threshold)) | (
+        pl.col(z_score_col) < pl.lit(-threshold)
+    )
+
+
+def filter_polars_flagged_anomalies(anomalies_df: pl.DataFrame) -> pl.DataFrame:
+    """Keep the rows tagged as anomalous by any of the detectors"""
+    return anomalies_df.filter(
+        pl.any_horizontal("is_anomalous", "is_anomalous_diff", "is_anomalous_YoY_diff")
+    )
+
+
+def get_detector_columns(detector: AnomalyDetector) -> tuple[str, str]:
+    """Columns of the center and scale of the values of a detector"""
+    if detector not in DETECTOR_COLUMNS:
+        accepted_values = [option.value for option in AnomalyDetector]
+        raise ValueError(f"detector should be either of {accepted_values}")
+    return DETECTOR_COLUMNS[detector]
+
+
+def get_anomaly_columns(
+    metric_name: str, time_column: str, detector: AnomalyDetector = "zscore"
+) -> list[str]:
+    """Columns added by the detectors, in the order they add them when run in
+    sequence"""
+    center_col, scale_col = get_detector_columns(detector)
+    return [
+        center_col,
+        scale_col,
+        "z_score",
+        "is_anomalous",
+        f"{metric_name}_diff",
+        f"{center_col}_diff",
+        f"{scale_col}_diff",
+        "z_score_diff",
+        "is_anomalous_diff",
+        f"{time_column}YoY",
+        f"{metric_name}_YoY",
+        f"{metric_name}_YoY_diff",
+        f"{center_col}_YoY_diff",
+        f"{scale_col}_YoY_diff",
+        "z_score_YoY_diff",
+        "is_anomalous_YoY_diff",
+    ]
+
+
+def calculate_polars_anomalies(
+    trend_df: pl.DataFrame | pl.LazyFrame,
+    metric_name: str,
+    metric_trend_type: MetricsTrendType,
+    threshold: float,
+    sub_group: bool = False,
+    yoy_method: YoYMethod = "search",
+    detector: AnomalyDetector = "zscore",
+) -> pl.DataFrame:
+    """
+    Find the zscore, previous period difference and YoY difference anomalies with
+    a single collect. The rolling statistics, z-scores and flags of the three
+    detectors are built as one lazy query instead of a pass per column, the columns
+    match calculate_polars_anomaly, calculate_polars_rowdiff_anomaly and
+    calculate_polars_yoy_diff_anomaly each tagged by tag_polars_anomalies.
+
+    The rolling windows of subgroups are shifts of the rows sorted by sub_group
+    rather than windows over every sub_group, so they match up to rounding. The YoY
+    values are searched in the sorted trend by default rather than joined, the
+    values of the join across gaps in the period grid too.
+
+    The scores of the other detectors standardize the values with the rolling
+    median and median absolute deviation, with the exponentially weighted mean and
+    standard deviation, or with the seasonal baseline and the rolling standard
+    deviation of the residuals from the seasonal profile, their columns named by
+    get_detector_columns.
+
+    Args:
+        trend_df (pl.DataFrame | pl.LazyFrame): trend sorted by time, by sub_group
+            first for subgroups
+        metric_name (str): name of the metric column
+        metric_trend_type (MetricsTrendType): time period of the trend
+        threshold (float): The z-score threshold over which are considered anomalies
+        sub_group (bool, optional): whether the trend holds the subgroups
+        yoy_method (YoYMethod, optional): method of add_polars_yoy_values
+        detector (AnomalyDetector, optional): center and scale the scores
+            standardize the values with
+    """
+    trend_lf = trend_df.lazy()
+    time_column = get_time_column(trend_lf)
+    diff_col_name = f"{metric_name}_diff"
+    yoy_col_name = f"{metric_name}_YoY_diff"
+
+    center_col, scale_col = get_detector_columns(detector)
+
+    if sub_group:
+        pct_change_expr = build_sub_group_pct_change_agg_expr(
+            metric_name, diff_col_name
+        )
+    else:
+        pct_change_expr = build_pct_change_agg_expr(metric_name, diff_col_name)
+
+    def add_center_scale(lf: pl.LazyFrame, column_name: str, suffix: str = ""):
+        if detector == AnomalyDetector.MAD:
+            return add_polars_rolling_median_mad(
+                lf,
+                column_name,
+                metric_trend_type,
+                f"{center_col}{suffix}",
+                f"{scale_col}{suffix}",
+                sub_group,
+            )
+        elif detector == AnomalyDetector.SEASONAL:
+            return add_polars_seasonal_baseline(
+                lf,
+                column_name,
+                metric_trend_type,
+                f"{center_col}{suffix}",
+                f"{scale_col}{suffix}",
+                sub_group,
+            )
+        elif detector == AnomalyDetector.EWMA:
+            return lf.with_columns(
+                build_ewm_mean_agg_expr(
+                    column_name, metric_trend_type, sub_group
+                ).alias(f"{center_col}{suffix}"),
+                build_ewm_stddev_agg_expr(
+                    column_name, metric_trend_type, sub_group
+                ).alias(f"{scale_col}{suffix}"),
+            )
+        if sub_group:
+            return lf.with_columns(
+                build_sub_group_rolling_mean_agg_expr(
+                    column_name, metric_trend_type
+                ).alias(f"{center_col}{suffix}")
+            ).with_columns(
+                build_sub_group_rolling_stddev_agg_expr(
+                    column_name, metric_trend_type, f"{center_col}{suffix}"
+                ).alias(f"{scale_col}{suffix}")
+            )
+        return lf.with_columns(
+            build_rolling_mean_agg_expr(column_name, metric_trend_type).alias(
+                f"{center_col}{suffix}"
+            ),
+            build_rolling_stddev_agg_expr(column_name, metric_trend_type).alias(
+                f"{scale_col}{suffix}"
+            ),
+        )
+
+    # infinite pct changes are nulled before their rolling statistics
+    pct_change_expr = (
+        pl.when(pct_change_expr.is_infinite()).then(None).otherwise(pct_change_expr)
+    )
+    # each with_columns only refers to the columns of the previous ones
+    anomalies_lf = (
+        trend_lf.with_columns(pct_change_expr.alias(diff_col_name))
+        .pipe(add_center_scale, metric_name)
+        .pipe(add_center_scale, diff_col_name, "_diff")
+        .with_columns(
+            build_z_score_agg_expr(metric_name, center_col, scale_col).alias("z_score"),
+            build_z_score_agg_expr(
+                diff_col_name, f"{center_col}_diff", f"{scale_col}_diff"
+            ).alias("z_score_diff"),
+        )
+        .with_columns(
+            build_polars_anomaly_flag_expr("z_score", threshold).alias("is_anomalous"),
+            build_polars_anomaly_flag_expr("z_score_diff", threshold).alias(
+                "is_anomalous_diff"
+            ),
+        )
+        .pipe(
+            add_polars_yoy_values,
+            metric_name,
+            metric_trend_type,
+            sub_group,
+            yoy_method,
+        )
+        .with_columns(
+            pl.when(
+                (pl.col(f"{metric_name}_YoY") == 0)
+                | pl.col(metric_name).is_null()
+                | pl.col(f"{metric_name}_YoY").is_null()
+            )
+            .then(None)
+            .otherwise(
+                (pl.col(metric_name) - pl.col(f"{metric_name}_YoY"))
+                / pl.col(f"{metric_name}_YoY")
+            )
+            .alias(yoy_col_name)
+        )
+        .pipe(add_center_scale, yoy_col_name, "_YoY_diff")
+        .with_columns(
+            build_z_score_agg_expr(
+                yoy_col_name, f"{center_col}_YoY_diff", f"{scale_col}_YoY_diff"
+            ).alias("z_score_YoY_diff")
+        )
+        .with_columns(
+            build_polars_anomaly_flag_expr("z_score_YoY_diff", threshold).alias(
+                "is_anomalous_YoY_diff"
+            )
+        )
+    )
+
+    anomaly_columns = get_anomaly_columns(metric_name, time_column, detector)
+    trend_columns = [
+        column
+        for column in trend_lf.collect_schema().names()
+        if column not in anomaly_columns
+    ]
+    return anomalies_lf.select(trend_columns + anomaly_columns).collect()
+
+
 def calculate_databricks_anomaly(**kwargs):
     kwargs = None
     return kwargs
@@ -195,6 +577,16 @@ def calculate_databricks_yoy_diff_anomaly(**kwargs):
     return kwargs
 
 
+def calculate_databricks_anomalies(**kwargs):
+    kwargs = None
+    return kwargs
+
+
+def calculate_databricks_incremental_anomalies(**kwargs):
+    kwargs = None
+    return kwargs
+
+
 def tag_databricks_anomalies(**kwargs):
     kwargs = None
     return kwargs
@@ -1,7 +1,10 @@
 import polars as pl
 
+from base.anomaly import AnomalyDetector, AnomalyEngine, YoYMethod
 from base.general import ProcessingType
 from base.metrics_trend import MetricsTrendType
+from calculations.anomaly import incremental as anomaly_incremental
+from calculations.anomaly import matrix as anomaly_matrix
 from calculations.anomaly import repository as anomaly_repository
 
 
@@ -58,10 +61,11 @@ def calculate_yoy_diff_anomaly(
     threshold: float,
     processing_type: str,
     sub_group: bool = False,
+    yoy_method: YoYMethod = "join",
 ):
     if processing_type == ProcessingType.IN_MEMORY:
         results, z_score_col = anomaly_repository.calculate_polars_yoy_diff_anomaly(
-            trend_df, metric_name, metric_trend_type, sub_group
+            trend_df, metric_name, metric_trend_type, sub_group, yoy_method
         )
         results = anomaly_repository.tag_polars_anomalies(
             z_score_col, results, threshold, "is_anomalous_YoY_diff"
@@ -75,3 +79,86 @@ def calculate_yoy_diff_anomaly(
         results = anomaly_repository.tag_databricks_anomalies()
 
     return results
+
+
+def calculate_anomalies(
+    trend_df: pl.DataFrame,
+    metric_name,
+    metric_trend_type: MetricsTrendType,
+    threshold: float,
+    processing_type: str,
+    sub_group: bool = False,
+    yoy_method: YoYMethod = "search",
+    engine: AnomalyEngine = "polars",
+    flagged_only: bool = False,
+    detector: AnomalyDetector = "zscore",
+):
+    """Run the zscore, row diff and YoY diff detectors as one fused pipeline, the
+    results match calculate_anomaly, calculate_row_diff_anomaly and
+    calculate_yoy_diff_anomaly run in sequence. The matrix engine finds the YoY
+    values on the period grid, whatever the yoy_method, and only standardizes the
+    values with the rolling mean and standard deviation, the zscore detector."""
+    if processing_type == ProcessingType.IN_MEMORY:
+        if engine == AnomalyEngine.MATRIX:
+            if detector != AnomalyDetector.ZSCORE:
+                raise ValueError(
+                    f"detector should be {AnomalyDetector.ZSCORE.value} with the "
+                    f"{AnomalyEngine.MATRIX.value} engine"
+                )
+            results = anomaly_matrix.calculate_matrix_anomalies(
+                trend_df,
+                metric_name,
+                metric_trend_type,
+                threshold,
+                sub_group,
+                flagged_only,
+            )
+        elif engine == AnomalyEngine.POLARS:
+            results = anomaly_repository.calculate_polars_anomalies(
+                trend_df,
+                metric_name,
+                metric_trend_type,
+                threshold,
+                sub_group,
+                yoy_method,
+                detector,
+            )
+            if flagged_only:
+                results = anomaly_repository.filter_polars_flagged_anomalies(results)
+        else:
+            accepted_values = [option.value for option in AnomalyEngine]
+            raise ValueError(f"engine should be either of {accepted_values}")
+
+    elif processing_type == ProcessingType.DATABRICKS:
+        results = anomaly_repository.calculate_databricks_anomalies()
+
+    return results
+
+
+def calculate_incremental_anomalies(
+    trend_df: pl.DataFrame,
+    metric_name,
+    metric_trend_type: MetricsTrendType,
+    threshold: float,
+    processing_type: str,
+    state_df: pl.DataFrame = None,
+    sub_group: bool = False,
+):
+    """Run the zscore, row diff and YoY diff detectors on the new periods of a trend
+    only, from the state of its previous periods. Returns the anomalies of the new
+    periods and the state of the new periods, the anomalies match calculate_anomalies with
+    the matrix engine over the whole trend."""
+    if processing_type == ProcessingType.IN_MEMORY:
+        results = anomaly_incremental.calculate_incremental_anomalies(
+            trend_df,
+            metric_name,
+            metric_trend_type,
+            threshold,
+            state_df,
+            sub_group,
+        )
+
+    elif processing_type == ProcessingType.DATABRICKS:
+        results = anomaly_repository.calculate_databricks_incremental_anomalies()
+
+    return results
@@ -1,7 +1,23 @@
+import functools
+import operator
+
 import polars as pl
 
 from base.metrics_trend import MetricsTrendType
-from calculations.utils import PERIOD_WINDOW_SIZE
+from calculations.utils import (
+    PERIOD_WINDOW_SIZE,
+    PERIODS_PER_YEAR,
+    build_date_from_date_label_expr,
+    build_period_index_expr,
+    build_period_start_date_expr,
+    build_yoy_period_index_expr,
+)
+
+# scale of the median absolute deviation of normal values to their standard deviation
+MAD_NORMAL_SCALE = 1.4826
+# seasons of the seasonal profiles, the days of the week, the ISO weeks of the
+# year, the months of the year and the quarters of the year
+SEASON_PERIODS = {"daily": 7, "weekly": 53, "monthly": 12, "quarterly": 4}
 
 
 def build_rolling_mean_agg_expr(
@@ -36,6 +52,93 @@ def build_rolling_stddev_agg_expr(
     )
 
 
+def build_ewm_mean_agg_expr(
+    column_name: str,
+    metric_trend_type: MetricsTrendType,
+    sub_group: bool = False,
+):
+    """Exponentially weighted mean of the previous periods with the span of the
+    rolling window, null until the window is full. A value is standardized by the
+    forecast of the previous periods, were it part of its own mean and standard
+    deviation the scores of short windows could never reach the threshold. NaN
+    values are skipped as nulls, they would otherwise carry to every later period."""
+    window_size = PERIOD_WINDOW_SIZE[metric_trend_type]
+    ewm_mean_expr = (
+        pl.col(column_name)
+        .fill_nan(None)
+        .ewm_mean(span=window_size, min_periods=window_size)
+        .shift(1)
+    )
+    if not sub_group:
+        return ewm_mean_expr
+    return ewm_mean_expr.over("sub_group")
+
+
+def build_ewm_stddev_agg_expr(
+    column_name: str,
+    metric_trend_type: MetricsTrendType,
+    sub_group: bool = False,
+):
+    """Exponentially weighted standard deviation of the previous periods with the
+    span of the rolling window, null until the window is full, as
+    build_ewm_mean_agg_expr"""
+    window_size = PERIOD_WINDOW_SIZE[metric_trend_type]
+    ewm_stddev_expr = (
+        pl.col(column_name)
+        .fill_nan(None)
+        .ewm_std(span=window_size, min_periods=window_size)
+        .shift(1)
+    )
+    if not sub_group:
+        return ewm_stddev_expr
+    return ewm_stddev_expr.over("sub_group")
+
+
+def build_season_expr(time_column: str, metric_trend_type: MetricsTrendType):
+    """Build the expression of the season of the period of every row, from 0 to
+    SEASON_PERIODS - 1, on the time column, the PeriodIndex or the DateLabel
+
+    Args:
+        time_column (str): column of the periods, the PeriodIndex or the DateLabel
+        metric_trend_type (MetricsTrendType): time period of the trend
+    """
+    if time_column == "PeriodIndex":
+        index_expr = pl.col("PeriodIndex")
+    else:
+        index_expr = build_period_index_expr(
+            build_date_from_date_label_expr(pl.col("DateLabel"), metric_trend_type),
+            metric_trend_type,
+        )
+    if metric_trend_type == "weekly":
+        return build_period_start_date_expr(index_expr, metric_trend_type).dt.week() - 1
+    elif metric_trend_type in SEASON_PERIODS:
+        return index_expr % SEASON_PERIODS[metric_trend_type]
+    else:
+        accepted_values = ["daily", "weekly", "monthly", "quarterly"]
+        raise ValueError(f"period should be either of {accepted_values}")
+
+
+def build_seasonal_mean_agg_expr(column_name: str, season_col: str):
+    """Seasonal profile of the values, the mean of the values of the earlier periods
+    of the same season, so a period is only compared with its past as the rolling
+    detectors do and an anomaly does not lift its own profile. Null for the first
+    period of a season. The profiles of every sub_group are a single grouped
+    cumulative sum. NaN values are skipped as nulls, they would otherwise carry to
+    every later period of their season.
+
+    Args:
+        column_name (str): column of the values, sorted by time within the seasons
+        season_col (str): column of the season of the periods, of the sub_group and
+            the season for subgroups
+    """
+    values_expr = pl.col(column_name).cast(pl.Float64).fill_nan(None)
+    sum_expr = values_expr.fill_null(0)
+    count_expr = values_expr.is_not_null().cast(pl.UInt32)
+    prior_sum = sum_expr.cum_sum().over(season_col) - sum_expr
+    prior_count = count_expr.cum_sum().over(season_col) - count_expr
+    return pl.when(prior_count > 0).then(prior_sum / prior_count)
+
+
 def build_pct_change_agg_expr(
     column_name: str, diff_col_name: str, sub_group: bool = False
 ):
@@ -53,3 +156,275 @@ def build_z_score_agg_expr(column_name, mean_col, stddev_col):
         .then(0)
         .otherwise((pl.col(column_name) - pl.col(mean_col)) / pl.col(stddev_col))
     )
+
+
+def build_sub_group_window_exprs(column_name: str, window_size: int):
+    """Build the expressions of the values of the window of rows ending at each
+    row, the shifts of the column"""
+    return [
+        pl.col(column_name).cast(pl.Float64).shift(lag) for lag in range(window_size)
+    ]
+
+
+def build_sub_group_window_mask_expr(window_size: int):
+    """Build the expression of whether the window of rows ending at each row lies
+    in a single sub_group. The rows must be sorted by sub_group, the windows over
+    each sub_group are then the shifts of the rows masked where they span several
+    sub_groups."""
+    return pl.col("sub_group") == pl.col("sub_group").shift(window_size - 1)
+
+
+def build_sub_group_rolling_mean_agg_expr(
+    column_name: str, metric_trend_type: MetricsTrendType
+):
+    """Rolling mean over the rows sorted by sub_group, matches
+    build_rolling_mean_agg_expr over the sub_group"""
+    window_size = PERIOD_WINDOW_SIZE[metric_trend_type]
+    window_exprs = build_sub_group_window_exprs(column_name, window_size)
+    # a null in the window nulls the mean, as rolling_mean does
+    return pl.when(build_sub_group_window_mask_expr(window_size)).then(
+        functools.reduce(operator.add, window_exprs) / window_size
+    )
+
+
+def build_sub_group_rolling_stddev_agg_expr(
+    column_name: str, metric_trend_type: MetricsTrendType, mean_col: str = None
+):
+    """Rolling sample standard deviation over the rows sorted by sub_group, matches
+    build_rolling_stddev_agg_expr over the sub_group
+
+    Args:
+        column_name (str): column of the values
+        metric_trend_type (MetricsTrendType): time period of the trend
+        mean_col (str, optional): column of the rolling mean of the values, computed
+            here when not given
+    """
+    window_size = PERIOD_WINDOW_SIZE[metric_trend_type]
+    mean_expr = (
+        pl.col(mean_col)
+        if mean_col is not None
+        else build_sub_group_rolling_mean_agg_expr(column_name, metric_trend_type)
+    )
+    squared_deviation_exprs = [
+        (window_expr - mean_expr) ** 2
+        for window_expr in build_sub_group_window_exprs(column_name, window_size)
+    ]
+    return pl.when(build_sub_group_window_mask_expr(window_size)).then(
+        (
+            functools.reduce(operator.add, squared_deviation_exprs) / (window_size - 1)
+        ).sqrt()
+    )
+
+
+def build_sorted_window_stages(
+    column_name: str, window_size: int, sorted_cols: list[str], sub_group: bool = False
+) -> list[list[pl.Expr]]:
+    """Build the stages of expressions sorting the values of the window of rows
+    ending at each row into the sorted columns, the window values then the rounds of
+    an odd-even transposition sort. Each stage only refers to the columns of the
+    previous ones, so they run as successive with_columns. The values are null
+    where the window holds a null or a NaN, or spans several sub_groups of the rows
+    sorted by sub_group.
+
+    Args:
+        column_name (str): column of the values
+        window_size (int): rows of the window
+        sorted_cols (list[str]): columns of the values sorted ascending, one per row
+            of the window
+        sub_group (bool, optional): whether the rows are sorted by sub_group
+    """
+    window_exprs = [
+        pl.col(column_name).cast(pl.Float64).fill_nan(None).shift(lag)
+        for lag in range(window_size)
+    ]
+    full_window_expr = pl.all_horizontal(
+        [window_expr.is_not_null() for window_expr in window_exprs]
+    )
+    if sub_group:
+        full_window_expr = full_window_expr & build_sub_group_window_mask_expr(
+            window_size
+        )
+    stages = [
+        [
+            pl.when(full_window_expr).then(window_expr).alias(sorted_col)
+            for window_expr, sorted_col in zip(window_exprs, sorted_cols)
+        ]
+    ]
+    for sort_round in range(window_size):
+        stage = []
+        for rank in range(sort_round % 2, window_size - 1, 2):
+            low_col, high_col = sorted_cols[rank], sorted_cols[rank + 1]
+            stage.append(pl.min_horizontal(low_col, high_col).alias(low_col))
+            stage.append(pl.max_horizontal(low_col, high_col).alias(high_col))
+        stages.append(stage)
+    return stages
+
+
+def build_sorted_window_median_expr(sorted_cols: list[str]) -> pl.Expr:
+    """Median of the sorted window values, interpolated as rolling_median does"""
+    middle = len(sorted_cols) // 2
+    if len(sorted_cols) % 2:
+        return pl.col(sorted_cols[middle])
+    low_expr, high_expr = pl.col(sorted_cols[middle - 1]), pl.col(sorted_cols[middle])
+    return low_expr + (high_expr - low_expr) * 0.5
+
+
+def build_sorted_window_mad_expr(sorted_cols: list[str], median_col: str) -> pl.Expr:
+    """Median absolute deviation of the sorted window values from their median,
+    scaled by MAD_NORMAL_SCALE to estimate the standard deviation of normal values.
+    Unlike the standard deviation, a single spike in the window barely moves it.
+
+    The deviations of the values below and above the median are each sorted, from
+    the median outwards, so their middle ranks are selected from the merge of the
+    two halves: the k-th smallest of the merge is the smallest, over the splits of
+    the k + 1 first values between the halves, of the largest value taken.
+
+    Args:
+        sorted_cols (list[str]): columns of the window values sorted ascending
+        median_col (str): column of the median of the window values
+    """
+    window_size = len(sorted_cols)
+    half = window_size // 2
+    median_expr = pl.col(median_col)
+    below = [median_expr - pl.col(sorted_cols[half - 1 - rank]) for rank in range(half)]
+    above = [
+        pl.col(sorted_cols[window_size - half + rank]) - median_expr
+        for rank in range(half)
+    ]
+
+    def select_merged(rank: int) -> pl.Expr:
+        split_exprs = []
+        for taken_below in range(rank + 2):
+            taken_above = rank + 1 - taken_below
+            if taken_below > half or taken_above > half:
+                continue
+            largest = [below[taken_below - 1]] if taken_below else []
+            largest += [above[taken_above - 1]] if taken_above else []
+            split_exprs.append(pl.max_horizontal(largest))
+        return pl.min_horizontal(split_exprs)
+
+    if window_size % 2:
+        # the deviation of the median itself is the smallest one, zero
+        mad_expr = select_merged(half - 1)
+    else:
+        low_expr, high_expr = select_merged(half - 1), select_merged(half)
+        mad_expr = low_expr + (high_expr - low_expr) * 0.5
+    return mad_expr * MAD_NORMAL_SCALE
+
+
+def build_sub_group_season_expr(time_column: str, metric_trend_type: MetricsTrendType):
+    """Build the expression of the sub_group and season of every row as one integer
+    key over the rows sorted by sub_group, the number of the sub_group in the
+    sorted rows and the season, cheaper to group by than the sub_group and the
+    season"""
+    sub_group_start = (pl.col("sub_group") != pl.col("sub_group").shift(1)).fill_null(
+        True
+    )
+    return sub_group_start.cum_sum().cast(pl.Int64) * SEASON_PERIODS[
+        metric_trend_type
+    ] + build_season_expr(time_column, metric_trend_type)
+
+
+def build_sub_group_pct_change_agg_expr(column_name: str, diff_col_name: str):
+    """Percentage change from the previous row over the rows sorted by sub_group,
+    matches build_pct_change_agg_expr over the sub_group. As pct_change, the null
+    values are forward filled, only from the rows of the same sub_group."""
+    sub_group_start = pl.col("sub_group") != pl.col("sub_group").shift(1)
+    filled_row = (
+        pl.when(pl.col(column_name).is_not_null() | sub_group_start.fill_null(True))
+        .then(pl.int_range(pl.len()))
+        .forward_fill()
+    )
+    filled = pl.col(column_name).cast(pl.Float64).gather(filled_row)
+    return (
+        pl.when(sub_group_start.not_())
+        .then((filled - filled.shift(1)) / filled.shift(1))
+        .alias(diff_col_name)
+    )
+
+
+def build_yoy_time_expr(time_column: str, metric_trend_type: MetricsTrendType):
+    """Build the expression of the period of the previous year on the time column,
+    the PeriodIndex or the DateLabel"""
+    if time_column == "PeriodIndex":
+        return build_yoy_period_index_expr(
+            pl.col("PeriodIndex"), metric_trend_type
+        ).cast(pl.Int32)
+    return pl.concat_str(
+        [
+            (pl.col("DateLabel").str.slice(0, 4).cast(pl.Int32) - 1).cast(pl.Utf8),
+            pl.col("DateLabel").str.slice(4),
+        ]
+    )
+
+
+def build_shift_yoy_value_expr(
+    column_name: str,
+    time_column: str,
+    yoy_time_column: str,
+    metric_trend_type: MetricsTrendType,
+    sub_group: bool = False,
+):
+    """Value of the column in the period of the previous year, from the rows a year
+    of periods before on the time sorted rows, by sub_group first for subgroups. A
+    row is only used when it is the period of the previous year of the same
+    sub_group, so the value is null where the period grid has gaps.
+
+    Args:
+        column_name (str): column of the values
+        time_column (str): column of the periods, the PeriodIndex or the DateLabel
+        yoy_time_column (str): column of the period of the previous year
+        metric_trend_type (MetricsTrendType): time period of the trend
+        sub_group (bool, optional): whether the rows hold the subgroups
+    """
+    yoy_value_exprs = []
+    for periods in PERIODS_PER_YEAR[metric_trend_type]:
+        is_yoy_row = pl.col(time_column).shift(periods) == pl.col(yoy_time_column)
+        if sub_group:
+            is_yoy_row = is_yoy_row & (
+                pl.col("sub_group").shift(periods) == pl.col("sub_group")
+            )
+        yoy_value_exprs.append(
+            pl.when(is_yoy_row).then(pl.col(column_name).shift(periods))
+        )
+    return pl.coalesce(yoy_value_exprs)
+
+
+def build_search_yoy_value_expr(
+    column_name: str,
+    time_column: str,
+    yoy_time_column: str,
+    sub_group: bool = False,
+):
+    """Value of the column in the period of the previous year, from a binary search
+    of that period in the time sorted rows, by sub_group first for subgroups. The
+    period is found across gaps in the period grid, as the join does, without
+    joining the trend to itself.
+
+    The periods of subgroups are prefixed by the number of the run of rows of their
+    sub_group, so the keys of all the rows are sorted and searched at once.
+
+    Args:
+        column_name (str): column of the values
+        time_column (str): column of the periods, the PeriodIndex or the DateLabel
+        yoy_time_column (str): column of the period of the previous year
+        sub_group (bool, optional): whether the rows hold the subgroups
+    """
+    time_key = pl.col(time_column)
+    yoy_time_key = pl.col(yoy_time_column)
+    if sub_group:
+        run = pl.col("sub_group").rle_id()
+        if time_column == "PeriodIndex":
+            # the Int32 periods fit below the run number in the high 32 bits
+            run = run.cast(pl.Int64) * (1 << 32)
+            time_key = run + time_key
+            yoy_time_key = run + yoy_time_key
+        else:
+            run = run.cast(pl.Utf8).str.zfill(10)
+            time_key = pl.concat_str([run, time_key])
+            yoy_time_key = pl.concat_str([run, yoy_time_key])
+
+    index = time_key.search_sorted(yoy_time_key).clip(0, pl.len() - 1)
+    return pl.when(time_key.gather(index) == yoy_time_key).then(
+        pl.col(column_name).gather(index)
+    )
@@ -0,0 +1,47 @@
+"""Cache of the partial aggregates of the subgroup cube shared across insights"""
+
+import hashlib
+import json
+import os
+from typing import List
+
+from data_source import utils as data_source_utils
+from data_source.spill_store import SpillStore
+
+CUBE_CACHE_MAX_MEMORY_BYTES = int(
+    os.environ.get("INSIGHTS_CUBE_CACHE_MAX_MEMORY_BYTES", 1024 * 1024 * 1024)
+)
+CUBE_CACHE_DIR = os.environ.get(
+    "INSIGHTS_CUBE_CACHE_DIR", os.path.join(data_source_utils.CACHE_DIR, "cube")
+)
+CUBE_CACHE_MAX_SIZE_BYTES = int(
+    os.environ.get("INSIGHTS_CUBE_CACHE_MAX_SIZE_BYTES", 10 * 1024 * 1024 * 1024)
+)
+
+
+class SubgroupCubeCache(SpillStore):
+    """Process-wide cache of the partials of the combinations of the subgroup cube,
+    keyed by get_key and shared by the insights over the same rows"""
+
+    def __init__(
+        self,
+        max_memory_bytes: int = CUBE_CACHE_MAX_MEMORY_BYTES,
+        spill_dir: str = CUBE_CACHE_DIR,
+        max_spill_bytes: int = CUBE_CACHE_MAX_SIZE_BYTES,
+    ) -> None:
+        super().__init__(max_memory_bytes, spill_dir, max_spill_bytes)
+
+    @staticmethod
+    def get_key(prefix: str, combination, group_keys: List[str]) -> str:
+        """Cache key of the partials of a combination
+
+        Args:
+            prefix (str): fingerprint of the rows and of the metric aggregated
+            combination (tuple): dimensions of the combination, in any order
+            group_keys (List[str]): columns grouped along with the combination
+        """
+        key = json.dumps([prefix, sorted(combination), group_keys])
+        return hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+
+
+subgroup_cube_cache = SubgroupCubeCache()
@@ -1,9 +1,18 @@
+import hashlib
+import json
+from typing import Callable, Dict, List
+
 from base.general import ProcessingType
 from base.insights import MetricsInsight
 from base.metrics import DualColumnMetric, SingleColumnMetric
 from base.metrics_trend import BaseMetricsTrend
 from calculations.subgroup_insights import services as subgroup_trend_services
+from calculations.subgroup_insights.cube_cache import SubgroupCubeCache
+from calculations.subgroup_insights.scheduler import SubgroupScheduler
+from calculations.subgroup_insights.subgroup_dictionary import SubgroupDictionary
+from calculations.subgroup_insights.top_k_subgroups import TopKSubgroups
 from calculations.trend import services as trend_services
+from polars import DataFrame
 
 
 class PeriodicSubgroupMetricsTrend(BaseMetricsTrend):
@@ -13,16 +22,92 @@ class PeriodicSubgroupMetricsTrend(BaseMetricsTrend):
         self,
         processing_type: ProcessingType = "in_memory",
         time_intervals: int = None,
+        cube: bool = False,
+        max_threads: int = None,
+        cube_cache: SubgroupCubeCache = None,
+        progress: Callable = None,
     ) -> None:
         super().__init__()
         self.processing_type = processing_type
         self.time_intervals = time_intervals
+        self.cube = cube
+        # worker threads aggregating the combinations of a calculation, progress is
+        # called before every combination and stops the calculation when it raises
+        self.scheduler = SubgroupScheduler(max_threads, progress=progress)
+        # partials of the cube reused across calculations over the same rows
+        self.cube_cache = cube_cache
+        self.subgroup_dictionary = None
+
+    def build_subgroup_dictionary(
+        self, dataframes: List[DataFrame], metric_details: MetricsInsight
+    ) -> SubgroupDictionary:
+        """Build the dictionary encoding the subgroup keys of the insight dimensions
+        from the values found in the dataframes
+
+        Args:
+            dataframes (List[DataFrame]): data the subgroups are aggregated from
+            metric_details (MetricsInsight): Metrics details
+        """
+        return SubgroupDictionary.from_dataframes(
+            dataframes, self.get_columns_to_combine(metric_details=metric_details)
+        )
+
+    def get_cube_metric_name(self, metric_details: MetricsInsight) -> str:
+        """Name of the metric aggregated by the partial expressions of the cube"""
+        metric = metric_details.metrics
+        return (
+            metric_details.name
+            if isinstance(metric, SingleColumnMetric)
+            else metric.name
+        )
+
+    def build_cube_cache_prefix(
+        self, data_fingerprint: str, metric_details: MetricsInsight
+    ) -> str | None:
+        """Build the prefix of the cube cache keys of the partials of the insight
+        metric, None without a data fingerprint as the rows can not be told apart.
+
+        Args:
+            data_fingerprint (str): fingerprint of the rows aggregated, changes
+                whenever the rows change
+            metric_details (MetricsInsight): Metrics details
+        """
+        if data_fingerprint is None or self.cube_cache is None:
+            return None
+        prefix = json.dumps(
+            [
+                data_fingerprint,
+                metric_details.metrics.model_dump(mode="json"),
+                self.get_cube_metric_name(metric_details),
+                self.time_intervals,
+            ],
+            sort_keys=True,
+        )
+        return hashlib.blake2b(prefix.encode(), digest_size=16).hexdigest()
+
+    def build_cube_partial_exps(self, metric_details: MetricsInsight):
+        """Build the partial expressions of the insight metric for the subgroup cube,
+        None when the cube is disabled or the metric can not be aggregated from
+        partials.
+
+        Args:
+            metric_details (MetricsInsight): Metrics details
+        """
+        if not self.cube:
+            return None
+        return trend_services.build_partial_metric_exps(
+            metric=metric_details.metrics,
+            metric_name=self.get_cube_metric_name(metric_details),
+            processing_type=self.processing_type,
+        )
 
     def calculate(
         self,
         trend_df,
         dataframe,
         metric_details: MetricsInsight,
+        subgroup_dictionary: SubgroupDictionary = None,
+        data_fingerprint: str = None,
     ):
         """
         Calculate Periodic Subgroup Metrics Trend
@@ -32,15 +117,47 @@ class PeriodicSubgroupMetricsTrend(BaseMetricsTrend):
             dataframe (_type_): dataframe on which to run calculation
             trend_df: Periodic trends for metric
             metric (models.Metric): Metrics type to calculate
+            subgroup_dictionary (SubgroupDictionary, optional): encoding of the
+                sub_group keys, built from the dataframe when not given and kept
+                in self.subgroup_dictionary to render the keys
+            data_fingerprint (str, optional): fingerprint of the rows of the
+                dataframe, the partials of the cube are cached under it
 
             we may do customization based on metric type in future,or how we return/format the response based on metric type
+
+        With the cube enabled the rows are aggregated once per maximal combination and
+        the coarser combinations are rolled up from those partials, metrics which can
+        not be rolled up fall back to one aggregation per combination. With a cube
+        cache and a data fingerprint only the combinations missing from the cache are
+        aggregated.
         """
 
         columns_to_combine = self.get_columns_to_combine(metric_details=metric_details)
+        self.subgroup_dictionary = (
+            subgroup_dictionary
+            or self.build_subgroup_dictionary([dataframe], metric_details)
+        )
 
         all_combinations = subgroup_trend_services.build_dimension_combinations(
             columns_to_combine, rca_depth=metric_details.max_rca_depth
         )
+        partial_exps = self.build_cube_partial_exps(metric_details)
+        if partial_exps is not None:
+            return subgroup_trend_services.apply_subgroup_cube_trend_agg(
+                all_combinations=all_combinations,
+                trend_df=trend_df,
+                dataframe=dataframe,
+                partial_exps=partial_exps,
+                processing_type=self.processing_type,
+                metric_details=metric_details,
+                subgroup_dictionary=self.subgroup_dictionary,
+                scheduler=self.scheduler,
+                cube_cache=self.cube_cache,
+                cache_prefix=self.build_cube_cache_prefix(
+                    data_fingerprint, metric_details
+                ),
+            )
+
         if isinstance(metric_details.metrics, SingleColumnMetric):
             print(
                 "Aggregation Method ",
@@ -63,6 +180,8 @@ class PeriodicSubgroupMetricsTrend(BaseMetricsTrend):
                 processing_type=self.processing_type,
                 time_intervals=self.time_intervals,
                 metric_details=metric_details,
+                subgroup_dictionary=self.subgroup_dictionary,
+                scheduler=self.scheduler,
             )
         elif isinstance(metric_details.metrics, DualColumnMetric):
             pass
@@ -85,6 +204,99 @@ class PeriodicSubgroupMetricsTrend(BaseMetricsTrend):
                 processing_type=self.processing_type,
                 time_intervals=self.time_intervals,
                 metric_details=metric_details,
+                subgroup_dictionary=self.subgroup_dictionary,
+                scheduler=self.scheduler,
             )
 
         return trend_calc
+
+    def calculate_segments(
+        self,
+        trend_df,
+        dataframe,
+        metric_details: MetricsInsight,
+        segment_labels: Dict[str, str],
+        subgroup_dictionary: SubgroupDictionary = None,
+        top_k_subgroups: TopKSubgroups = None,
+        data_fingerprint: str = None,
+        source_dataframe: DataFrame = None,
+    ) -> Dict[str, DataFrame] | DataFrame:
+        """
+        Calculate Subgroup Metrics Trend of the baseline and comparison segments over
+        data tagged with the segment mask, both segments are aggregated together.
+
+        Args:
+
+            trend_df: Segment trends labelled with the segment DateLabel
+            dataframe (_type_): data tagged with the segment mask
+            metric_details (MetricsInsight): Metrics details
+            segment_labels (Dict[str, str]): DateLabel of each segment
+            subgroup_dictionary (SubgroupDictionary, optional): encoding of the
+                sub_group keys, built from the dataframe when not given
+            top_k_subgroups (TopKSubgroups, optional): keeps the top subgroups while
+                the combinations are aggregated, the merged top subgroups are
+                returned instead of the subgroups of each segment
+            data_fingerprint (str, optional): fingerprint of the rows of the
+                dataframe, segment mask included, the partials of the cube are
+                cached under it
+            source_dataframe (DataFrame, optional): rows the segments were tagged
+                from, with the metric filters applied. The partials of the cube are
+                then aggregated from them, grouped with the columns the segments
+                select their rows on, and data_fingerprint is the fingerprint of
+                these rows, so the cached partials are shared by the insights over
+                any segments of the same rows.
+        """
+        columns_to_combine = self.get_columns_to_combine(metric_details=metric_details)
+        self.subgroup_dictionary = (
+            subgroup_dictionary
+            or self.build_subgroup_dictionary([dataframe], metric_details)
+        )
+
+        all_combinations = subgroup_trend_services.build_dimension_combinations(
+            columns_to_combine, rca_depth=metric_details.max_rca_depth
+        )
+        partial_exps = self.build_cube_partial_exps(metric_details)
+        if partial_exps is not None:
+            group_keys, tag_partials = None, None
+            if source_dataframe is not None:
+                dataframe = source_dataframe
+                group_keys = trend_services.get_segment_columns(metric_details)
+
+                def tag_partials(partial_df):
+                    return trend_services.apply_segment_mask(
+                        partial_df, metric_details, self.processing_type
+                    )
+
+            return subgroup_trend_services.apply_segment_subgroup_cube_trend_agg(
+                all_combinations=all_combinations,
+                trend_df=trend_df,
+                dataframe=dataframe,
+                partial_exps=partial_exps,
+                segment_labels=segment_labels,
+                processing_type=self.processing_type,
+                metric_details=metric_details,
+                subgroup_dictionary=self.subgroup_dictionary,
+                scheduler=self.scheduler,
+                cube_cache=self.cube_cache,
+                cache_prefix=self.build_cube_cache_prefix(
+                    data_fingerprint, metric_details
+                ),
+                top_k_subgroups=top_k_subgroups,
+                group_keys=group_keys,
+                tag_partials=tag_partials,
+            )
+
+        return subgroup_trend_services.apply_segment_subgroup_trend_agg(
+            all_combinations=all_combinations,
+            trend_df=trend_df,
+            dataframe=dataframe,
+            segment_agg_exprs=trend_services.build_segment_agg_exps(
+                metric_details.metrics, self.processing_type
+            ),
+            segment_labels=segment_labels,
+            processing_type=self.processing_type,
+            metric_details=metric_details,
+            subgroup_dictionary=self.subgroup_dictionary,
+            scheduler=self.scheduler,
+            top_k_subgroups=top_k_subgroups,
+        )
@@ -1,32 +1,253 @@
-import json
-from copy import deepcopy
-from typing import List
+import itertools
+from typing import Dict, List
 
 import polars as pl
 from base.insights import DimensionValuePair, MetricsInsight
 from base.metrics import DualColumnMetric, SingleColumnMetric
+from calculations import utils as calculation_utils
+from calculations.subgroup_insights.subgroup_dictionary import SubgroupDictionary
+from calculations.subgroup_insights.subgroup_index import SubgroupIndex
 
 
 def apply_polar_subgroup_trend_agg(
-    combination, trend_df, dataframe, agg_expr, metric_details: MetricsInsight
+    combination,
+    trend_df,
+    dataframe,
+    agg_expr,
+    metric_details: MetricsInsight,
+    subgroup_dictionary: SubgroupDictionary,
 ):
+    time_column = calculation_utils.get_time_column(dataframe)
+
     # Group by Date and combination
-    subset_metric = dataframe.group_by(["DateLabel"] + list(combination)).agg(agg_expr)
+    subset_metric = dataframe.group_by([time_column] + list(combination)).agg(agg_expr)
+    return finalize_polar_subgroup_trend(
+        combination,
+        trend_df,
+        subset_metric,
+        time_column,
+        metric_details,
+        subgroup_dictionary,
+    )
+
+
+def apply_polar_segment_subgroup_trend_agg(
+    combination,
+    trend_df,
+    dataframe,
+    segment_agg_exprs: Dict[str, List[pl.Expr]],
+    segment_labels: Dict[str, str],
+    metric_details: MetricsInsight,
+    subgroup_dictionary: SubgroupDictionary,
+) -> Dict[str, pl.DataFrame]:
+    """Aggregate a combination for every segment of data tagged with the segment mask
+    in a single group_by.
+
+    Args:
+        combination (tuple): dimensions to group by
+        trend_df (pl.DataFrame): segment trends labelled with the segment DateLabel
+        dataframe (pl.DataFrame): data tagged with the segment mask
+        segment_agg_exprs (Dict[str, List[pl.Expr]]): aggregation expressions of each
+            segment, including the number of rows of the segment
+        segment_labels (Dict[str, str]): DateLabel of each segment
+        metric_details (MetricsInsight): Metrics details
+        subgroup_dictionary (SubgroupDictionary): encoding of the subgroup keys
+
+    Returns:
+        Dict[str, pl.DataFrame]: subgroup impacts of each segment
+    """
+    time_column = calculation_utils.get_time_column(dataframe)
+
+    segment_columns = {}
+    agg_exprs = []
+    for segment, exprs in segment_agg_exprs.items():
+        segment_columns[segment] = [expr.meta.output_name() for expr in exprs]
+        agg_exprs += [
+            expr.alias(f"{expr.meta.output_name()}__{segment}") for expr in exprs
+        ]
+    segments_metric = dataframe.group_by(list(combination)).agg(agg_exprs)
+
+    subgroup_trends = {}
+    for segment, columns in segment_columns.items():
+        subset_metric = segments_metric.filter(
+            pl.col(f"{calculation_utils.SEGMENT_ROWS_COLUMN}__{segment}") > 0
+        ).select(
+            [pl.lit(segment_labels[segment]).alias(time_column)]
+            + list(combination)
+            + [
+                pl.col(f"{column}__{segment}").alias(column)
+                for column in columns
+                if column != calculation_utils.SEGMENT_ROWS_COLUMN
+            ]
+        )
+        subgroup_trends[segment] = finalize_polar_subgroup_trend(
+            combination,
+            trend_df,
+            subset_metric,
+            time_column,
+            metric_details,
+            subgroup_dictionary,
+        )
+    return subgroup_trends
+
+
+def get_polar_cardinalities(dataframe: pl.DataFrame, columns: List[str]):
+    """Number of unique values of each column
+
+    Args:
+        dataframe (pl.DataFrame): Polars dataframe
+        columns (List[str]): columns to count the unique values of
+    """
+    return dataframe.select(pl.col(columns).n_unique()).row(0, named=True)
+
+
+def aggregate_polar_cube_combination(
+    combination,
+    dataframe: pl.DataFrame,
+    cube: Dict[frozenset, pl.DataFrame],
+    partial_exps: tuple,
+    group_keys: List[str],
+) -> pl.DataFrame:
+    """Aggregate the partials of a combination of the cube. The combination is rolled
+    up from the smallest partials already computed for one of its supersets, the
+    rows are only aggregated when there is none.
+
+    Args:
+        combination (tuple): dimensions to group by
+        dataframe (pl.DataFrame): rows to aggregate
+        cube (Dict[frozenset, pl.DataFrame]): partials of the combinations computed
+            so far
+        partial_exps (tuple): partial keys, partial, rollup and final expressions
+            from build_polar_partial_metric_exps
+        group_keys (List[str]): columns grouped along with every combination
+    """
+    partial_keys, partial_exprs, rollup_exprs, _ = partial_exps
+    keys = list(dict.fromkeys(group_keys + list(combination) + partial_keys))
+
+    if frozenset(combination) in cube:
+        return cube[frozenset(combination)]
+    parent_dfs = [
+        partial_df
+        for parent, partial_df in cube.items()
+        if frozenset(combination) < parent
+    ]
+    if not parent_dfs:
+        return dataframe.group_by(keys).agg(partial_exprs)
+
+    # only the rollups producing partial columns, the others are final aggregations
+    partial_columns = [expr.meta.output_name() for expr in partial_exprs]
+    partial_rollup_exprs = [
+        expr for expr in rollup_exprs if expr.meta.output_name() in partial_columns
+    ]
+    parent_df = min(parent_dfs, key=lambda partial_df: partial_df.height)
+    return parent_df.group_by(keys).agg(partial_rollup_exprs)
+
+
+def apply_polar_subgroup_cube_trend_agg(
+    combination,
+    trend_df,
+    partial_df,
+    partial_exps: tuple,
+    metric_details,
+    subgroup_dictionary: SubgroupDictionary,
+):
+    """Calculate the subgroup impacts of a combination from its partials in the cube
+
+    Args:
+        combination (tuple): dimensions to group by
+        trend_df (pl.DataFrame): overall trend
+        partial_df (pl.DataFrame): partials of the combination grouped with the time
+            column
+        partial_exps (tuple): partial keys, partial, rollup and final expressions
+        metric_details (MetricsInsight): Metrics details
+        subgroup_dictionary (SubgroupDictionary): encoding of the subgroup keys
+    """
+    _, _, rollup_exprs, final_exprs = partial_exps
+    time_column = calculation_utils.get_time_column(partial_df)
+    keys = [time_column] + list(combination)
+
+    subset_metric = (
+        partial_df.group_by(keys).agg(rollup_exprs).select(keys + final_exprs)
+    )
+    return finalize_polar_subgroup_trend(
+        combination,
+        trend_df,
+        subset_metric,
+        time_column,
+        metric_details,
+        subgroup_dictionary,
+    )
+
+
+def apply_polar_segment_subgroup_cube_trend_agg(
+    combination,
+    trend_df,
+    partial_df,
+    partial_exps: tuple,
+    segment_labels: Dict[str, str],
+    metric_details: MetricsInsight,
+    subgroup_dictionary: SubgroupDictionary,
+) -> Dict[str, pl.DataFrame]:
+    """Calculate the subgroup impacts of a combination for every segment from its
+    partials in the cube, grouped with the segment mask
+
+    Args:
+        combination (tuple): dimensions to group by
+        trend_df (pl.DataFrame): segment trends labelled with the segment DateLabel
+        partial_df (pl.DataFrame): partials of the combination grouped with the
+            segment mask
+        partial_exps (tuple): partial keys, partial, rollup and final expressions
+        segment_labels (Dict[str, str]): DateLabel of each segment
+        metric_details (MetricsInsight): Metrics details
+        subgroup_dictionary (SubgroupDictionary): encoding of the subgroup keys
 
+    Returns:
+        Dict[str, pl.DataFrame]: subgroup impacts of each segment
+    """
+    _, _, rollup_exprs, final_exprs = partial_exps
+    time_column = "DateLabel"
+
+    subgroup_trends = {}
+    for segment, segment_label in segment_labels.items():
+        subset_metric = (
+            partial_df.filter(calculation_utils.build_segment_member_exp(segment))
+            .group_by(list(combination))
+            .agg(rollup_exprs)
+            .select(
+                [pl.lit(segment_label).alias(time_column)]
+                + list(combination)
+                + final_exprs
+            )
+        )
+        subgroup_trends[segment] = finalize_polar_subgroup_trend(
+            combination,
+            trend_df,
+            subset_metric,
+            time_column,
+            metric_details,
+            subgroup_dictionary,
+        )
+    return subgroup_trends
+
+
+def finalize_polar_subgroup_trend(
+    combination,
+    trend_df,
+    subset_metric,
+    time_column: str,
+    metric_details: MetricsInsight,
+    subgroup_dictionary: SubgroupDictionary,
+):
+    """Join the aggregated combination with the overall trend, key its subgroups and
+    calculate their impact"""
     # Merge the overall_metric back to the subset_metric
     subset_metric = subset_metric.join(
-        trend_df, on="DateLabel", how="inner", suffix="_overall"
+        trend_df, on=time_column, how="inner", suffix="_overall"
     )
 
+    # integer keys, the JSON of the dimension values is only rendered for the output
     subset_metric = subset_metric.with_columns(
-        [
-            pl.Series(
-                [
-                    json.dumps(item)
-                    for item in subset_metric.select(list(combination)).to_dicts()
-                ]
-            ).alias("sub_group"),
-        ]
+        subgroup_dictionary.build_key_exp(combination)
     )
 
     # Remove 'combination' columns from subset_metric
@@ -35,6 +256,75 @@ def apply_polar_subgroup_trend_agg(
     return subset_metric
 
 
+def apply_polar_subgroup_pruning(
+    combination, dataframe: pl.DataFrame, passing_keys: Dict[tuple, pl.DataFrame]
+):
+    """Keep only the rows, or the cube partials, of the subgroups whose every parent
+    subgroup, one dimension shorter, passed the thresholds.
+
+    Args:
+        combination (tuple): dimensions to group by
+        dataframe (pl.DataFrame): rows or partials of the combination to aggregate
+        passing_keys (Dict[tuple, pl.DataFrame]): dimension values of the passing
+            subgroups of each combination
+    """
+    for subset in itertools.combinations(combination, len(combination) - 1):
+        if subset:
+            dataframe = dataframe.join(
+                passing_keys[subset], on=list(subset), how="semi", join_nulls=True
+            )
+    return dataframe
+
+
+def prune_polar_subgroups(
+    subgroup_dfs: Dict[str, pl.DataFrame],
+    combination,
+    subgroup_dictionary: SubgroupDictionary,
+    metric_details: MetricsInsight,
+):
+    """Drop the subgroups of a combination under the support and impact thresholds, a
+    subgroup passes when any of its rows, across segments and periods, passes.
+
+    Args:
+        subgroup_dfs (Dict[str, pl.DataFrame]): subgroup impacts of the combination
+        combination (tuple): dimensions of the combination
+        subgroup_dictionary (SubgroupDictionary): encoding of the subgroup keys
+        metric_details (MetricsInsight): Metrics details holding the thresholds
+
+    Returns:
+        tuple: subgroup impacts of the passing subgroups, dimension values of the
+            passing subgroups and the number of pruned subgroups
+    """
+    threshold_expr = pl.lit(True)
+    if metric_details.min_subgroup_support is not None:
+        threshold_expr = threshold_expr & (
+            pl.col("size") >= metric_details.min_subgroup_support
+        )
+    if metric_details.min_subgroup_impact is not None:
+        threshold_expr = threshold_expr & (
+            pl.col("absolute_impact").abs() >= metric_details.min_subgroup_impact
+        )
+
+    subgroups = pl.concat(
+        [subgroup_df.select("sub_group") for subgroup_df in subgroup_dfs.values()]
+    ).unique()
+    passing_subgroups = pl.concat(
+        [
+            subgroup_df.filter(threshold_expr.fill_null(False)).select("sub_group")
+            for subgroup_df in subgroup_dfs.values()
+        ]
+    ).unique()
+
+    passing_keys = passing_subgroups.select(
+        subgroup_dictionary.build_values_exps(combination)
+    )
+    subgroup_dfs = {
+        key: subgroup_df.join(passing_subgroups, on="sub_group", how="semi")
+        for key, subgroup_df in subgroup_dfs.items()
+    }
+    return subgroup_dfs, passing_keys, subgroups.height - passing_subgroups.height
+
+
 def apply_databricks_subgroup_trend_agg(**kwargs):
     """Build databricks subroup trend agg
 
@@ -99,15 +389,34 @@ def calculate_databricks_subgroup_impact(**kwargs):
 
 
 def apply_polar_filter_on_subgroup_impact_df(
-    trend_df: pl.DataFrame, dimension_value_pairs: List[DimensionValuePair]
+    trend_df: pl.DataFrame,
+    dimension_value_pairs: List[DimensionValuePair],
+    subgroup_dictionary: SubgroupDictionary = None,
+    subgroup_index: SubgroupIndex = None,
 ):
     """Apply filter on subgroup impact dataframe to extract data for required dimension_value_pairs.
 
     Args:
         trend_df (pl.DataFrame): bubgroup impact dataframe.
         subgroup_dimension_value_pair (List[DimensionValuePair]): List of dimension value pairs to filter the dataframe.
+        subgroup_dictionary (SubgroupDictionary, optional): encoding of the subgroup
+            keys, the keys are matched exactly when given, otherwise the rendered
+            JSON is searched.
+        subgroup_index (SubgroupIndex, optional): index built over trend_df, looked
+            up instead of scanning trend_df when given.
     """
-    filtered_df = deepcopy(trend_df)
+    if subgroup_index is not None:
+        return subgroup_index.filter(dimension_value_pairs)
+
+    if subgroup_dictionary is not None:
+        key = subgroup_dictionary.build_key(
+            {pair.dimension: pair.value for pair in dimension_value_pairs}
+        )
+        if key is None:
+            return trend_df.clear()
+        return trend_df.filter(pl.col("sub_group") == key)
+
+    filtered_df = trend_df
     # string value search
     search_string = """\"{dimension}\": \"{value}\""""
 
@@ -0,0 +1,117 @@
+"""Scheduling of the subgroup combinations over a bounded number of worker threads"""
+
+import os
+import threading
+from typing import Callable, List, Sequence
+
+from joblib import Parallel, delayed
+
+# worker threads of one subgroup calculation, every worker runs its group_by on the
+# polars thread pool shared by the whole process
+SUBGROUP_MAX_THREADS = int(
+    os.environ.get("INSIGHTS_SUBGROUP_MAX_THREADS", min(os.cpu_count() or 1, 8))
+)
+# batches running at once across all the concurrent subgroup calculations
+PROCESS_MAX_THREADS = int(
+    os.environ.get("INSIGHTS_PROCESS_MAX_THREADS", os.cpu_count() or 1)
+)
+# the combinations are batched so that every worker thread gets this many batches
+BATCHES_PER_THREAD = 4
+
+_process_slots = threading.BoundedSemaphore(PROCESS_MAX_THREADS)
+
+
+class SubgroupScheduler:
+    """Runs the tasks of a subgroup calculation on at most max_threads worker threads.
+
+    The tasks are ordered by decreasing cost so that the expensive ones start first,
+    the cheap ones are batched together so that each batch costs about the same, and
+    every batch holds one of the slots shared by all the schedulers of the process.
+
+    The progress callback is called before every task with the number of tasks of
+    the map done and their total, an exception it raises, such as the cancellation
+    of a job, stops the map.
+    """
+
+    def __init__(self, max_threads: int = None, progress: Callable = None) -> None:
+        self.max_threads = max(1, max_threads or SUBGROUP_MAX_THREADS)
+        self.progress = progress
+
+    def plan_batches(self, costs: Sequence[float]) -> List[List[int]]:
+        """Batch the tasks, by decreasing cost, until each batch reaches the cost of
+        an even share of the batches of all worker threads
+
+        Args:
+            costs (Sequence[float]): estimated cost of each task
+
+        Returns:
+            List[List[int]]: indices of the tasks of each batch
+        """
+        order = sorted(range(len(costs)), key=lambda index: costs[index], reverse=True)
+        batch_cost_target = sum(costs) / (self.max_threads * BATCHES_PER_THREAD)
+
+        batches, batch, batch_cost = [], [], 0
+        for index in order:
+            batch.append(index)
+            batch_cost += costs[index]
+            if batch_cost >= batch_cost_target:
+                batches.append(batch)
+                batch, batch_cost = [], 0
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def map(
+        self, function: Callable, tasks: Sequence, costs: Sequence[float] = None
+    ) -> list:
+        """Apply the function to every task
+
+        Args:
+            function (Callable): function of a task
+            tasks (Sequence): tasks, the subgroup combinations
+            costs (Sequence[float], optional): estimated cost of each task, the tasks
+                cost the same when not given
+
+        Returns:
+            list: result of each task, in the order of the tasks
+        """
+        if costs is None:
+            costs = [1] * len(tasks)
+        batches = self.plan_batches(costs)
+        if self.progress is not None:
+            function = self.track_progress(function, len(tasks))
+        batch_results = Parallel(
+            n_jobs=min(self.max_threads, max(len(batches), 1)), backend="threading"
+        )(
+            delayed(run_batch)(function, [tasks[index] for index in batch])
+            for batch in batches
+        )
+
+        results = [None] * len(tasks)
+        for batch, batch_result in zip(batches, batch_results):
+            for index, result in zip(batch, batch_result):
+                results[index] = result
+        return results
+
+    def track_progress(self, function: Callable, total: int) -> Callable:
+        """Wrap the function of the tasks to call the progress callback before each
+        task with the number of tasks done"""
+        lock = threading.Lock()
+        done = [0]
+
+        def tracked_function(task):
+            with lock:
+                completed = done[0]
+            self.progress(completed, total)
+            result = function(task)
+            with lock:
+                done[0] += 1
+            return result
+
+        return tracked_function
+
+
+def run_batch(function: Callable, tasks: Sequence) -> list:
+    """Run a batch of tasks holding one of the slots of the process"""
+    with _process_slots:
+        return [function(task) for task in tasks]
@@ -1,3 +1,6 @@
+import json
+from typing import Callable
+
 import calculations.trend.services as trend_services
 import polars as pl
 from base.general import ProcessingType
@@ -6,9 +9,11 @@ from base.metrics import DualColumnMetric, SingleColumnMetric
 from base.metrics_trend import BaseMetricsTrend
 from calculations import utils as calculation_utils
 from calculations.subgroup_insights import services as subgroup_trend_services
+from calculations.subgroup_insights.cube_cache import SubgroupCubeCache
 from calculations.subgroup_insights.periodic_subgroup_insights_trend import (
     PeriodicSubgroupMetricsTrend,
 )
+from calculations.subgroup_insights.top_k_subgroups import TopKSubgroups
 from polars import DataFrame
 
 
@@ -18,18 +23,119 @@ class SegmentSubgroupInsights(BaseMetricsTrend):
         insights: MetricsInsight,
         processing_type: ProcessingType = "in_memory",
         time_intervals: int = None,
+        cube: bool = False,
+        max_threads: int = None,
+        top_k: int = None,
+        top_k_order_by: str = "absolute_impact_diff",
+        cube_cache: SubgroupCubeCache = None,
+        progress: Callable = None,
     ) -> None:
         super().__init__()
         self.processing_type = processing_type
         self.time_intervals = time_intervals
         self.insights = insights
+        self.cube = cube
+        self.max_threads = max_threads
+        # only the top_k subgroups of largest |top_k_order_by| are returned
+        self.top_k = top_k
+        self.top_k_order_by = top_k_order_by
+        # partials of the cube reused across insights over the same rows
+        self.cube_cache = cube_cache
+        # called with the combinations done and their total before every combination,
+        # an exception it raises stops the calculation, e.g. once its job is cancelled
+        self.progress = progress
+        self.subgroup_dictionary = None
 
     def calculate(
         self,
         trend_df: DataFrame,
-        baseline_filtered_df: pl.DataFrame,
-        comparison_filtered_df: pl.DataFrame,
+        baseline_filtered_df: pl.DataFrame | pl.LazyFrame,
+        comparison_filtered_df: pl.DataFrame | pl.LazyFrame,
+        data_fingerprint: str = None,
+        dataframe: pl.DataFrame | pl.LazyFrame = None,
     ):
+        """Calculate the subgroup insights for the baseline and comparison segment
+
+        Args:
+            trend_df (DataFrame): Segment trends calculated by SegmentComparison
+            baseline_filtered_df (pl.DataFrame | pl.LazyFrame): Baseline segment data
+            comparison_filtered_df (pl.DataFrame | pl.LazyFrame): Comparison segment data
+            data_fingerprint (str, optional): fingerprint of the source data, with the
+                segments and time periods it keys the partials of the cube cache
+                unless they are aggregated from the source data
+            dataframe (pl.DataFrame | pl.LazyFrame, optional): source data the
+                segments were selected from. In single pass mode with the cube and
+                a data fingerprint, the partials of the cube are aggregated from
+                the source rows grouped with the columns the segments select their
+                rows on and keyed by the data fingerprint alone, so they are reused
+                by the insights over other segments. Lazy source data is not
+                collected, the partials are then aggregated from the segment rows.
+
+        When SegmentComparison ran in single pass mode both segments are the same data
+        tagged with the segment mask, and every combination is aggregated once for both.
+        The sub_group keys are encoded by self.subgroup_dictionary, shared by both
+        segments, which renders them as JSON for the output.
+
+        With top_k only the top subgroups are returned, by decreasing
+        |top_k_order_by|. In single pass mode they are kept while the combinations are
+        aggregated, so the subgroups which can not enter them are never merged.
+        """
+        # every dimension combination runs its own group_by, so lazy segment data
+        # is materialized once here instead of being re-scanned per combination
+        if isinstance(baseline_filtered_df, pl.LazyFrame) or isinstance(
+            comparison_filtered_df, pl.LazyFrame
+        ):
+            baseline_filtered_df, comparison_filtered_df = pl.collect_all(
+                [baseline_filtered_df.lazy(), comparison_filtered_df.lazy()]
+            )
+
+        periodic_subgroup_trend_calculator = PeriodicSubgroupMetricsTrend(
+            processing_type=self.processing_type,
+            cube=self.cube,
+            max_threads=self.max_threads,
+            cube_cache=self.cube_cache,
+            progress=self.progress,
+        )
+        if calculation_utils.SEGMENT_MASK_COLUMN in baseline_filtered_df.columns:
+            self.subgroup_dictionary = (
+                periodic_subgroup_trend_calculator.build_subgroup_dictionary(
+                    [baseline_filtered_df], self.insights
+                )
+            )
+            top_k_subgroups = self.build_top_k_subgroups()
+            source_dataframe = None
+            segment_fingerprint = self.build_segment_fingerprint(data_fingerprint)
+            if (
+                self.cube
+                and data_fingerprint is not None
+                and isinstance(dataframe, pl.DataFrame)
+            ):
+                source_dataframe = trend_services.apply_filters(
+                    dataframe,
+                    trend_services.build_filter_exp(
+                        self.insights.metrics.filters, self.processing_type
+                    ),
+                    self.processing_type,
+                )
+                segment_fingerprint = data_fingerprint
+            subgroup_trends = periodic_subgroup_trend_calculator.calculate_segments(
+                trend_df=trend_df,
+                dataframe=baseline_filtered_df,
+                metric_details=self.insights,
+                segment_labels=trend_services.get_segment_labels(self.insights),
+                subgroup_dictionary=self.subgroup_dictionary,
+                top_k_subgroups=top_k_subgroups,
+                data_fingerprint=segment_fingerprint,
+                source_dataframe=source_dataframe,
+            )
+            if top_k_subgroups is not None:
+                return subgroup_trends
+            return subgroup_trend_services.merge_segment_baseline_and_comparison_data(
+                baseline_df=subgroup_trends["baseline"],
+                comparison_df=subgroup_trends["comparison"],
+                metric_name=self.insights.name,
+            )
+
         # update datelabel with segment name
         # need this step in subgroup first
         baseline_filtered_df = baseline_filtered_df.with_columns(
@@ -66,8 +172,11 @@ class SegmentSubgroupInsights(BaseMetricsTrend):
             )
         )
 
-        periodic_subgroup_trend_calculator = PeriodicSubgroupMetricsTrend(
-            processing_type=self.processing_type
+        # both segments share the keys of their subgroups
+        self.subgroup_dictionary = (
+            periodic_subgroup_trend_calculator.build_subgroup_dictionary(
+                [baseline_filtered_df, comparison_filtered_df], self.insights
+            )
         )
 
         # calculate trend
@@ -75,12 +184,24 @@ class SegmentSubgroupInsights(BaseMetricsTrend):
             trend_df=trend_df,
             dataframe=baseline_filtered_df,
             metric_details=self.insights,
+            subgroup_dictionary=self.subgroup_dictionary,
+            data_fingerprint=self.build_segment_fingerprint(
+                data_fingerprint, "baseline"
+            ),
         )
+        baseline_pruned_subgroups = self.insights.pruned_subgroups
         comparison_df = periodic_subgroup_trend_calculator.calculate(
             trend_df=trend_df,
             dataframe=comparison_filtered_df,
             metric_details=self.insights,
+            subgroup_dictionary=self.subgroup_dictionary,
+            data_fingerprint=self.build_segment_fingerprint(
+                data_fingerprint, "comparison"
+            ),
         )
+        # each segment is pruned on its own in this mode
+        if baseline_pruned_subgroups is not None:
+            self.insights.pruned_subgroups += baseline_pruned_subgroups
 
         baseline_df = (
             subgroup_trend_services.merge_segment_baseline_and_comparison_data(
@@ -90,4 +211,55 @@ class SegmentSubgroupInsights(BaseMetricsTrend):
             )
         )
 
+        top_k_subgroups = self.build_top_k_subgroups()
+        if top_k_subgroups is not None:
+            top_k_subgroups.select(baseline_df)
+            baseline_df = top_k_subgroups.result()
+
         return baseline_df
+
+    def build_top_k_subgroups(self):
+        """Top subgroups selection of the top_k option, None without it"""
+        if self.top_k is None:
+            return None
+        return TopKSubgroups(
+            top_k=self.top_k,
+            metric_name=self.insights.name,
+            order_by=self.top_k_order_by,
+        )
+
+    def build_segment_fingerprint(
+        self, data_fingerprint: str, segment: str = None
+    ) -> str | None:
+        """Fingerprint of the rows of the segments, the source data fingerprint with
+        the segment filters and time periods selecting the rows
+
+        Args:
+            data_fingerprint (str): fingerprint of the source data
+            segment (str, optional): segment of the rows, both segments when not given
+        """
+        if data_fingerprint is None:
+            return None
+        return json.dumps(
+            [
+                data_fingerprint,
+                segment,
+                [
+                    [
+                        segment_filter.model_dump(mode="json")
+                        for segment_filter in filters
+                    ]
+                    for filters in (
+                        self.insights.baseline_segment or [],
+                        self.insights.comparison_segment or [],
+                    )
+                ],
+                [
+                    [str(period_date) for period_date in time_period]
+                    for time_period in (
+                        self.insights.baseline_time_period or [],
+                        self.insights.comparison_time_period or [],
+                    )
+                ],
+            ]
+        )
@@ -1,10 +1,20 @@
 import itertools
+import math
+from typing import Callable, List
 
 import polars as pl
 from base.general import ProcessingType
+from calculations import utils as calculation_utils
 from calculations.subgroup_insights import repository as subgroup_trend_repository
+from calculations.subgroup_insights.cube_cache import SubgroupCubeCache
+from calculations.subgroup_insights.scheduler import SubgroupScheduler
+from calculations.subgroup_insights.subgroup_index import SubgroupIndex
+from calculations.subgroup_insights.top_k_subgroups import TopKSubgroups
 from joblib import Parallel, delayed
 
+# a grouping set of the subgroup cube holds at most this fraction of the rows
+CUBE_PARTIAL_ROWS_RATIO = 0.1
+
 
 def build_dimension_combinations(dimensions, rca_depth: int = None):
     # taking combinations of length 1, 2 and 3 only
@@ -16,6 +26,173 @@ def build_dimension_combinations(dimensions, rca_depth: int = None):
     return all_combinations
 
 
+def estimate_combination_costs(all_combinations, cardinalities, rows):
+    """Estimate the cost of aggregating each combination from the rows, the rows
+    times its groups, the product of the cardinalities of its dimensions bounded by
+    the rows
+
+    Args:
+        all_combinations (list): combinations of dimensions
+        cardinalities (dict): number of unique values of each dimension
+        rows (int): number of rows aggregated
+    """
+    return [
+        rows
+        * min(math.prod(cardinalities[dimension] for dimension in combination), rows)
+        for combination in all_combinations
+    ]
+
+
+def estimate_polar_combination_costs(all_combinations, dataframe):
+    """Estimate the cost of aggregating each combination from the dataframe"""
+    dimensions = list(
+        dict.fromkeys(
+            dimension for combination in all_combinations for dimension in combination
+        )
+    )
+    return estimate_combination_costs(
+        all_combinations,
+        subgroup_trend_repository.get_polar_cardinalities(dataframe, dimensions),
+        dataframe.height,
+    )
+
+
+def offer_top_k_subgroups(segment_dfs, top_k_subgroups=None):
+    """Hand the segment subgroups of a combination to top_k_subgroups, which keeps
+    the top ones, instead of returning them when it is given"""
+    if top_k_subgroups is None:
+        return segment_dfs
+    top_k_subgroups.offer(segment_dfs)
+    return None
+
+
+def collect_segment_subgroups(results, segments, top_k_subgroups=None):
+    """Concatenate the subgroups of every combination of each segment, or return the
+    merged top subgroups when top_k_subgroups kept them"""
+    if top_k_subgroups is not None:
+        return top_k_subgroups.result()
+    return {
+        segment: pl.concat([result[segment] for result in results])
+        for segment in segments
+    }
+
+
+def is_subgroup_pruning_enabled(metric_details):
+    """Whether the insight sets a support or impact threshold on its subgroups"""
+    return (
+        metric_details.min_subgroup_support is not None
+        or metric_details.min_subgroup_impact is not None
+    )
+
+
+def apply_pruned_subgroup_trend_agg(
+    all_combinations,
+    dataframe,
+    aggregate_combination,
+    processing_type,
+    metric_details,
+    subgroup_dictionary,
+    scheduler: SubgroupScheduler = None,
+    top_k_subgroups: TopKSubgroups = None,
+    cube: dict = None,
+):
+    """Aggregate the combinations level by level, in the apriori style. A combination
+    is only aggregated over the rows of the subgroups whose parents, one dimension
+    shorter, all passed the support and impact thresholds, and is skipped when one
+    of its parent combinations has no passing subgroup left.
+
+    With a cube the candidates of a combination are its partials semi-joined with
+    the passing subgroups of its parents, instead of its rows.
+
+    The number of pruned subgroups is set on metric_details.pruned_subgroups.
+
+    Args:
+        all_combinations (list): combinations of dimensions
+        dataframe (pl.DataFrame): rows to aggregate
+        aggregate_combination (Callable): aggregates the subgroup impacts of a
+            combination from its rows or partials, one dataframe or one dataframe
+            per segment
+        processing_type (ProcessingType): Processing type depending on ProcessingType
+        metric_details (MetricsInsight): Metrics details holding the thresholds
+        subgroup_dictionary (SubgroupDictionary): encoding of the subgroup keys
+        scheduler (SubgroupScheduler, optional): runs the combinations of a level
+        top_k_subgroups (TopKSubgroups, optional): keeps the top segment subgroups
+            of the combinations once pruned, instead of returning them
+        cube (dict, optional): partials of each combination from
+            build_subgroup_cube
+
+    Returns:
+        list: subgroup impacts of each combination which was not pruned
+    """
+    results = []
+    pruned_subgroups = 0
+    if processing_type == ProcessingType.IN_MEMORY:
+        scheduler = scheduler or SubgroupScheduler()
+        if cube is not None:
+            costs = {
+                combination: cube[combination].height
+                for combination in all_combinations
+            }
+        else:
+            costs = dict(
+                zip(
+                    all_combinations,
+                    estimate_polar_combination_costs(all_combinations, dataframe),
+                )
+            )
+
+        def aggregate_pruned_combination(combination, passing_keys):
+            result = aggregate_combination(
+                combination,
+                subgroup_trend_repository.apply_polar_subgroup_pruning(
+                    combination,
+                    dataframe if cube is None else cube[combination],
+                    passing_keys,
+                ),
+            )
+            subgroup_dfs = result if isinstance(result, dict) else {None: result}
+            subgroup_dfs, combination_keys, pruned = (
+                subgroup_trend_repository.prune_polar_subgroups(
+                    subgroup_dfs, combination, subgroup_dictionary, metric_details
+                )
+            )
+            if not isinstance(result, dict):
+                subgroup_dfs = subgroup_dfs[None]
+            else:
+                subgroup_dfs = offer_top_k_subgroups(subgroup_dfs, top_k_subgroups)
+            return subgroup_dfs, combination_keys, pruned
+
+        passing_keys = {}
+        for depth in sorted({len(combination) for combination in all_combinations}):
+            level = [
+                combination
+                for combination in all_combinations
+                if len(combination) == depth
+                and all(
+                    passing_keys.get(subset) is not None
+                    and passing_keys[subset].height > 0
+                    for subset in itertools.combinations(combination, depth - 1)
+                    if subset
+                )
+            ]
+            level_results = scheduler.map(
+                lambda combination: aggregate_pruned_combination(
+                    combination, passing_keys
+                ),
+                level,
+                [costs[combination] for combination in level],
+            )
+            for combination, (subgroup_dfs, combination_keys, pruned) in zip(
+                level, level_results
+            ):
+                results.append(subgroup_dfs)
+                passing_keys[combination] = combination_keys
+                pruned_subgroups += pruned
+
+    metric_details.pruned_subgroups = pruned_subgroups
+    return results
+
+
 def apply_subgroup_trend_agg(
     all_combinations,
     trend_df,
@@ -24,21 +201,131 @@ def apply_subgroup_trend_agg(
     processing_type,
     time_intervals,
     metric_details,
+    subgroup_dictionary,
+    scheduler: SubgroupScheduler = None,
 ):
     num_cores = -1  # Set to the number of available cores, or a specific number
-    if processing_type == ProcessingType.IN_MEMORY:
+    if processing_type == ProcessingType.IN_MEMORY and is_subgroup_pruning_enabled(
+        metric_details
+    ):
+        results = apply_pruned_subgroup_trend_agg(
+            all_combinations=all_combinations,
+            dataframe=dataframe,
+            aggregate_combination=lambda combination, combination_df: (
+                subgroup_trend_repository.apply_polar_subgroup_trend_agg(
+                    combination,
+                    trend_df,
+                    combination_df,
+                    agg_expr,
+                    metric_details,
+                    subgroup_dictionary,
+                )
+            ),
+            processing_type=processing_type,
+            metric_details=metric_details,
+            subgroup_dictionary=subgroup_dictionary,
+            scheduler=scheduler,
+        )
+        merged_df = pl.concat(results)
+    elif processing_type == ProcessingType.IN_MEMORY:
+        results = (scheduler or SubgroupScheduler()).map(
+            lambda combination: (
+                subgroup_trend_repository.apply_polar_subgroup_trend_agg(
+                    combination,
+                    trend_df,
+                    dataframe,
+                    agg_expr,
+                    metric_details,
+                    subgroup_dictionary,
+                )
+            ),
+            all_combinations,
+            estimate_polar_combination_costs(all_combinations, dataframe),
+        )
+        merged_df = pl.concat(results)
+
+    elif processing_type == ProcessingType.DATABRICKS:
         results = Parallel(n_jobs=num_cores, backend="threading")(
-            delayed(subgroup_trend_repository.apply_polar_subgroup_trend_agg)(
-                combination, trend_df, dataframe, agg_expr, metric_details
+            delayed(subgroup_trend_repository.apply_databricks_subgroup_trend_agg)(
+                combination, trend_df, dataframe, agg_expr
             )
             for combination in all_combinations
         )
-        merged_df = pl.concat(results)
+        merged_df = results  # combine results into single results for all combinations
+    return merged_df
+
+
+def apply_segment_subgroup_trend_agg(
+    all_combinations,
+    trend_df,
+    dataframe,
+    segment_agg_exprs,
+    segment_labels,
+    processing_type,
+    metric_details,
+    subgroup_dictionary,
+    scheduler: SubgroupScheduler = None,
+    cube_cache: SubgroupCubeCache = None,
+    cache_prefix: str = None,
+    top_k_subgroups: TopKSubgroups = None,
+):
+    """Aggregate every combination for all segments of data tagged with the segment
+    mask, each combination is scanned once for all segments. With top_k_subgroups the
+    segments of each combination are merged as soon as it is aggregated and only the
+    merged top subgroups are returned."""
+    num_cores = -1  # Set to the number of available cores, or a specific number
+    if processing_type == ProcessingType.IN_MEMORY and is_subgroup_pruning_enabled(
+        metric_details
+    ):
+        # a subgroup is kept when it passes the thresholds in either segment
+        results = apply_pruned_subgroup_trend_agg(
+            all_combinations=all_combinations,
+            dataframe=dataframe,
+            aggregate_combination=lambda combination, combination_df: (
+                subgroup_trend_repository.apply_polar_segment_subgroup_trend_agg(
+                    combination,
+                    trend_df,
+                    combination_df,
+                    segment_agg_exprs,
+                    segment_labels,
+                    metric_details,
+                    subgroup_dictionary,
+                )
+            ),
+            processing_type=processing_type,
+            metric_details=metric_details,
+            subgroup_dictionary=subgroup_dictionary,
+            scheduler=scheduler,
+            top_k_subgroups=top_k_subgroups,
+        )
+        merged_df = collect_segment_subgroups(
+            results, segment_agg_exprs, top_k_subgroups
+        )
+    elif processing_type == ProcessingType.IN_MEMORY:
+        results = (scheduler or SubgroupScheduler()).map(
+            lambda combination: offer_top_k_subgroups(
+                subgroup_trend_repository.apply_polar_segment_subgroup_trend_agg(
+                    combination,
+                    trend_df,
+                    dataframe,
+                    segment_agg_exprs,
+                    segment_labels,
+                    metric_details,
+                    subgroup_dictionary,
+                ),
+                top_k_subgroups,
+            ),
+            all_combinations,
+            estimate_polar_combination_costs(all_combinations, dataframe),
+        )
+        merged_df = collect_segment_subgroups(
+            results, segment_agg_exprs, top_k_subgroups
+        )
 
     elif processing_type == ProcessingType.DATABRICKS:
         results = Parallel(n_jobs=num_cores, backend="threading")(
             delayed(subgroup_trend_repository.apply_databricks_subgroup_trend_agg)(
-                combination, trend_df, dataframe, agg_expr
+                combination, trend_df, dataframe, segment_agg_exprs
             )
             for combination in all_combinations
         )
@@ -46,15 +333,362 @@ def apply_subgroup_trend_agg(
     return merged_df
 
 
+def plan_subgroup_cube(all_combinations, cardinalities, max_partial_rows):
+    """Plan the grouping sets aggregated from the rows so that every combination is
+    contained in one of them. A grouping set is grown from an uncovered combination
+    with the dimension covering the most uncovered combinations, as long as the
+    product of the cardinalities of its dimensions stays under max_partial_rows.
+
+    Args:
+        all_combinations (list): combinations of dimensions
+        cardinalities (dict): number of unique values of each dimension
+        max_partial_rows (float): bound of the rows of the partials of a grouping set
+    """
+    dimensions = list(
+        dict.fromkeys(
+            dimension for combination in all_combinations for dimension in combination
+        )
+    )
+    uncovered = sorted(
+        (frozenset(combination) for combination in all_combinations),
+        key=len,
+        reverse=True,
+    )
+    grouping_sets = []
+    while uncovered:
+        grouping_set = set(uncovered[0])
+        while True:
+            best_dimension, best_gain = None, 0
+            for dimension in dimensions:
+                if dimension in grouping_set:
+                    continue
+                candidate_set = grouping_set | {dimension}
+                if (
+                    math.prod(cardinalities[column] for column in candidate_set)
+                    > max_partial_rows
+                ):
+                    continue
+                gain = sum(
+                    combination <= candidate_set and not combination <= grouping_set
+                    for combination in uncovered
+                )
+                if gain > best_gain:
+                    best_dimension, best_gain = dimension, gain
+            if best_dimension is None:
+                break
+            grouping_set.add(best_dimension)
+
+        grouping_sets.append(
+            tuple(dimension for dimension in dimensions if dimension in grouping_set)
+        )
+        uncovered = [
+            combination for combination in uncovered if not combination <= grouping_set
+        ]
+    return grouping_sets
+
+
+def build_subgroup_cube(
+    all_combinations,
+    dataframe,
+    partial_exps,
+    group_keys,
+    processing_type,
+    scheduler: SubgroupScheduler = None,
+    cube_cache: SubgroupCubeCache = None,
+    cache_prefix: str = None,
+):
+    """Aggregate the partials of every combination. The rows are scanned once per
+    grouping set of plan_subgroup_cube, then the combinations are rolled up level by
+    level from the deepest one, each from the smallest partials of its supersets.
+
+    With a cube cache the partials of the combinations cached under the cache prefix
+    are reused, the other combinations are rolled up from a cached superset when
+    there is one, and only the combinations left are planned into grouping sets.
+
+    Args:
+        all_combinations (list): combinations of dimensions
+        dataframe (pl.DataFrame): rows to aggregate
+        partial_exps (tuple): partial keys, partial, rollup and final expressions
+        group_keys (List[str]): columns grouped along with every combination
+        processing_type (ProcessingType): Processing type depending on ProcessingType
+        scheduler (SubgroupScheduler, optional): runs the combinations of a level
+        cube_cache (SubgroupCubeCache, optional): partials shared across calculations
+        cache_prefix (str, optional): fingerprint of the rows and of the metric
+            aggregated, the cube cache is only used with it
+
+    Returns:
+        dict: partials of each combination
+    """
+    cube = {}
+    if processing_type == ProcessingType.IN_MEMORY:
+        scheduler = scheduler or SubgroupScheduler()
+        partial_keys = partial_exps[0]
+        if cache_prefix is None:
+            cube_cache = None
+
+        cache_keys = {}
+        if cube_cache is not None:
+            for combination in all_combinations:
+                cache_keys[combination] = cube_cache.get_key(
+                    cache_prefix, combination, group_keys
+                )
+                partial_df = cube_cache.get(cache_keys[combination])
+                if partial_df is not None:
+                    cube[frozenset(combination)] = partial_df
+        missing = [
+            combination
+            for combination in all_combinations
+            if frozenset(combination) not in cube
+        ]
+        # only the combinations without a cached superset need the rows
+        uncovered = [
+            combination
+            for combination in missing
+            if not any(frozenset(combination) < cached for cached in cube)
+        ]
+
+        grouping_sets = []
+        if missing:
+            dimensions = list(
+                dict.fromkeys(
+                    dimension for combination in missing for dimension in combination
+                )
+            )
+            cardinalities = subgroup_trend_repository.get_polar_cardinalities(
+                dataframe, list(dict.fromkeys(dimensions + group_keys + partial_keys))
+            )
+        if uncovered:
+            # no rows, every cardinality is 0 and so is their product
+            keys_rows = max(
+                math.prod(
+                    cardinalities[column]
+                    for column in set(group_keys + partial_keys) - set(dimensions)
+                ),
+                1,
+            )
+            grouping_sets = plan_subgroup_cube(
+                uncovered,
+                cardinalities,
+                max_partial_rows=dataframe.height * CUBE_PARTIAL_ROWS_RATIO / keys_rows,
+            )
+
+        levels = [grouping_sets] + [
+            [combination for combination in missing if len(combination) == depth]
+            for depth in sorted(
+                {len(combination) for combination in missing}, reverse=True
+            )
+        ]
+        for level in levels:
+            if not level:
+                continue
+            results = scheduler.map(
+                lambda combination: (
+                    subgroup_trend_repository.aggregate_polar_cube_combination(
+                        combination, dataframe, cube, partial_exps, group_keys
+                    )
+                ),
+                level,
+                estimate_combination_costs(level, cardinalities, dataframe.height),
+            )
+            cube.update(
+                (frozenset(combination), partial_df)
+                for combination, partial_df in zip(level, results)
+            )
+
+        if cube_cache is not None:
+            for combination in missing:
+                cube_cache.add(cache_keys[combination], cube[frozenset(combination)])
+    return {
+        combination: cube[frozenset(combination)] for combination in all_combinations
+    }
+
+
+def apply_subgroup_cube_trend_agg(
+    all_combinations,
+    trend_df,
+    dataframe,
+    partial_exps,
+    processing_type,
+    metric_details,
+    subgroup_dictionary,
+    scheduler: SubgroupScheduler = None,
+    cube_cache: SubgroupCubeCache = None,
+    cache_prefix: str = None,
+):
+    """Aggregate every combination through the subgroup cube instead of scanning the
+    rows once per combination, the results match apply_subgroup_trend_agg. The
+    support and impact thresholds prune the subgroups from the partials of the cube,
+    which are aggregated and cached whatever the thresholds."""
+    if processing_type == ProcessingType.IN_MEMORY:
+        scheduler = scheduler or SubgroupScheduler()
+        cube = build_subgroup_cube(
+            all_combinations=all_combinations,
+            dataframe=dataframe,
+            partial_exps=partial_exps,
+            group_keys=[calculation_utils.get_time_column(dataframe)],
+            processing_type=processing_type,
+            scheduler=scheduler,
+            cube_cache=cube_cache,
+            cache_prefix=cache_prefix,
+        )
+
+        def aggregate_combination(combination, partial_df):
+            return subgroup_trend_repository.apply_polar_subgroup_cube_trend_agg(
+                combination,
+                trend_df,
+                partial_df,
+                partial_exps,
+                metric_details,
+                subgroup_dictionary,
+            )
+
+        if is_subgroup_pruning_enabled(metric_details):
+            results = apply_pruned_subgroup_trend_agg(
+                all_combinations=all_combinations,
+                dataframe=dataframe,
+                aggregate_combination=aggregate_combination,
+                processing_type=processing_type,
+                metric_details=metric_details,
+                subgroup_dictionary=subgroup_dictionary,
+                scheduler=scheduler,
+                cube=cube,
+            )
+        else:
+            results = scheduler.map(
+                lambda combination: aggregate_combination(
+                    combination, cube[combination]
+                ),
+                all_combinations,
+                [cube[combination].height for combination in all_combinations],
+            )
+        merged_df = pl.concat(results)
+
+    elif processing_type == ProcessingType.DATABRICKS:
+        merged_df = subgroup_trend_repository.apply_databricks_subgroup_trend_agg()
+    return merged_df
+
+
+def apply_segment_subgroup_cube_trend_agg(
+    all_combinations,
+    trend_df,
+    dataframe,
+    partial_exps,
+    segment_labels,
+    processing_type,
+    metric_details,
+    subgroup_dictionary,
+    scheduler: SubgroupScheduler = None,
+    cube_cache: SubgroupCubeCache = None,
+    cache_prefix: str = None,
+    top_k_subgroups: TopKSubgroups = None,
+    group_keys: List[str] = None,
+    tag_partials: Callable = None,
+):
+    """Aggregate every combination for all segments of data tagged with the segment
+    mask through the subgroup cube, the results match
+    apply_segment_subgroup_trend_agg.
+
+    The partials are grouped with the segment mask by default. With tag_partials they
+    are instead grouped with the group keys, the columns the segments select their
+    rows on, and tagged with the segment mask once taken from the cube, so the
+    cached partials do not depend on the segments.
+    """
+    if processing_type == ProcessingType.IN_MEMORY:
+        scheduler = scheduler or SubgroupScheduler()
+        cube = build_subgroup_cube(
+            all_combinations=all_combinations,
+            dataframe=dataframe,
+            partial_exps=partial_exps,
+            group_keys=group_keys or [calculation_utils.SEGMENT_MASK_COLUMN],
+            processing_type=processing_type,
+            scheduler=scheduler,
+            cube_cache=cube_cache,
+            cache_prefix=cache_prefix,
+        )
+        if tag_partials is not None:
+            cube = {
+                combination: tag_partials(partial_df)
+                for combination, partial_df in cube.items()
+            }
+
+        def aggregate_combination(combination, partial_df):
+            return (
+                subgroup_trend_repository.apply_polar_segment_subgroup_cube_trend_agg(
+                    combination,
+                    trend_df,
+                    partial_df,
+                    partial_exps,
+                    segment_labels,
+                    metric_details,
+                    subgroup_dictionary,
+                )
+            )
+
+        if is_subgroup_pruning_enabled(metric_details):
+            # a subgroup is kept when it passes the thresholds in either segment
+            results = apply_pruned_subgroup_trend_agg(
+                all_combinations=all_combinations,
+                dataframe=dataframe,
+                aggregate_combination=aggregate_combination,
+                processing_type=processing_type,
+                metric_details=metric_details,
+                subgroup_dictionary=subgroup_dictionary,
+                scheduler=scheduler,
+                top_k_subgroups=top_k_subgroups,
+                cube=cube,
+            )
+        else:
+            results = scheduler.map(
+                lambda combination: offer_top_k_subgroups(
+                    aggregate_combination(combination, cube[combination]),
+                    top_k_subgroups,
+                ),
+                all_combinations,
+                [cube[combination].height for combination in all_combinations],
+            )
+        merged_df = collect_segment_subgroups(results, segment_labels, top_k_subgroups)
+
+    elif processing_type == ProcessingType.DATABRICKS:
+        merged_df = subgroup_trend_repository.apply_databricks_subgroup_trend_agg()
+    return merged_df
+
+
+def build_subgroup_index(
+    trend_df,
+    subgroup_dictionary,
+    processing_type: ProcessingType = "in_memory",
+):
+    """Build the index of the subgroups of a subgroup impact result by dimension value
+    and depth, reused by every apply_filter_on_subgroup_impact_df on the result.
+
+    Args:
+        trend_df (pl.DataFrame): subgroup impacts keyed by sub_group
+        subgroup_dictionary (SubgroupDictionary): encoding of the sub_group keys
+        processing_type (ProcessingType): Processing type depending on ProcessingType
+    """
+    if processing_type == ProcessingType.IN_MEMORY:
+        return SubgroupIndex(trend_df, subgroup_dictionary)
+    elif processing_type == ProcessingType.DATABRICKS:
+        return None
+
+
 def apply_filter_on_subgroup_impact_df(
     trend_df,
     dimension_value_pairs,
     processing_type: ProcessingType = "in_memory",
+    subgroup_dictionary=None,
+    subgroup_index=None,
 ):
-    """Apply filter on subgroup impact dataframe to extract data for required dimension_value_pairs."""
+    """Apply filter on subgroup impact dataframe to extract data for required dimension_value_pairs.
+
+    Repeated lookups on the same result should pass the index of build_subgroup_index.
+    """
     if processing_type == ProcessingType.IN_MEMORY:
         return subgroup_trend_repository.apply_polar_filter_on_subgroup_impact_df(
-            trend_df=trend_df, dimension_value_pairs=dimension_value_pairs
+            trend_df=trend_df,
+            dimension_value_pairs=dimension_value_pairs,
+            subgroup_dictionary=subgroup_dictionary,
+            subgroup_index=subgroup_index,
         )
     elif processing_type == ProcessingType.DATABRICKS:
         return subgroup_trend_repository.apply_databricks_filter_on_subgroup_impact_df(
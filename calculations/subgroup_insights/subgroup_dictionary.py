@@ -0,0 +1,225 @@
+"""Dictionary encoding of the subgroup keys"""
+
+import json
+from typing import Any, Dict, List, Optional
+
+import polars as pl
+
+# keys whose mixed radix does not fit in 64 bits fall back to a string of codes
+SUBGROUP_KEY_MAX = 2**64 - 1
+ABSENT_CODE = 0
+
+
+class SubgroupDictionary:
+    """Dictionary of the values of the dimensions combined into subgroups.
+
+    Every value of a dimension is coded 1..n in sorted order, n + 1 codes null and 0
+    marks a dimension absent from the subgroup. The sub_group key of a subgroup is the
+    mixed radix number of the codes of all dimensions, an UInt64 unique across every
+    combination, or a string of the codes when the radix does not fit in 64 bits.
+    The JSON view of the keys is only rendered for the output.
+    """
+
+    def __init__(self, dimensions: List[str], values: Dict[str, pl.Series]) -> None:
+        self.dimensions = list(dimensions)
+        self.values = values
+        self.radixes = {
+            dimension: len(values[dimension]) + 2 for dimension in self.dimensions
+        }
+        self.multipliers = {}
+        multiplier = 1
+        for dimension in self.dimensions:
+            self.multipliers[dimension] = multiplier
+            multiplier *= self.radixes[dimension]
+        self.is_packed = multiplier - 1 <= SUBGROUP_KEY_MAX
+        self.codes = {
+            dimension: {
+                value: code
+                for code, value in enumerate(values[dimension].to_list(), start=1)
+            }
+            for dimension in self.dimensions
+        }
+
+    @classmethod
+    def from_dataframes(
+        cls,
+        dataframes: List[pl.DataFrame | pl.LazyFrame],
+        dimensions: List[str],
+    ) -> "SubgroupDictionary":
+        """Build the dictionary of the dimension values found in the dataframes
+
+        Args:
+            dataframes (List[pl.DataFrame | pl.LazyFrame]): data the subgroups are
+                aggregated from
+            dimensions (List[str]): dimensions combined into subgroups, the order of
+                the keys in the JSON view
+        """
+        dimension_values = (
+            pl.concat([dataframe.lazy().select(dimensions) for dataframe in dataframes])
+            .select(pl.all().drop_nulls().unique().sort().implode())
+            .collect()
+        )
+        values = {
+            dimension: dimension_values.get_column(dimension)[0]
+            for dimension in dimensions
+        }
+        return cls(dimensions, values)
+
+    @property
+    def key_dtype(self) -> pl.DataType:
+        """Data type of the sub_group keys"""
+        return pl.UInt64 if self.is_packed else pl.Utf8
+
+    def build_code_exp(self, dimension: str) -> pl.Expr:
+        """Build the expression coding the values of a dimension column"""
+        values = self.values[dimension]
+        return (
+            pl.col(dimension)
+            .replace_strict(
+                values,
+                pl.int_range(1, len(values) + 1, dtype=pl.UInt64, eager=True),
+                default=None,
+                return_dtype=pl.UInt64,
+            )
+            .fill_null(self.radixes[dimension] - 1)
+        )
+
+    def build_key_exp(self, combination) -> pl.Expr:
+        """Build the sub_group key expression of a combination from its dimension
+        columns
+
+        Args:
+            combination (tuple): dimensions of the subgroups
+        """
+        if self.is_packed:
+            key_expr = pl.lit(0, dtype=pl.UInt64)
+            for dimension in combination:
+                key_expr = key_expr + self.build_code_exp(dimension) * pl.lit(
+                    self.multipliers[dimension], dtype=pl.UInt64
+                )
+            return key_expr.alias("sub_group")
+
+        return pl.concat_str(
+            [
+                (
+                    self.build_code_exp(dimension).cast(pl.Utf8)
+                    if dimension in combination
+                    else pl.lit(str(ABSENT_CODE))
+                )
+                for dimension in self.dimensions
+            ],
+            separator=",",
+        ).alias("sub_group")
+
+    def get_code(self, dimension: str, value: Any) -> Optional[int]:
+        """Code of a dimension value, None when the value is not in the dictionary.
+        Values not found are also matched on their string, as values coming from
+        forms are.
+
+        Args:
+            dimension (str): dimension of the value
+            value (Any): value to code
+        """
+        if dimension not in self.codes:
+            return None
+        if value is None:
+            return self.radixes[dimension] - 1
+        codes = self.codes[dimension]
+        if value in codes:
+            return codes[value]
+        return next(
+            (code for known, code in codes.items() if str(known) == str(value)), None
+        )
+
+    def build_key(self, dimension_values: Dict[str, Any]):
+        """Key of a single subgroup, None when one of its values is not in the
+        dictionary
+
+        Args:
+            dimension_values (Dict[str, Any]): value of each dimension of the subgroup
+        """
+        codes = {
+            dimension: self.get_code(dimension, value)
+            for dimension, value in dimension_values.items()
+        }
+        if None in codes.values():
+            return None
+        if self.is_packed:
+            return sum(
+                code * self.multipliers[dimension] for dimension, code in codes.items()
+            )
+        return ",".join(
+            str(codes.get(dimension, ABSENT_CODE)) for dimension in self.dimensions
+        )
+
+    def build_decoded_code_exp(
+        self, dimension: str, key_column: str = "sub_group"
+    ) -> pl.Expr:
+        """Build the expression extracting the code of a dimension from the keys"""
+        if self.is_packed:
+            return (pl.col(key_column) // self.multipliers[dimension]) % self.radixes[
+                dimension
+            ]
+        return (
+            pl.col(key_column)
+            .str.split(",")
+            .list.get(self.dimensions.index(dimension))
+            .cast(pl.UInt64)
+        )
+
+    def build_values_exps(self, combination, key_column: str = "sub_group"):
+        """Build the expressions decoding the dimension values of a combination from
+        the keys, the columns have the data type of the dimensions
+
+        Args:
+            combination (tuple): dimensions of the subgroups
+            key_column (str, optional): column of the keys
+        """
+        return [
+            self.build_decoded_code_exp(dimension, key_column)
+            .replace_strict(
+                pl.int_range(
+                    1,
+                    len(self.values[dimension]) + 1,
+                    dtype=pl.UInt64,
+                    eager=True,
+                ),
+                self.values[dimension],
+                default=None,
+            )
+            .alias(dimension)
+            for dimension in combination
+        ]
+
+    def render(self, dataframe: pl.DataFrame, key_column: str = "sub_group"):
+        """Render the keys as the JSON of the dimension values of the subgroups, as
+        json.dumps of the dimension values in the order of the dimensions
+
+        Args:
+            dataframe (pl.DataFrame): data with sub_group keys
+            key_column (str, optional): column of the keys
+        """
+        pieces = []
+        for dimension in self.dimensions:
+            rendered_values = [
+                f"{json.dumps(dimension)}: {json.dumps(value)}"
+                for value in self.values[dimension].to_list() + [None]
+            ]
+            pieces.append(
+                self.build_decoded_code_exp(dimension, key_column).replace_strict(
+                    pl.int_range(
+                        1, self.radixes[dimension], dtype=pl.UInt64, eager=True
+                    ),
+                    pl.Series(rendered_values, dtype=pl.Utf8),
+                    default=None,
+                )
+            )
+        return dataframe.with_columns(
+            pl.concat_str(
+                [
+                    pl.lit("{"),
+                    pl.concat_str(pieces, separator=", ", ignore_nulls=True),
+                    pl.lit("}"),
+                ]
+            ).alias(key_column)
+        )
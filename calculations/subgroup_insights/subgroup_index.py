@@ -0,0 +1,106 @@
+"""Inverted index of the subgroups of a subgroup impact result"""
+
+from typing import Dict, FrozenSet, List, Tuple
+
+import polars as pl
+from base.insights import DimensionValuePair
+from calculations.subgroup_insights.subgroup_dictionary import (
+    ABSENT_CODE,
+    SubgroupDictionary,
+)
+
+ROW_ID_COLUMN = "__row_id"
+
+
+class SubgroupIndex:
+    """Index of the rows of a subgroup impact result by dimension value and by depth.
+
+    The rows of the subgroups of some dimension value pairs are the intersection of
+    the rows of every pair with the rows of the depth, so repeated lookups on the
+    same result do not scan it again.
+    """
+
+    def __init__(
+        self, trend_df: pl.DataFrame, subgroup_dictionary: SubgroupDictionary
+    ) -> None:
+        """Build the index over the sub_group keys of the result
+
+        Args:
+            trend_df (pl.DataFrame): subgroup impacts keyed by sub_group
+            subgroup_dictionary (SubgroupDictionary): encoding of the sub_group keys
+        """
+        self.trend_df = trend_df
+        self.subgroup_dictionary = subgroup_dictionary
+
+        dimensions = subgroup_dictionary.dimensions
+        codes_df = trend_df.select(
+            [
+                subgroup_dictionary.build_decoded_code_exp(dimension).alias(dimension)
+                for dimension in dimensions
+            ]
+        ).with_row_index(ROW_ID_COLUMN)
+
+        self.value_rows: Dict[Tuple[str, int], FrozenSet[int]] = {}
+        for dimension in dimensions:
+            value_rows_df = (
+                codes_df.filter(pl.col(dimension) != ABSENT_CODE)
+                .group_by(dimension)
+                .agg(pl.col(ROW_ID_COLUMN))
+            )
+            for code, row_ids in value_rows_df.iter_rows():
+                self.value_rows[(dimension, code)] = frozenset(row_ids)
+
+        depth_rows_df = (
+            codes_df.select(
+                pl.sum_horizontal(
+                    [
+                        (pl.col(dimension) != ABSENT_CODE).cast(pl.UInt32)
+                        for dimension in dimensions
+                    ]
+                ).alias("depth"),
+                ROW_ID_COLUMN,
+            )
+            .group_by("depth")
+            .agg(pl.col(ROW_ID_COLUMN))
+        )
+        self.depth_rows: Dict[int, FrozenSet[int]] = {
+            depth: frozenset(row_ids) for depth, row_ids in depth_rows_df.iter_rows()
+        }
+
+    def lookup(
+        self, dimension_value_pairs: List[DimensionValuePair], depth: int = None
+    ) -> List[int]:
+        """Rows of the subgroups holding all the dimension value pairs
+
+        Args:
+            dimension_value_pairs (List[DimensionValuePair]): dimension value pairs of
+                the subgroups
+            depth (int, optional): number of dimensions of the subgroups, by default
+                the subgroups of exactly the pairs, a deeper depth gives the
+                subgroups drilling down into them
+
+        Returns:
+            List[int]: sorted row ids
+        """
+        if depth is None:
+            depth = len(dimension_value_pairs)
+        row_sets = [self.depth_rows.get(depth, frozenset())]
+        for pair in dimension_value_pairs:
+            code = self.subgroup_dictionary.get_code(pair.dimension, pair.value)
+            row_sets.append(self.value_rows.get((pair.dimension, code), frozenset()))
+        return sorted(frozenset.intersection(*sorted(row_sets, key=len)))
+
+    def filter(
+        self, dimension_value_pairs: List[DimensionValuePair], depth: int = None
+    ) -> pl.DataFrame:
+        """Rows of the result for the subgroups holding all the dimension value pairs
+
+        Args:
+            dimension_value_pairs (List[DimensionValuePair]): dimension value pairs of
+                the subgroups
+            depth (int, optional): number of dimensions of the subgroups, by default
+                the number of pairs
+        """
+        return self.trend_df.select(
+            pl.all().gather(self.lookup(dimension_value_pairs, depth))
+        )
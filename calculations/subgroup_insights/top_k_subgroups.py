@@ -0,0 +1,177 @@
+"""Bounded selection of the top subgroups of a segment comparison"""
+
+import threading
+from typing import Dict
+
+import polars as pl
+from calculations.subgroup_insights import repository as subgroup_trend_repository
+
+SEGMENTS = ("baseline", "comparison")
+# columns filled with the value of their segment by the merge of the segments
+SEGMENT_FILL_COLUMNS = ("DateLabel", "{metric_name}_overall", "size_overall")
+
+
+class TopKSubgroups:
+    """Keeps the top_k subgroups of largest |order_by| while the combinations are
+    aggregated, so at most top_k merged subgroups are held besides the combinations
+    being merged.
+
+    The combinations are offered one at a time, from any thread. Ordering by
+    absolute_impact_diff, the baseline and comparison subgroups of a combination are
+    only merged for the subgroups which can enter the top: a subgroup whose
+    |absolute_impact| is under half of the smallest kept |absolute_impact_diff| in
+    both segments can not. Before top_k subgroups are kept, the threshold is the
+    smallest of the top |absolute_impact_diff| of the subgroups of largest
+    |absolute_impact| of the combination.
+    """
+
+    def __init__(
+        self,
+        top_k: int,
+        metric_name: str,
+        order_by: str = "absolute_impact_diff",
+    ) -> None:
+        """
+        Args:
+            top_k (int): number of subgroups kept
+            metric_name (str): name of the insight metric
+            order_by (str, optional): column of the merged subgroups ordering them,
+                by decreasing absolute value
+        """
+        self.top_k = top_k
+        self.metric_name = metric_name
+        self.order_by = order_by
+        self.top_df = None
+        # smallest |order_by| kept once top_k subgroups are kept
+        self.threshold = None
+        self.fill_values = {}
+        self._lock = threading.Lock()
+
+    def build_order_exps(self):
+        """Expressions ordering the subgroups, ties broken by the sub_group key"""
+        return [pl.col(self.order_by).abs(), pl.col("sub_group")]
+
+    def sort(self, merged_df: pl.DataFrame) -> pl.DataFrame:
+        """Top_k merged subgroups, by decreasing |order_by|"""
+        return merged_df.sort(
+            self.build_order_exps(),
+            descending=[True, False],
+            nulls_last=True,
+        ).head(self.top_k)
+
+    def select(self, merged_df: pl.DataFrame):
+        """Keep the top subgroups of merged baseline and comparison subgroups
+
+        Args:
+            merged_df (pl.DataFrame): subgroups merged by
+                merge_segment_baseline_and_comparison_data
+        """
+        if self.order_by not in merged_df.columns:
+            raise ValueError(
+                f"The top subgroups order_by should be either of {merged_df.columns}"
+            )
+        # the subgroups of the combination are cut to their own top first, outside of
+        # the lock, so at most twice top_k subgroups are concatenated and sorted
+        merged_df = self.sort(merged_df)
+        with self._lock:
+            if self.top_df is not None:
+                merged_df = self.sort(
+                    pl.concat([self.top_df, merged_df], how="vertical_relaxed")
+                )
+            self.top_df = merged_df
+            if self.top_df.height == self.top_k:
+                self.threshold = self.top_df.select(
+                    pl.col(self.order_by).abs().last()
+                ).item()
+
+    def merge_segments(
+        self, segment_dfs: Dict[str, pl.DataFrame], sub_groups: pl.DataFrame = None
+    ) -> pl.DataFrame:
+        """Merge the baseline and comparison subgroups, only the sub_groups given"""
+        if sub_groups is not None:
+            segment_dfs = {
+                segment: segment_dfs[segment].join(
+                    sub_groups, on="sub_group", how="semi"
+                )
+                for segment in SEGMENTS
+            }
+        return (
+            subgroup_trend_repository.merge_polars_segment_baseline_and_comparison_data(
+                baseline_df=segment_dfs["baseline"],
+                comparison_df=segment_dfs["comparison"],
+                metric_name=self.metric_name,
+            )
+        )
+
+    def offer(self, segment_dfs: Dict[str, pl.DataFrame]):
+        """Merge the baseline and comparison subgroups of a combination and keep the
+        top ones
+
+        Args:
+            segment_dfs (Dict[str, pl.DataFrame]): subgroup impacts of each segment
+        """
+        with self._lock:
+            for segment in SEGMENTS:
+                if segment_dfs[segment].height:
+                    self.fill_values.setdefault(
+                        segment, segment_dfs[segment].row(0, named=True)
+                    )
+            threshold = self.threshold
+
+        if self.order_by != "absolute_impact_diff":
+            self.select(self.merge_segments(segment_dfs))
+            return
+
+        # the top_k subgroups of largest |absolute_impact| of each segment, merged,
+        # bound the top subgroups of the combination before any is kept
+        sample_df = self.merge_segments(
+            segment_dfs,
+            pl.concat(
+                [
+                    segment_dfs[segment]
+                    .top_k(self.top_k, by=pl.col("absolute_impact").abs())
+                    .select("sub_group")
+                    for segment in SEGMENTS
+                ]
+            ).unique(),
+        )
+        if sample_df.height >= self.top_k:
+            sample_threshold = sample_df.select(
+                pl.col(self.order_by).abs().top_k(self.top_k).min()
+            ).item()
+            if threshold is None or sample_threshold > threshold:
+                threshold = sample_threshold
+
+        if threshold is None:
+            self.select(self.merge_segments(segment_dfs))
+            return
+        # |comparison - baseline| <= |comparison| + |baseline|
+        candidates = pl.concat(
+            [
+                segment_dfs[segment]
+                .filter(pl.col("absolute_impact").abs() >= threshold / 2)
+                .select("sub_group")
+                for segment in SEGMENTS
+            ]
+        ).unique()
+        if candidates.height:
+            self.select(self.merge_segments(segment_dfs, candidates))
+
+    def result(self) -> pl.DataFrame:
+        """Top subgroups, by decreasing |order_by|. The segment columns of the
+        subgroups missing from a segment are filled as the merge of all the
+        subgroups fills them."""
+        if self.top_df is None:
+            return None
+        return self.top_df.with_columns(
+            [
+                pl.col(f"{column}_{segment}").fill_null(
+                    self.fill_values[segment][column]
+                )
+                for segment in self.fill_values
+                for column in (
+                    fill_column.format(metric_name=self.metric_name)
+                    for fill_column in SEGMENT_FILL_COLUMNS
+                )
+            ]
+        )
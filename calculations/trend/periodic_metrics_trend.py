@@ -1,3 +1,7 @@
+from typing import Dict, List
+
+import polars as pl
+
 from base.general import ProcessingType
 from base.metrics import DualColumnMetric, Metric, SingleColumnMetric
 from base.metrics_trend import BaseMetricsTrend, MetricsTrendType
@@ -49,12 +53,12 @@ class PeriodicMetricsTrend(BaseMetricsTrend):
                 metric.aggregation_method,
                 type(metric.aggregation_method),
             )
-            dataframe = calculation_utils.get_time_period_date_label(
+            dataframe = calculation_utils.get_time_period_index(
                 date_column=metric.date_column,
                 dataframe=dataframe,
                 period=metrics_trend,
             )
-            print("get_time_period_date_label")
+            print("get_time_period_index")
             print("metrics_trend: ", metrics_trend)
             print(type(metrics_trend))
             print(dataframe.head())
@@ -76,7 +80,7 @@ class PeriodicMetricsTrend(BaseMetricsTrend):
                 metric.combine_method,
                 type(metric.combine_method),
             )
-            dataframe = calculation_utils.get_time_period_date_label(
+            dataframe = calculation_utils.get_time_period_index(
                 date_column=metric.numerator_metric.date_column,
                 dataframe=dataframe,
                 period=metrics_trend,
@@ -93,4 +97,128 @@ class PeriodicMetricsTrend(BaseMetricsTrend):
                 time_intervals=self.time_intervals,
             )
 
+        # label is rendered on the aggregated trend only
+        if metrics_trend is not None:
+            trend_calc = calculation_utils.render_date_label(trend_calc, metrics_trend)
+
         return trend_calc, dataframe
+
+    def calculate_multi_period(
+        self,
+        dataframe,
+        metric: Metric,
+        metrics_trends: List[MetricsTrendType],
+    ) -> Dict[MetricsTrendType, pl.DataFrame]:
+        """Calculate Periodic Metrics Trend for several trend types in one pass
+
+        The data is filtered, indexed and aggregated once at the finest trend type
+        and the coarser trend types are rolled up from those partial aggregates.
+        The partials of count_distinct metrics hold the distinct values of each
+        period of the finest trend type, as many rows as the data at worst.
+
+        Args:
+            dataframe (_type_): dataframe on which to run calculation
+            metric (models.Metric): Metrics type to calculate
+            metrics_trends (List[models.MetricsTrendType]): trend types to calculate
+
+        Returns:
+            Dict[MetricsTrendType, pl.DataFrame]: trend dataframe of each trend type
+        """
+        partial_exps = trend_services.build_partial_metric_exps(
+            metric=metric,
+            metric_name=metric.name,
+            processing_type=self.processing_type,
+        )
+        if partial_exps is None:
+            # no partials outside of memory, fall back to one calculation per
+            # trend type
+            return {
+                metrics_trend: self.calculate(dataframe, metric, metrics_trend)[0]
+                for metrics_trend in metrics_trends
+            }
+
+        filters_expr = trend_services.build_filter_exp(
+            metric.filters, self.processing_type
+        )
+        dataframe = trend_services.apply_filters(
+            dataframe, filters_expr, self.processing_type
+        )
+
+        date_column = (
+            metric.date_column
+            if isinstance(metric, SingleColumnMetric)
+            else metric.numerator_metric.date_column
+        )
+        base_period = trend_services.get_base_period(metrics_trends)
+        dataframe = calculation_utils.get_time_period_index(
+            date_column=date_column,
+            dataframe=dataframe,
+            period=base_period,
+        )
+
+        return trend_services.apply_multi_period_trend_agg(
+            dataframe=dataframe,
+            partial_exps=partial_exps,
+            base_period=base_period,
+            metrics_trends=metrics_trends,
+            processing_type=self.processing_type,
+            time_intervals=self.time_intervals,
+        )
+
+    def calculate_batch(
+        self,
+        dataframe,
+        metrics: List[Metric],
+        metrics_trend: MetricsTrendType = None,
+    ) -> Dict[str, pl.DataFrame]:
+        """Calculate Periodic Metrics Trend of several metrics over the same data
+
+        Metrics sharing the same filters are filtered once and aggregated together in
+        a single group_by.
+
+        Args:
+            dataframe (_type_): dataframe on which to run calculation
+            metrics (List[models.Metric]): Metrics to calculate, names must be unique
+            metrics_trend (models.MetricsTrendType): Metrics trend type for the time period to roll up the calculations
+
+        Returns:
+            Dict[str, pl.DataFrame]: trend dataframe of each metric by metric name
+        """
+        metric_names = [metric.name for metric in metrics]
+        if len(set(metric_names)) != len(metric_names):
+            raise ValueError("metric names should be unique to calculate a batch")
+
+        trends = {}
+        metric_groups = trend_services.group_metrics_by_filters(metrics)
+        for (_, date_column), metric_group in metric_groups.items():
+            filters_expr = trend_services.build_filter_exp(
+                metric_group[0].filters, self.processing_type
+            )
+            group_df = trend_services.apply_filters(
+                dataframe, filters_expr, self.processing_type
+            )
+            group_df = calculation_utils.get_time_period_index(
+                date_column=date_column,
+                dataframe=group_df,
+                period=metrics_trend,
+            )
+
+            group_trends = trend_services.apply_batch_trend_agg(
+                dataframe=group_df,
+                agg_exprs={
+                    metric.name: trend_services.build_metric_agg_exp(
+                        metric, self.processing_type
+                    )
+                    for metric in metric_group
+                },
+                processing_type=self.processing_type,
+                time_intervals=self.time_intervals,
+            )
+            for metric_name, trend_calc in group_trends.items():
+                if metrics_trend is not None:
+                    trend_calc = calculation_utils.render_date_label(
+                        trend_calc, metrics_trend
+                    )
+                trends[metric_name] = trend_calc
+
+        return {metric_name: trends[metric_name] for metric_name in metric_names}
@@ -1,9 +1,10 @@
-from typing import List
+from typing import Dict, List
 
 import polars as pl
 from polars import Expr
 
 from base.general import AggregateMethod, CombineMethod, Filter, FilterOperator
+from base.metrics import DualColumnMetric, SingleColumnMetric
 from base.metrics_trend import MetricsTrendType
 from calculations import utils as calculation_utils
 
@@ -39,6 +40,205 @@ def build_polar_aggregation_exp(
         raise ValueError(f"aggregation_method should be either of {accepted_values}")
 
 
+def build_polar_partial_aggregation_exp(
+    column_name: str,
+    aggregation_method: AggregateMethod,
+    filter_expr: pl.Expr,
+    partial_name: str,
+) -> List[Expr]:
+    """Build polar expressions of the mergeable partial aggregates of a single column
+    aggregation, partials of smaller groups are rolled up into larger ones.
+
+    Args:
+        column_name (str): Column on which to run aggregations
+        aggregation_method (AggregateMethod): Type of aggregation on single column.
+        filter_expr (pl.Expr): Filter applied on the column before aggregation
+        partial_name (str): Prefix of the partial aggregate columns
+    """
+    col = pl.col(column_name)
+    if filter_expr is not None:
+        col = col.filter(filter_expr)
+    if aggregation_method == AggregateMethod.SUM:
+        return [col.sum().alias(f"{partial_name}__sum")]
+    elif aggregation_method == AggregateMethod.COUNT:
+        return [col.count().alias(f"{partial_name}__count")]
+    elif aggregation_method == AggregateMethod.AVG:
+        return [
+            col.sum().alias(f"{partial_name}__sum"),
+            col.count().alias(f"{partial_name}__count"),
+        ]
+    else:
+        raise ValueError(f"{aggregation_method} can not be aggregated from partials")
+
+
+def build_polar_rollup_exp(
+    aggregation_method: AggregateMethod, partial_name: str
+) -> List[Expr]:
+    """Build polar expressions rolling up partial aggregates into larger groups
+
+    Args:
+        aggregation_method (AggregateMethod): Type of aggregation on single column.
+        partial_name (str): Prefix of the partial aggregate columns
+    """
+    if aggregation_method == AggregateMethod.SUM:
+        return [pl.col(f"{partial_name}__sum").sum()]
+    elif aggregation_method == AggregateMethod.COUNT:
+        return [pl.col(f"{partial_name}__count").sum()]
+    elif aggregation_method == AggregateMethod.AVG:
+        return [
+            pl.col(f"{partial_name}__sum").sum(),
+            pl.col(f"{partial_name}__count").sum(),
+        ]
+    else:
+        raise ValueError(f"{aggregation_method} can not be aggregated from partials")
+
+
+def build_polar_final_exp(
+    aggregation_method: AggregateMethod, partial_name: str
+) -> Expr:
+    """Build polar expression of the aggregation value from its partial aggregates
+
+    Args:
+        aggregation_method (AggregateMethod): Type of aggregation on single column.
+        partial_name (str): Prefix of the partial aggregate columns
+    """
+    if aggregation_method == AggregateMethod.SUM:
+        return pl.col(f"{partial_name}__sum")
+    elif aggregation_method == AggregateMethod.COUNT:
+        return pl.col(f"{partial_name}__count")
+    elif aggregation_method == AggregateMethod.AVG:
+        # mean of an empty group is null, as with col.mean()
+        return (
+            pl.when(pl.col(f"{partial_name}__count") > 0)
+            .then(pl.col(f"{partial_name}__sum") / pl.col(f"{partial_name}__count"))
+            .otherwise(None)
+        )
+    else:
+        raise ValueError(f"{aggregation_method} can not be aggregated from partials")
+
+
+def build_polar_partial_metric_exps(
+    metric: SingleColumnMetric | DualColumnMetric, metric_name: str
+):
+    """Build the partial, rollup and final expressions of a metric. The partials are
+    computed once on the rows grouped by the finest keys, the rollup expressions
+    merge them into coarser groups and the final expressions compute the metric
+    columns, matching build_aggregation_exp and build_combine_exp.
+
+    The columns of count_distinct metrics are kept among the partial keys, the
+    distinct values of each group are the mergeable partial, so the partials grow
+    with the distinct values of each period, up to a row per row of the data. The
+    rows of each value passing the filters of a dependent metric are counted, the
+    values with rows are the distinct values of the dependent metric.
+
+    Args:
+        metric (SingleColumnMetric | DualColumnMetric): metric to aggregate
+        metric_name (str): name of the metric column
+
+    Returns:
+        tuple: partial keys, partial expressions, rollup expressions and final
+            expressions or None when the metric can not be aggregated from partials
+    """
+    size_partial = "size__partial"
+    if isinstance(metric, SingleColumnMetric):
+        size_exprs = build_polar_partial_aggregation_exp(
+            metric.column, AggregateMethod.COUNT, None, size_partial
+        )
+        size_final_expr = build_polar_final_exp(AggregateMethod.COUNT, size_partial)
+        if metric.aggregation_method == AggregateMethod.DISTINCT:
+            return (
+                [metric.column],
+                size_exprs,
+                [
+                    pl.col(metric.column).n_unique().cast(int).alias(metric_name),
+                    *build_polar_rollup_exp(AggregateMethod.COUNT, size_partial),
+                ],
+                [pl.col(metric_name), size_final_expr.alias("size")],
+            )
+
+        metric_partial = f"{metric_name}__partial"
+        return (
+            [],
+            build_polar_partial_aggregation_exp(
+                metric.column, metric.aggregation_method, None, metric_partial
+            )
+            + size_exprs,
+            build_polar_rollup_exp(metric.aggregation_method, metric_partial)
+            + build_polar_rollup_exp(AggregateMethod.COUNT, size_partial),
+            [
+                build_polar_final_exp(metric.aggregation_method, metric_partial).alias(
+                    metric_name
+                ),
+                size_final_expr.alias("size"),
+            ],
+        )
+
+    dependent_metrics = [metric.numerator_metric, metric.denominator_metric]
+    partial_keys, partial_exprs, rollup_exprs, final_exprs = [], [], [], []
+    for dependent_metric in dependent_metrics:
+        dependent_partial = f"{dependent_metric.name}__partial"
+        filter_expr = build_polar_filter_exp(dependent_metric.filters)
+        if dependent_metric.aggregation_method == AggregateMethod.DISTINCT:
+            if dependent_metric.column not in partial_keys:
+                partial_keys.append(dependent_metric.column)
+            partial_exprs.append(
+                pl.col(dependent_metric.column)
+                .filter(filter_expr)
+                .len()
+                .alias(f"{dependent_partial}__rows")
+            )
+            rollup_exprs.extend(
+                [
+                    pl.col(f"{dependent_partial}__rows").sum(),
+                    pl.col(dependent_metric.column)
+                    .filter(pl.col(f"{dependent_partial}__rows") > 0)
+                    .n_unique()
+                    .cast(int)
+                    .alias(f"{dependent_partial}__distinct"),
+                ]
+            )
+            final_expr = pl.col(f"{dependent_partial}__distinct")
+        else:
+            partial_exprs.extend(
+                build_polar_partial_aggregation_exp(
+                    dependent_metric.column,
+                    dependent_metric.aggregation_method,
+                    filter_expr,
+                    dependent_partial,
+                )
+            )
+            rollup_exprs.extend(
+                build_polar_rollup_exp(
+                    dependent_metric.aggregation_method, dependent_partial
+                )
+            )
+            final_expr = build_polar_final_exp(
+                dependent_metric.aggregation_method, dependent_partial
+            )
+        final_exprs.append(final_expr.fill_null(0).alias(dependent_metric.name))
+
+    size_partial_exprs = build_polar_partial_aggregation_exp(
+        metric.numerator_metric.column, AggregateMethod.COUNT, None, size_partial
+    )
+    final_exprs.extend(
+        [
+            build_polar_combine_exp(
+                dual_metric_name=metric_name,
+                combine_method=metric.combine_method,
+                numerator_metric_agg_expr=final_exprs[0],
+                denominator_metric_agg_expr=final_exprs[1],
+            ).alias(metric_name),
+            build_polar_final_exp(AggregateMethod.COUNT, size_partial).alias("size"),
+        ]
+    )
+    return (
+        partial_keys,
+        partial_exprs + size_partial_exprs,
+        rollup_exprs + build_polar_rollup_exp(AggregateMethod.COUNT, size_partial),
+        final_exprs,
+    )
+
+
 def build_databricks_aggregation_exp(**kwargs):
     """Build aggregate expressions for databricks"""
     kwargs = None
@@ -96,17 +296,169 @@ def apply_polar_trend_agg(
     Returns:
         _type_: _description_
     """
-
+    # group on the integer PeriodIndex when the data carries it
+    time_column = calculation_utils.get_time_column(dataframe)
     trend_df = (
-        dataframe.group_by("DateLabel").agg(agg_expr).sort("DateLabel", descending=True)
+        dataframe.group_by(time_column).agg(agg_expr).sort(time_column, descending=True)
     )
 
     if time_intervals is not None:
-        trend_df = trend_df[-1 * (time_intervals + 1) :]
+        trend_df = trend_df.tail(time_intervals + 1)
 
     return trend_df  # .to_dicts()
 
 
+def apply_polar_batch_trend_agg(
+    dataframe: pl.DataFrame,
+    agg_exprs: Dict[str, List[pl.Expr]],
+    time_intervals: int = None,
+) -> Dict[str, pl.DataFrame]:
+    """Calculate trends of several KPIs for polars dataset in a single group_by.
+    Identical expressions across metrics, such as the size count of a shared
+    column, are computed once.
+
+    Args:
+        dataframe (pl.DataFrame): dataframe to run calculations on
+        agg_exprs (Dict[str, List[pl.Expr]]): aggregation expressions of each metric
+        time_intervals (int, optional): time intervals for which to aggregate the KPI for.
+
+    Returns:
+        Dict[str, pl.DataFrame]: trend dataframe of each metric
+    """
+    time_column = calculation_utils.get_time_column(dataframe)
+
+    unique_exprs = []
+    metric_columns = {}
+    for metric_name, exprs in agg_exprs.items():
+        metric_columns[metric_name] = {}
+        for expr in exprs:
+            unaliased_expr = expr.meta.undo_aliases()
+            for index, unique_expr in enumerate(unique_exprs):
+                if unique_expr.meta.eq(unaliased_expr):
+                    break
+            else:
+                index = len(unique_exprs)
+                unique_exprs.append(unaliased_expr)
+            metric_columns[metric_name][expr.meta.output_name()] = f"__agg_{index}"
+
+    batch_df = dataframe.group_by(time_column).agg(
+        [expr.alias(f"__agg_{index}") for index, expr in enumerate(unique_exprs)]
+    )
+
+    trends = {}
+    for metric_name, columns in metric_columns.items():
+        trend_df = batch_df.select(
+            [pl.col(time_column)]
+            + [pl.col(column).alias(name) for name, column in columns.items()]
+        ).sort(time_column, descending=True)
+        if time_intervals is not None:
+            trend_df = trend_df.tail(time_intervals + 1)
+        trends[metric_name] = trend_df
+
+    return trends
+
+
+def apply_polar_segment_trend_agg(
+    dataframe: pl.DataFrame,
+    segment_agg_exprs: Dict[str, List[pl.Expr]],
+    segment_labels: Dict[str, str],
+) -> pl.DataFrame:
+    """Calculate trend of KPI of every segment for polars dataset tagged with the
+    segment mask, all segments are aggregated in a single group_by.
+
+    Args:
+        dataframe (pl.DataFrame): dataframe tagged with the segment mask
+        segment_agg_exprs (Dict[str, List[pl.Expr]]): aggregation expressions of each
+            segment, including the number of rows of the segment
+        segment_labels (Dict[str, str]): DateLabel of each segment
+
+    Returns:
+        pl.DataFrame: trend of every non empty segment, labelled with its DateLabel
+    """
+    trends = apply_polar_batch_trend_agg(dataframe, segment_agg_exprs)
+    return pl.concat(
+        [
+            trends[segment]
+            .filter(pl.col(calculation_utils.SEGMENT_ROWS_COLUMN) > 0)
+            .drop(calculation_utils.SEGMENT_ROWS_COLUMN)
+            .with_columns(DateLabel=pl.lit(segment_labels[segment]))
+            for segment in segment_agg_exprs
+        ]
+    )
+
+
+def apply_polar_segment_mask(
+    dataframe: pl.DataFrame, baseline_expr: pl.Expr, comparison_expr: pl.Expr
+):
+    """Tag rows with the segment mask and drop the rows outside of every segment
+
+    Args:
+        dataframe (pl.DataFrame): Polars dataframe for in-memory processing
+        baseline_expr (pl.Expr): Filter expression of the baseline segment
+        comparison_expr (pl.Expr): Filter expression of the comparison segment
+    """
+    segment_mask = pl.lit(0, dtype=pl.UInt8)
+    for segment, segment_expr in [
+        ("baseline", baseline_expr),
+        ("comparison", comparison_expr),
+    ]:
+        segment_mask = segment_mask | pl.when(segment_expr).then(
+            pl.lit(calculation_utils.SEGMENT_BITS[segment], dtype=pl.UInt8)
+        ).otherwise(pl.lit(0, dtype=pl.UInt8))
+    return dataframe.with_columns(
+        segment_mask.alias(calculation_utils.SEGMENT_MASK_COLUMN)
+    ).filter(pl.col(calculation_utils.SEGMENT_MASK_COLUMN) != 0)
+
+
+def apply_polar_multi_period_trend_agg(
+    dataframe: pl.DataFrame,
+    partial_exps: tuple,
+    base_period: MetricsTrendType,
+    metrics_trends: List[MetricsTrendType],
+    time_intervals: int = None,
+):
+    """Calculate trends of KPI for several periods with polars, the data is
+    aggregated once at the base period and rolled up to the coarser periods.
+
+    Args:
+        dataframe (pl.DataFrame): dataframe indexed with PeriodIndex of the base period
+        partial_exps (tuple): partial keys, partial, rollup and final expressions
+            from build_polar_partial_metric_exps
+        base_period (MetricsTrendType): finest period, every period must roll up from it
+        metrics_trends (List[MetricsTrendType]): periods to calculate the trend for
+        time_intervals (int, optional): time intervals for which to aggregate the KPI for.
+
+    Returns:
+        dict: trend dataframe for each period
+    """
+    partial_keys, partial_exprs, rollup_exprs, final_exprs = partial_exps
+    partial_df = dataframe.group_by(["PeriodIndex"] + partial_keys).agg(partial_exprs)
+    base_date = calculation_utils.build_period_start_date_expr(
+        pl.col("PeriodIndex"), base_period
+    )
+
+    trends = {}
+    for metrics_trend in metrics_trends:
+        trend_df = (
+            partial_df.with_columns(
+                calculation_utils.build_period_index_expr(
+                    base_date, metrics_trend
+                ).alias("PeriodIndex")
+            )
+            .group_by("PeriodIndex")
+            .agg(rollup_exprs)
+            .select([pl.col("PeriodIndex")] + final_exprs)
+            .sort("PeriodIndex", descending=True)
+        )
+        if time_intervals is not None:
+            trend_df = trend_df.tail(time_intervals + 1)
+        trends[metrics_trend] = calculation_utils.render_date_label(
+            trend_df, metrics_trend
+        )
+
+    return trends
+
+
 def apply_databricks_trend_agg(**kwargs):
     """Calculate trend of KPI for databricks data"""
     kwargs = None
@@ -127,7 +479,7 @@ def build_polar_filter_exp(filters: List[Filter]):
             if _filter.operator == FilterOperator.EQ:
                 expr = expr.is_in(_filter.values)
             elif _filter.operator == FilterOperator.NEQ:
-                expr = expr.is_in(_filter.values).is_not()
+                expr = expr.is_in(_filter.values).not_()
             elif _filter.operator == FilterOperator.EMPTY:
                 expr = expr.is_null() | expr.len().eq(0)
             elif _filter.operator == FilterOperator.NON_EMPTY:
@@ -15,13 +15,42 @@ class SegmentComparison(BaseMetricsTrend):
         insights: MetricsInsight,
         processing_type: ProcessingType = "in_memory",
         time_intervals: int = None,
+        single_pass: bool = False,
     ) -> None:
         super().__init__()
         self.processing_type = processing_type
         self.time_intervals = time_intervals
         self.insights = insights
+        self.single_pass = single_pass
+
+    def calculate(self, dataframe: DataFrame | pl.LazyFrame):
+        """Calculate the baseline and comparison segment trends
+
+        Args:
+            dataframe (DataFrame | pl.LazyFrame): data on which to run calculation. When a
+                LazyFrame is passed only the columns referenced by the insight and the
+                rows of either segment are read, once for all the segments.
+
+        In single pass mode the rows are tagged once with the segments they belong to
+        and both segments are aggregated in the same group_by, the tagged data is then
+        returned in place of both filtered segments.
+        """
+        if isinstance(dataframe, pl.LazyFrame):
+            # the projection and the segment filters are pushed into the scan, collected
+            # once as collect_all does not share a scan and would read the source again
+            # for every segment plan
+            baseline_expr, comparison_expr = trend_services.build_segment_filter_exps(
+                self.insights, self.processing_type
+            )
+            dataframe = (
+                dataframe.select(self.get_columns_to_load(metric_details=self.insights))
+                .filter(baseline_expr | comparison_expr)
+                .collect()
+            )
+
+        if self.single_pass:
+            return self.calculate_single_pass(dataframe)
 
-    def calculate(self, dataframe: DataFrame):
         baseline_df, comparison_df = trend_services.get_baseline_and_comparison_df(
             dataframe=dataframe,
             insights=self.insights,
@@ -80,3 +109,45 @@ class SegmentComparison(BaseMetricsTrend):
             baseline_filtered_df,
             comparison_filtered_df,
         )
+
+    def calculate_single_pass(self, dataframe: DataFrame | pl.LazyFrame):
+        """Calculate the baseline and comparison segment trends from a single scan
+
+        Args:
+            dataframe (DataFrame | pl.LazyFrame): data on which to run calculation
+        """
+        metric = self.insights.metrics
+        date_column = (
+            metric.date_column
+            if isinstance(metric, SingleColumnMetric)
+            else metric.numerator_metric.date_column
+        )
+
+        tagged_df = trend_services.apply_segment_mask(
+            dataframe=dataframe,
+            insights=self.insights,
+            processing_type=self.processing_type,
+        )
+        filters_expr = trend_services.build_filter_exp(
+            metric.filters, self.processing_type
+        )
+        tagged_df = trend_services.apply_filters(
+            tagged_df, filters_expr, self.processing_type
+        )
+        tagged_df = calculation_utils.get_time_period_index(
+            date_column=date_column, dataframe=tagged_df, period=None
+        )
+
+        trend_df = trend_services.apply_segment_trend_agg(
+            dataframe=tagged_df,
+            segment_agg_exprs=trend_services.build_segment_agg_exps(
+                metric, self.processing_type
+            ),
+            segment_labels=trend_services.get_segment_labels(self.insights),
+            processing_type=self.processing_type,
+        )
+
+        if isinstance(tagged_df, pl.LazyFrame):
+            trend_df, tagged_df = pl.collect_all([trend_df, tagged_df])
+
+        return trend_df, tagged_df, tagged_df
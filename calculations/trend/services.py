@@ -1,12 +1,14 @@
 """all model related functions for trend calculations"""
 
-from typing import Any, Union
+import json
+from typing import Any, Dict, List, Tuple, Union
 
 import calculations.utils as calculation_utils
 import polars as pl
 from base.general import AggregateMethod, Filter, ProcessingType
 from base.insights import MetricsInsight
 from base.metrics import DualColumnMetric, SingleColumnMetric
+from base.metrics_trend import MetricsTrendType
 from calculations.trend import repository as trend_repository
 
 
@@ -52,6 +54,7 @@ def build_aggregation_exp(
 def build_combine_exp(
     metric: DualColumnMetric,
     processing_type: ProcessingType,
+    filter_expr: pl.Expr = None,
 ):
     """Build Aggregation expressions.
 
@@ -59,16 +62,25 @@ def build_combine_exp(
         column_name (str): Column to run aggregations on
         aggregation_method (models.AggregateMethod): Aggregation method based on AggregateMethod
         processing_type (models.ProcessingType): Processing type depending on ProcessingType
+        filter_expr (pl.Expr, optional): Filter applied on the rows of both metrics
+            before aggregation
     """
     print("2 ", metric.combine_method, type(metric.combine_method))
     if processing_type == ProcessingType.IN_MEMORY:
+        numerator_filter_expr = build_filter_exp(
+            metric.numerator_metric.filters, processing_type
+        )
+        denominator_filter_expr = build_filter_exp(
+            metric.denominator_metric.filters, processing_type
+        )
+        if filter_expr is not None:
+            numerator_filter_expr = filter_expr & numerator_filter_expr
+            denominator_filter_expr = filter_expr & denominator_filter_expr
         numerator_metric_agg_expr = (
             trend_repository.build_polar_aggregation_exp(
                 column_name=metric.numerator_metric.column,
                 aggregation_method=metric.numerator_metric.aggregation_method,
-                filter_expr=build_filter_exp(
-                    metric.numerator_metric.filters, processing_type
-                ),
+                filter_expr=numerator_filter_expr,
             )
             .fill_null(0)
             .alias(metric.numerator_metric.name)
@@ -77,9 +89,7 @@ def build_combine_exp(
             trend_repository.build_polar_aggregation_exp(
                 column_name=metric.denominator_metric.column,
                 aggregation_method=metric.denominator_metric.aggregation_method,
-                filter_expr=build_filter_exp(
-                    metric.denominator_metric.filters, processing_type
-                ),
+                filter_expr=denominator_filter_expr,
             )
             .fill_null(0)
             .alias(metric.denominator_metric.name)
@@ -93,7 +103,7 @@ def build_combine_exp(
         size_expr = trend_repository.build_polar_aggregation_exp(
             column_name=metric.numerator_metric.column,
             aggregation_method=AggregateMethod.COUNT,
-            filter_expr=None,
+            filter_expr=filter_expr,
         ).alias("size")
     elif processing_type == ProcessingType.DATABRICKS:
         numerator_metric_agg_expr = trend_repository.build_databricks_aggregation_exp(
@@ -126,6 +136,103 @@ def build_combine_exp(
     ]
 
 
+def build_metric_agg_exp(
+    metric: Union[SingleColumnMetric, DualColumnMetric],
+    processing_type: ProcessingType,
+    filter_expr: pl.Expr = None,
+):
+    """Build Aggregation expressions of a single or dual column metric.
+
+    Args:
+        metric (Union[SingleColumnMetric, DualColumnMetric]): metric to aggregate
+        processing_type (models.ProcessingType): Processing type depending on ProcessingType
+        filter_expr (pl.Expr, optional): Filter applied on the rows before aggregation
+    """
+    if isinstance(metric, SingleColumnMetric):
+        return build_aggregation_exp(
+            column_name=metric.column,
+            aggregation_method=metric.aggregation_method,
+            processing_type=processing_type,
+            metric_name=metric.name,
+            filter_expr=filter_expr,
+        )
+    elif isinstance(metric, DualColumnMetric):
+        return build_combine_exp(
+            metric=metric, processing_type=processing_type, filter_expr=filter_expr
+        )
+
+
+def build_segment_agg_exps(
+    metric: Union[SingleColumnMetric, DualColumnMetric],
+    processing_type: ProcessingType,
+) -> Dict[str, List[pl.Expr]]:
+    """Build Aggregation expressions of a metric for each segment of data tagged with
+    the segment mask, along with the number of rows of the segment.
+
+    Args:
+        metric (Union[SingleColumnMetric, DualColumnMetric]): metric to aggregate
+        processing_type (models.ProcessingType): Processing type depending on ProcessingType
+    """
+    segment_agg_exprs = {}
+    for segment in calculation_utils.SEGMENT_BITS:
+        segment_expr = calculation_utils.build_segment_member_exp(segment)
+        segment_agg_exprs[segment] = build_metric_agg_exp(
+            metric, processing_type, filter_expr=segment_expr
+        ) + [segment_expr.sum().alias(calculation_utils.SEGMENT_ROWS_COLUMN)]
+    return segment_agg_exprs
+
+
+def group_metrics_by_filters(
+    metrics: List[Union[SingleColumnMetric, DualColumnMetric]],
+) -> Dict[Tuple[str, str], List[Union[SingleColumnMetric, DualColumnMetric]]]:
+    """Group metrics sharing the same filters and date column, every group can be
+    aggregated over the same filtered data.
+
+    Args:
+        metrics (List[Union[SingleColumnMetric, DualColumnMetric]]): metrics to group
+    """
+    metric_groups = {}
+    for metric in metrics:
+        filters_key = json.dumps(
+            sorted(
+                json.dumps(_filter.model_dump(mode="json"), sort_keys=True)
+                for _filter in metric.filters or []
+            )
+        )
+        date_column = (
+            metric.date_column
+            if isinstance(metric, SingleColumnMetric)
+            else metric.numerator_metric.date_column
+        )
+        metric_groups.setdefault((filters_key, date_column), []).append(metric)
+    return metric_groups
+
+
+def build_partial_metric_exps(
+    metric: Union[SingleColumnMetric, DualColumnMetric],
+    metric_name: str,
+    processing_type: ProcessingType,
+):
+    """Build partial, rollup and final expressions of a metric aggregated from
+    mergeable partials.
+
+    Args:
+        metric (Union[SingleColumnMetric, DualColumnMetric]): metric to aggregate
+        metric_name (str): Name of the metric column
+        processing_type (models.ProcessingType): Processing type depending on ProcessingType
+
+    Returns:
+        tuple: partial keys, partial, rollup and final expressions, None when the
+            metric can not be aggregated from partials
+    """
+    if processing_type == ProcessingType.IN_MEMORY:
+        return trend_repository.build_polar_partial_metric_exps(
+            metric=metric, metric_name=metric_name
+        )
+    elif processing_type == ProcessingType.DATABRICKS:
+        return None
+
+
 def build_filter_exp(filters: Filter, processing_type: ProcessingType):
     """Build filter expressions.
 
@@ -187,6 +294,115 @@ def apply_trend_agg(
     return trend_calc
 
 
+def apply_batch_trend_agg(
+    dataframe: Union[pl.DataFrame, Any],
+    agg_exprs: Dict[str, List[Union[pl.Expr, Any]]],
+    processing_type: ProcessingType,
+    time_intervals: int = None,
+):
+    """Calculate KPI Trends of several metrics over the same data in one aggregation.
+
+    Args:
+        dataframe (Union[pl.DataFrame, Any]): data on which to run the aggregation
+        agg_exprs (Dict[str, List[Union[pl.Expr, Any]]]): aggregation expressions of
+            each metric
+        processing_type (models.ProcessingType): Processing type depending on ProcessingType
+        time_intervals (int, optional): time intervals for which to aggregate the KPI for.
+    """
+    if processing_type == ProcessingType.IN_MEMORY:
+        trends = trend_repository.apply_polar_batch_trend_agg(
+            dataframe=dataframe,
+            agg_exprs=agg_exprs,
+            time_intervals=time_intervals,
+        )
+    elif processing_type == ProcessingType.DATABRICKS:
+        trends = trend_repository.apply_databricks_trend_agg(date_column=None)
+
+    return trends
+
+
+def apply_segment_trend_agg(
+    dataframe: Union[pl.DataFrame, Any],
+    segment_agg_exprs: Dict[str, List[Union[pl.Expr, Any]]],
+    segment_labels: Dict[str, str],
+    processing_type: ProcessingType,
+):
+    """Calculate KPI Trends of the baseline and comparison segments in one aggregation
+    over data tagged with the segment mask.
+
+    Args:
+        dataframe (Union[pl.DataFrame, Any]): data tagged with the segment mask
+        segment_agg_exprs (Dict[str, List[Union[pl.Expr, Any]]]): aggregation
+            expressions of each segment
+        segment_labels (Dict[str, str]): DateLabel of each segment
+        processing_type (models.ProcessingType): Processing type depending on ProcessingType
+    """
+    if processing_type == ProcessingType.IN_MEMORY:
+        trend_df = trend_repository.apply_polar_segment_trend_agg(
+            dataframe=dataframe,
+            segment_agg_exprs=segment_agg_exprs,
+            segment_labels=segment_labels,
+        )
+    elif processing_type == ProcessingType.DATABRICKS:
+        trend_df = trend_repository.apply_databricks_trend_agg(date_column=None)
+
+    return trend_df
+
+
+def apply_multi_period_trend_agg(
+    dataframe: Union[pl.DataFrame, Any],
+    partial_exps: tuple,
+    base_period: MetricsTrendType,
+    metrics_trends: List[MetricsTrendType],
+    processing_type: ProcessingType,
+    time_intervals: int = None,
+):
+    """Calculate KPI Trends for several trend types from a single aggregation at the
+    base period.
+
+    Args:
+        dataframe (Union[pl.DataFrame, Any]): data indexed at the base period
+        partial_exps (tuple): expressions from build_partial_metric_exps
+        base_period (MetricsTrendType): finest trend type to aggregate at
+        metrics_trends (List[MetricsTrendType]): trend types to roll up to
+        processing_type (models.ProcessingType): Processing type depending on ProcessingType
+        time_intervals (int, optional): time intervals for which to aggregate the KPI for.
+    """
+    if processing_type == ProcessingType.IN_MEMORY:
+        trends = trend_repository.apply_polar_multi_period_trend_agg(
+            dataframe=dataframe,
+            partial_exps=partial_exps,
+            base_period=base_period,
+            metrics_trends=metrics_trends,
+            time_intervals=time_intervals,
+        )
+    elif processing_type == ProcessingType.DATABRICKS:
+        trends = trend_repository.apply_databricks_trend_agg(date_column=None)
+
+    return trends
+
+
+def get_base_period(metrics_trends: List[MetricsTrendType]) -> MetricsTrendType:
+    """Get the finest trend type all the given trend types roll up from. Weeks do
+    not roll up into months or quarters, so weekly with either of them needs daily.
+
+    Args:
+        metrics_trends (List[MetricsTrendType]): trend types to calculate
+    """
+    periods = set(metrics_trends)
+    if MetricsTrendType.DAILY in periods or (
+        MetricsTrendType.WEEKLY in periods and len(periods) > 1
+    ):
+        return MetricsTrendType.DAILY
+    for period in [
+        MetricsTrendType.WEEKLY,
+        MetricsTrendType.MONTHLY,
+        MetricsTrendType.QUARTERLY,
+    ]:
+        if period in periods:
+            return period
+
+
 def get_baseline_and_comparison_df(
     dataframe: pl.DataFrame,
     insights: MetricsInsight,
@@ -267,3 +483,119 @@ def get_baseline_and_comparison_df(
         return baseline_df, comparison_df
     elif processing_type == ProcessingType.DATABRICKS:
         return True, True
+
+
+def get_segment_labels(insights: MetricsInsight) -> Dict[str, str]:
+    """Get the DateLabel naming the baseline and comparison segments of an insight"""
+    comparison_segment = insights.comparison_segment
+    if insights.comparison_segment:
+        pass
+    elif (
+        insights.comparison_time_period
+        and insights.baseline_time_period
+        and insights.baseline_segment
+    ):
+        comparison_segment = insights.baseline_segment
+
+    return {
+        "baseline": calculation_utils.get_segment_col_name(
+            "baseline", insights.baseline_segment, insights.baseline_time_period
+        ),
+        "comparison": calculation_utils.get_segment_col_name(
+            "comparison",
+            comparison_segment,
+            (
+                insights.comparison_time_period
+                if insights.comparison_time_period
+                else insights.baseline_time_period
+            ),
+        ),
+    }
+
+
+def build_segment_filter_exps(
+    insights: MetricsInsight,
+    processing_type: ProcessingType = "in_memory",
+):
+    """Build the filter expressions of the baseline and comparison segments, rows
+    are selected the same way as get_baseline_and_comparison_df."""
+    if isinstance(insights.metrics, SingleColumnMetric):
+        date_column = insights.metrics.date_column
+    elif isinstance(insights.metrics, DualColumnMetric):
+        date_column = insights.metrics.numerator_metric.date_column
+
+    if not (
+        (insights.baseline_segment and insights.comparison_segment)
+        or (insights.baseline_time_period and insights.comparison_time_period)
+    ):
+        raise Exception("Segments Not Defined!")
+
+    baseline_expr = pl.lit(True)
+    if insights.baseline_time_period:
+        baseline_expr = baseline_expr & calculation_utils.build_time_period_filter_exp(
+            date_column, insights.baseline_time_period
+        )
+    if insights.baseline_segment:
+        baseline_expr = baseline_expr & build_filter_exp(
+            insights.baseline_segment, processing_type
+        )
+
+    comparison_expr = pl.lit(True)
+    comparison_time_period = (
+        insights.comparison_time_period or insights.baseline_time_period
+    )
+    if comparison_time_period:
+        comparison_expr = (
+            comparison_expr
+            & calculation_utils.build_time_period_filter_exp(
+                date_column, comparison_time_period
+            )
+        )
+    if insights.comparison_segment:
+        comparison_expr = comparison_expr & build_filter_exp(
+            insights.comparison_segment, processing_type
+        )
+    elif (
+        insights.comparison_time_period
+        and insights.baseline_time_period
+        and insights.baseline_segment
+    ):
+        comparison_expr = comparison_expr & build_filter_exp(
+            insights.baseline_segment, processing_type
+        )
+
+    return baseline_expr, comparison_expr
+
+
+def get_segment_columns(insights: MetricsInsight) -> List[str]:
+    """Get the columns the baseline and comparison segments of an insight select
+    their rows on, the date column too with time periods"""
+    if isinstance(insights.metrics, SingleColumnMetric):
+        date_column = insights.metrics.date_column
+    elif isinstance(insights.metrics, DualColumnMetric):
+        date_column = insights.metrics.numerator_metric.date_column
+
+    columns = []
+    if insights.baseline_time_period or insights.comparison_time_period:
+        columns.append(date_column)
+    for segment in [insights.baseline_segment, insights.comparison_segment]:
+        columns.extend(segment_filter.column for segment_filter in segment or [])
+    return list(dict.fromkeys(columns))
+
+
+def apply_segment_mask(
+    dataframe,
+    insights: MetricsInsight,
+    processing_type: ProcessingType = "in_memory",
+):
+    """Tag every row with the segments it belongs to in a single pass, rows outside of
+    both segments are dropped."""
+    baseline_expr, comparison_expr = build_segment_filter_exps(
+        insights, processing_type
+    )
+    if processing_type == ProcessingType.IN_MEMORY:
+        return trend_repository.apply_polar_segment_mask(
+            dataframe, baseline_expr, comparison_expr
+        )
+    elif processing_type == ProcessingType.DATABRICKS:
+        return True
@@ -1,12 +1,26 @@
-from datetime import date, datetime
+from datetime import date
 from typing import List, Tuple
 
 import polars as pl
-from pandas import Timestamp
 
 from base.general import Filter
 
 PERIOD_WINDOW_SIZE = {"daily": 6, "weekly": 3, "monthly": 6, "quarterly": 3}
+# periods between a period and the same period of the previous year, a year spans
+# 365 or 366 days and 52 or 53 ISO weeks
+PERIODS_PER_YEAR = {
+    "daily": (365, 366),
+    "weekly": (52, 53),
+    "monthly": (12,),
+    "quarterly": (4,),
+}
+# ordinal 0 of the period index, 1970-01-05 is the first monday after the epoch
+PERIOD_INDEX_EPOCH_YEAR = 1970
+PERIOD_INDEX_EPOCH_MONDAY = 4  # days since 1970-01-01
+# rows of both segments tagged in one pass, bit set for every segment the row is in
+SEGMENT_MASK_COLUMN = "SegmentMask"
+SEGMENT_ROWS_COLUMN = "SegmentRows"
+SEGMENT_BITS = {"baseline": 1, "comparison": 2}
 
 
 def get_time_period_date_label(
@@ -15,83 +29,272 @@ def get_time_period_date_label(
     """Get Time Period Date Label"""
     if period is None:
         return dataframe.with_columns(DateLabel=pl.lit("Overall"))
-    elif period == "weekly":
-        return dataframe.with_columns(
-            DateLabel=pl.col(date_column).apply(
-                lambda date: "{:04d}WK{:02d}".format(
-                    Timestamp(date).year, Timestamp(date).week
-                )
-            )
+    return dataframe.with_columns(
+        build_date_label_expr(pl.col(date_column), period).alias("DateLabel")
+    )
+
+
+def build_date_label_expr(date_expr: pl.Expr, period: str) -> pl.Expr:
+    """Build the native expression labelling dates with their time period
+
+    Labels are weekly YYYYWKww (ISO year and week, as the labels rendered from the
+    period index), monthly YYYYMmm(MonthName), quarterly YYYYQq and daily YYYYMMDD.
+
+    Args:
+        date_expr (pl.Expr): expression of the date or datetime column
+        period (str): time period of the label, look at MetricsTrendType
+    """
+    year = date_expr.dt.year().cast(pl.Utf8).str.zfill(4)
+    if period == "weekly":
+        return pl.concat_str(
+            [
+                date_expr.dt.iso_year().cast(pl.Utf8).str.zfill(4),
+                pl.lit("WK"),
+                date_expr.dt.week().cast(pl.Utf8).str.zfill(2),
+            ]
         )
     elif period == "monthly":
-        return dataframe.with_columns(
-            DateLabel=pl.col(date_column).apply(
-                lambda date: "{:04d}M{:02d}({:s})".format(
-                    Timestamp(date).year,
-                    Timestamp(date).month,
-                    Timestamp(date).month_name(),
-                )
-            )
-        )
+        return date_expr.dt.strftime("%YM%m(%B)")
     elif period == "quarterly":
-        return dataframe.with_columns(
-            DateLabel=pl.col(date_column).apply(
-                lambda date: "{:04d}Q{:d}".format(
-                    Timestamp(date).year, Timestamp(date).quarter
-                )
-            )
-        )
+        return pl.concat_str([year, pl.lit("Q"), date_expr.dt.quarter().cast(pl.Utf8)])
     elif period == "daily":  # daily YYYYMMDD
-        return dataframe.with_columns(
-            DateLabel=pl.col(date_column).apply(
-                lambda date: "{:04d}{:02d}{:02d}".format(
-                    Timestamp(date).year, Timestamp(date).month, Timestamp(date).day
-                )
-            )
-        )
+        return date_expr.dt.strftime("%Y%m%d")
+    else:
+        accepted_values = ["daily", "weekly", "monthly", "quarterly"]
+        raise ValueError(f"period should be either of {accepted_values}")
 
 
-def get_date_from_date_label(
-    df: pl.DataFrame, period: str, date_label_column="DateLabel"
+def get_time_period_index(
+    date_column: str, dataframe: pl.DataFrame, period: str = None
 ):
+    """Get Time Period Index, the Int32 ordinal of the time period used as the
+    internal time axis instead of the string DateLabel"""
+    if period is None:
+        return get_time_period_date_label(date_column, dataframe, period)
+    return dataframe.with_columns(
+        build_period_index_expr(pl.col(date_column), period).alias("PeriodIndex")
+    )
+
+
+def build_period_index_expr(date_expr: pl.Expr, period: str) -> pl.Expr:
+    """Build the expression of the Int32 ordinal of the time period of a date
+
+    Ordinals are days since 1970-01-01 for daily, ISO weeks since the week of
+    1970-01-05 for weekly, months since 1970-01 for monthly and quarters since
+    1970Q1 for quarterly.
+
+    Args:
+        date_expr (pl.Expr): expression of the date or datetime column
+        period (str): time period of the index, look at MetricsTrendType
     """
-    Convert the `DateLabel` string back into date
-    """
+    if period == "daily":
+        return date_expr.cast(pl.Date).cast(pl.Int32)
+    elif period == "weekly":
+        return (
+            (date_expr.cast(pl.Date).cast(pl.Int32) - PERIOD_INDEX_EPOCH_MONDAY) // 7
+        ).cast(pl.Int32)
+    elif period == "monthly":
+        return (
+            (date_expr.dt.year() - PERIOD_INDEX_EPOCH_YEAR) * 12
+            + date_expr.dt.month()
+            - 1
+        ).cast(pl.Int32)
+    elif period == "quarterly":
+        return (
+            (date_expr.dt.year() - PERIOD_INDEX_EPOCH_YEAR) * 4
+            + date_expr.dt.quarter()
+            - 1
+        ).cast(pl.Int32)
+    else:
+        accepted_values = ["daily", "weekly", "monthly", "quarterly"]
+        raise ValueError(f"period should be either of {accepted_values}")
 
-    def parse_quarter(date):
-        year, quarter = date.upper().split("Q")
-        dt = datetime(int(year), int(quarter) * 3 - 2, 1)
-        return dt.strftime("%Y-%m-%d")
 
-    if period == "weekly":
-        df = df.with_columns(
-            pl.col(date_label_column)
-            .apply(lambda x: datetime.strptime(x + "-1", "%YWK%W-%w"))
-            .cast(pl.Date)
-            .alias("parsed_date")
-        )
+def build_period_start_date_expr(index_expr: pl.Expr, period: str) -> pl.Expr:
+    """Build the expression of the first date of the period, the arithmetic inverse
+    of build_period_index_expr
 
+    Args:
+        index_expr (pl.Expr): expression of the period index column
+        period (str): time period of the index, look at MetricsTrendType
+    """
+    if period == "daily":
+        return index_expr.cast(pl.Date)
+    elif period == "weekly":
+        return (index_expr * 7 + PERIOD_INDEX_EPOCH_MONDAY).cast(pl.Date)
     elif period == "monthly":
-        df = df.with_columns(
-            pl.col(date_label_column)
-            .apply(lambda x: datetime.strptime(x, "%Y%B"))
-            .cast(pl.Date)
-            .alias("parsed_date")
+        return pl.date(
+            index_expr // 12 + PERIOD_INDEX_EPOCH_YEAR, index_expr % 12 + 1, 1
+        )
+    elif period == "quarterly":
+        return pl.date(
+            index_expr // 4 + PERIOD_INDEX_EPOCH_YEAR, (index_expr % 4) * 3 + 1, 1
         )
+    else:
+        accepted_values = ["daily", "weekly", "monthly", "quarterly"]
+        raise ValueError(f"period should be either of {accepted_values}")
+
 
+def build_yoy_period_index_expr(index_expr: pl.Expr, period: str) -> pl.Expr:
+    """Build the expression of the period index one year before, null when the
+    same period does not exist in the previous year (29th February, ISO week 53)
+
+    Args:
+        index_expr (pl.Expr): expression of the period index column
+        period (str): time period of the index, look at MetricsTrendType
+    """
+    if period == "monthly":
+        return index_expr - 12
     elif period == "quarterly":
-        df = df.with_columns(
-            pl.col(date_label_column)
-            .apply(parse_quarter)
-            .cast(pl.Date)
-            .alias("parsed_date")
+        return index_expr - 4
+
+    start_date = build_period_start_date_expr(index_expr, period)
+    if period == "daily":
+        return (
+            pl.when((start_date.dt.month() == 2) & (start_date.dt.day() == 29))
+            .then(None)
+            .otherwise(start_date.dt.offset_by("-1y").cast(pl.Int32))
+        )
+    elif period == "weekly":
+        # monday of the same ISO week number in the previous ISO year
+        jan_4th = pl.date(start_date.dt.iso_year() - 1, 1, 4)
+        yoy_date = (
+            jan_4th
+            - pl.duration(days=jan_4th.dt.weekday() - 1)
+            + pl.duration(weeks=start_date.dt.week() - 1)
+        )
+        return (
+            pl.when(yoy_date.dt.week() == start_date.dt.week())
+            .then(build_period_index_expr(yoy_date, period))
+            .otherwise(None)
         )
     else:
-        df = df.with_columns(
-            pl.col(date_label_column).str.to_date(format="%Y%m%d").alias("parsed_date")
+        accepted_values = ["daily", "weekly", "monthly", "quarterly"]
+        raise ValueError(f"period should be either of {accepted_values}")
+
+
+def build_date_label_from_period_index_expr(
+    index_expr: pl.Expr, period: str
+) -> pl.Expr:
+    """Build the expression rendering the DateLabel of a period index. Weekly labels
+    use the ISO year of the week so a week is never split at the year boundary.
+
+    Args:
+        index_expr (pl.Expr): expression of the period index column
+        period (str): time period of the index, look at MetricsTrendType
+    """
+    start_date = build_period_start_date_expr(index_expr, period)
+    if period == "weekly":
+        return pl.concat_str(
+            [
+                start_date.dt.iso_year().cast(pl.Utf8).str.zfill(4),
+                pl.lit("WK"),
+                start_date.dt.week().cast(pl.Utf8).str.zfill(2),
+            ]
         )
+    return build_date_label_expr(start_date, period)
+
+
+def render_date_label(
+    dataframe: pl.DataFrame, period: str, index_column: str = "PeriodIndex"
+):
+    """Render the human readable DateLabel of a period indexed dataframe, it is
+    added as the first column"""
+    return dataframe.select(
+        build_date_label_from_period_index_expr(pl.col(index_column), period).alias(
+            "DateLabel"
+        ),
+        pl.all().exclude("DateLabel"),
+    )
+
 
-    return df
+def get_time_column(dataframe: pl.DataFrame | pl.LazyFrame) -> str:
+    """Get the column of the time axis, the PeriodIndex when present otherwise the
+    DateLabel"""
+    if isinstance(dataframe, pl.LazyFrame):
+        columns = dataframe.collect_schema().names()
+    else:
+        columns = dataframe.columns
+    return "PeriodIndex" if "PeriodIndex" in columns else "DateLabel"
+
+
+def get_date_from_date_label(
+    df: pl.DataFrame, period: str, date_label_column="DateLabel"
+):
+    """
+    Convert the `DateLabel` string back into date, when the dataframe carries the
+    `PeriodIndex` the date is derived from it arithmetically
+    """
+    if "PeriodIndex" in df.columns:
+        return df.with_columns(
+            build_period_start_date_expr(pl.col("PeriodIndex"), period).alias(
+                "parsed_date"
+            )
+        )
+
+    # labels repeat heavily, each distinct label is parsed once and mapped back
+    labels_df = (
+        df.select(pl.col(date_label_column).unique())
+        .drop_nulls()
+        .with_columns(
+            build_date_from_date_label_expr(pl.col(date_label_column), period).alias(
+                "parsed_date"
+            )
+        )
+    )
+    return df.with_columns(
+        pl.col(date_label_column)
+        .replace_strict(
+            labels_df.get_column(date_label_column),
+            labels_df.get_column("parsed_date"),
+            default=None,
+            return_dtype=pl.Date,
+        )
+        .alias("parsed_date")
+    )
+
+
+def build_date_from_date_label_expr(label_expr: pl.Expr, period: str) -> pl.Expr:
+    """Build the native expression parsing a DateLabel back into the first date of
+    its period, with string slicing and date construction only.
+
+    Labels produced by build_date_label_from_period_index_expr round-trip: the parsed
+    date is labelled with the original label again. Weekly labels are resolved to the
+    monday of the ISO week, which is in the previous year for a week 01 starting in
+    December. Legacy labels of the calendar year, as 2021WK53 for 2021-01-01, resolve
+    to the monday of their ISO week number.
+
+    Args:
+        label_expr (pl.Expr): expression of the DateLabel column
+        period (str): time period of the label, look at MetricsTrendType
+    """
+    year = label_expr.str.slice(0, 4).cast(pl.Int32)
+    if period == "weekly":  # YYYYWKww
+        week = label_expr.str.slice(6, 2).cast(pl.Int32)
+        # week 53 of a year without one belongs to the previous ISO year, the 28th
+        # December is always in the last ISO week of its year
+        has_53_weeks = pl.date(year, 12, 28).dt.week() == 53
+        iso_year = pl.when((week == 53) & ~has_53_weeks).then(year - 1).otherwise(year)
+        jan_4th = pl.date(iso_year, 1, 4)
+        return (
+            jan_4th
+            - pl.duration(days=jan_4th.dt.weekday() - 1)
+            + pl.duration(weeks=week - 1)
+        )
+    elif period == "monthly":  # YYYYMmm(MonthName)
+        return pl.date(year, label_expr.str.slice(5, 2).cast(pl.Int32), 1)
+    elif period == "quarterly":  # YYYYQq
+        quarter = label_expr.str.slice(5, 1).cast(pl.Int32)
+        return pl.date(year, (quarter - 1) * 3 + 1, 1)
+    elif period == "daily":  # YYYYMMDD
+        return pl.date(
+            year,
+            label_expr.str.slice(4, 2).cast(pl.Int32),
+            label_expr.str.slice(6, 2).cast(pl.Int32),
+        )
+    else:
+        accepted_values = ["daily", "weekly", "monthly", "quarterly"]
+        raise ValueError(f"period should be either of {accepted_values}")
 
 
 def get_segment_col_name(
@@ -107,9 +310,25 @@ def get_segment_col_name(
     return segment_name
 
 
+def build_time_period_filter_exp(date_column: str, time_period: Tuple[date, date]):
+    return pl.col(date_column).ge(time_period[0]) & pl.col(date_column).le(
+        time_period[1]
+    )
+
+
 def apply_time_period_filter(
     dataframe: pl.DataFrame, date_column: str, time_period: Tuple[date, date]
 ):
-    return dataframe.filter(
-        pl.col(date_column).ge(time_period[0]) & pl.col(date_column).le(time_period[1])
-    )
+    return dataframe.filter(build_time_period_filter_exp(date_column, time_period))
+
+
+def build_segment_member_exp(segment: str) -> pl.Expr:
+    """Build the expression selecting the rows of a segment tagged with the segment mask
+
+    Args:
+        segment (str): either of "baseline" or "comparison"
+    """
+    if segment not in SEGMENT_BITS:
+        accepted_values = list(SEGMENT_BITS)
+        raise ValueError(f"segment should be either of {accepted_values}")
+    return (pl.col(SEGMENT_MASK_COLUMN) & SEGMENT_BITS[segment]) != 0
@@ -0,0 +1,210 @@
+"""In-memory registry of loaded datasets shared across requests"""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict
+
+import polars as pl
+
+from data_source import utils as data_source_utils
+
+REGISTRY_MAX_MEMORY_BYTES = int(
+    os.environ.get("INSIGHTS_REGISTRY_MAX_MEMORY_BYTES", 4 * 1024 * 1024 * 1024)
+)
+# number of inspected CSV schemas kept, they hold a dtype name per column
+REGISTRY_MAX_SCHEMAS = int(os.environ.get("INSIGHTS_REGISTRY_MAX_SCHEMAS", 256))
+
+
+class DatasetRegistry:
+    """Process-wide registry of polars dataframes keyed by source fingerprint.
+
+    Datasets are kept in memory until the memory budget is exceeded, then the least
+    recently used ones are evicted. The inspected schemas of the sources are kept
+    alongside, so the sessions only hold the path of a source.
+    """
+
+    def __init__(self, max_memory_bytes: int = REGISTRY_MAX_MEMORY_BYTES) -> None:
+        self.max_memory_bytes = max_memory_bytes
+        self._datasets: OrderedDict[str, pl.DataFrame] = OrderedDict()
+        self._sizes: dict[str, int] = {}
+        self._schemas: OrderedDict[str, Dict] = OrderedDict()
+        self._load_locks: dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def memory_bytes(self) -> int:
+        """Estimated memory held by the registered datasets"""
+        return sum(self._sizes.values())
+
+    def get_key(
+        self,
+        path: str,
+        date_column: str = None,
+        dtypes: Dict[str, str] = None,
+        date_format: str = None,
+    ) -> str:
+        """Registry key of a source, changes whenever the file changes or is typed
+        differently
+
+        Args:
+            path (str): path of the source file.
+            date_column (str, optional): Date column name in the dataframe.
+            dtypes (Dict[str, str], optional): Column dtypes sampled by
+                inspect_csv_schema.
+            date_format (str, optional): Format of a string date column.
+        """
+        return data_source_utils.get_cache_key(path, date_column, dtypes, date_format)
+
+    def get_schema(self, path: str, date_column: str = None) -> Dict:
+        """Get the schema of a CSV source from inspect_csv_schema, inspecting it once
+        per version of the file
+
+        Args:
+            path (str): path of the CSV file.
+            date_column (str, optional): Date column name in the dataframe.
+        """
+        key = self.get_key(path, date_column)
+        with self._lock:
+            if key in self._schemas:
+                self._schemas.move_to_end(key)
+                return self._schemas[key]
+
+        schema = data_source_utils.inspect_csv_schema(path, date_column=date_column)
+        with self._lock:
+            self._schemas[key] = schema
+            while len(self._schemas) > REGISTRY_MAX_SCHEMAS:
+                self._schemas.popitem(last=False)
+        return schema
+
+    def peek(
+        self,
+        path: str,
+        date_column: str = None,
+        dtypes: Dict[str, str] = None,
+        date_format: str = None,
+    ) -> pl.DataFrame | None:
+        """Get a dataset only if it is already registered, never loads it
+
+        Args:
+            path (str): path of the source file.
+            date_column (str, optional): Date column name in the dataframe.
+            dtypes (Dict[str, str], optional): Column dtypes sampled by
+                inspect_csv_schema.
+            date_format (str, optional): Format of a string date column.
+        """
+        key = self.get_key(path, date_column, dtypes, date_format)
+        with self._lock:
+            if key in self._datasets:
+                self._datasets.move_to_end(key)
+                return self._datasets[key]
+        return None
+
+    def get_or_scan(
+        self,
+        path: str,
+        date_column: str = None,
+        dtypes: Dict[str, str] = None,
+        date_format: str = None,
+    ) -> pl.DataFrame | pl.LazyFrame:
+        """Get a dataset from the registry, or a scan of its typed copy when the copy
+        is over the memory budget, so only the rows and columns read are loaded
+
+        Args:
+            path (str): path of the source file.
+            date_column (str, optional): Date column name in the dataframe.
+            dtypes (Dict[str, str], optional): Column dtypes sampled by
+                inspect_csv_schema.
+            date_format (str, optional): Format of a string date column.
+        """
+        df = self.peek(path, date_column, dtypes, date_format)
+        if df is not None:
+            return df
+
+        cache_file = data_source_utils.get_cached_file(
+            path, date_column, dtypes=dtypes, date_format=date_format
+        )
+        # the Arrow IPC copy takes about the memory of the loaded dataset
+        if os.path.getsize(cache_file) > self.max_memory_bytes:
+            return pl.scan_ipc(cache_file, memory_map=True)
+        return self.get(path, date_column, dtypes, date_format)
+
+    def get(
+        self,
+        path: str,
+        date_column: str = None,
+        dtypes: Dict[str, str] = None,
+        date_format: str = None,
+        loader: Callable[..., pl.DataFrame] = data_source_utils.load_df_from_cache,
+        **loader_kwargs,
+    ) -> pl.DataFrame:
+        """Get a dataset from the registry, loading it on the first call
+
+        Args:
+            path (str): path of the source file.
+            date_column (str, optional): Date column name in the dataframe.
+            dtypes (Dict[str, str], optional): Column dtypes sampled by
+                inspect_csv_schema.
+            date_format (str, optional): Format of a string date column.
+            loader (Callable, optional): function loading the dataset on a miss.
+                Defaults to the columnar cache loader.
+            loader_kwargs: extra keyword arguments passed to the loader.
+        """
+        key = self.get_key(path, date_column, dtypes, date_format)
+        with self._lock:
+            if key in self._datasets:
+                self._datasets.move_to_end(key)
+                return self._datasets[key]
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        # concurrent requests for the same source wait for a single load
+        try:
+            with load_lock:
+                with self._lock:
+                    if key in self._datasets:
+                        self._datasets.move_to_end(key)
+                        return self._datasets[key]
+
+                df = loader(
+                    path,
+                    date_column=date_column,
+                    dtypes=dtypes,
+                    date_format=date_format,
+                    **loader_kwargs,
+                )
+                self.add(key, df)
+        finally:
+            # also when the loader raises, a later call retries with a fresh lock
+            with self._lock:
+                self._load_locks.pop(key, None)
+        return df
+
+    def add(self, key: str, df: pl.DataFrame):
+        """Register a dataset and evict the least recently used ones over budget
+
+        Args:
+            key (str): registry key of the dataset.
+            df (pl.DataFrame): dataset to register.
+        """
+        size = df.estimated_size()
+        if size > self.max_memory_bytes:
+            print(f"Dataset {key} exceeds the registry memory budget, not registered")
+            return
+
+        with self._lock:
+            self._datasets[key] = df
+            self._sizes[key] = size
+            self._datasets.move_to_end(key)
+            while self.memory_bytes > self.max_memory_bytes:
+                evicted_key, _ = self._datasets.popitem(last=False)
+                self._sizes.pop(evicted_key)
+
+    def clear(self):
+        """Remove all registered datasets and schemas"""
+        with self._lock:
+            self._datasets.clear()
+            self._sizes.clear()
+            self._schemas.clear()
+
+
+dataset_registry = DatasetRegistry()
@@ -0,0 +1,137 @@
+"""In-memory store of frames spilled to Parquet files over its memory budget"""
+
+import os
+import threading
+from collections import OrderedDict
+
+import polars as pl
+
+from data_source import utils as data_source_utils
+
+
+class SpillStore:
+    """Process-wide store of values keyed by file name safe keys.
+
+    Values are kept in memory until the memory budget is exceeded, then the least
+    recently used ones are spilled to Parquet files in spill_dir, which are evicted
+    in turn once the directory exceeds max_spill_bytes. Values are frames, stores
+    keeping more than a frame per key override get_size, write_spill and read_spill.
+    """
+
+    def __init__(
+        self, max_memory_bytes: int, spill_dir: str, max_spill_bytes: int
+    ) -> None:
+        self.max_memory_bytes = max_memory_bytes
+        self.spill_dir = spill_dir
+        self.max_spill_bytes = max_spill_bytes
+        self._values: OrderedDict[str, object] = OrderedDict()
+        self._sizes: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def memory_bytes(self) -> int:
+        """Estimated memory held by the values in memory"""
+        return sum(self._sizes.values())
+
+    def get_spill_file(self, key: str) -> str:
+        """Path of the Parquet file a value is spilled to"""
+        return os.path.join(self.spill_dir, f"{key}.parquet")
+
+    def get_size(self, value) -> int:
+        """Estimated memory held by a value"""
+        return value.estimated_size()
+
+    def get(self, key: str):
+        """Get the value of a key from memory, or from its spilled files
+
+        Args:
+            key (str): key of the value
+        """
+        with self._lock:
+            if key in self._values:
+                self._values.move_to_end(key)
+                return self._values[key]
+
+        value = self.read_spill(key)
+        if value is not None:
+            self.add(key, value, spilled=True)
+        return value
+
+    def add(self, key: str, value, spilled: bool = False):
+        """Keep the value of a key in memory and spill the least recently used ones
+        over budget
+
+        Args:
+            key (str): key of the value
+            value: value to keep
+            spilled (bool, optional): whether the value is already spilled
+        """
+        size = self.get_size(value)
+        if size > self.max_memory_bytes:
+            if not spilled:
+                self.spill(key, value)
+            return
+
+        evicted = []
+        with self._lock:
+            self._values[key] = value
+            self._sizes[key] = size
+            self._values.move_to_end(key)
+            while self.memory_bytes > self.max_memory_bytes:
+                evicted_key = next(iter(self._values))
+                evicted.append((evicted_key, self.pop(evicted_key)))
+
+        for evicted_key, evicted_value in evicted:
+            self.spill(evicted_key, evicted_value)
+
+    def pop(self, key: str):
+        """Remove the value of a key from memory, call holding the lock"""
+        self._sizes.pop(key)
+        return self._values.pop(key)
+
+    def spill(self, key: str, value):
+        """Write the value of a key to its spilled files, unless already written,
+        and evict the least recently used spilled files over max_spill_bytes
+
+        Args:
+            key (str): key of the value
+            value: value to spill
+        """
+        spill_file = self.get_spill_file(key)
+        if os.path.isfile(spill_file):
+            return
+        try:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            self.write_spill(key, value)
+            data_source_utils.evict_cached_files(
+                self.spill_dir,
+                self.max_spill_bytes,
+                keep=spill_file,
+                extension=".parquet",
+            )
+        except OSError as e:
+            print("Exception as exc ", e)
+
+    def write_spill(self, key: str, value):
+        """Write the value of a key to its Parquet file"""
+        data_source_utils.write_file_atomic(
+            self.get_spill_file(key), value.write_parquet
+        )
+
+    def read_spill(self, key: str):
+        """Read the value of a key from its Parquet file, None when it is not spilled
+        or was evicted"""
+        spill_file = self.get_spill_file(key)
+        try:
+            value = pl.read_parquet(spill_file)
+            # bump the modification time, it is the recency used by the eviction
+            os.utime(spill_file)
+        except (FileNotFoundError, OSError):
+            return None
+        return value
+
+    def clear(self):
+        """Remove all values kept in memory, spilled files are left to eviction"""
+        with self._lock:
+            self._values.clear()
+            self._sizes.clear()
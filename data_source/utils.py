@@ -1,21 +1,66 @@
 """Utility functions realted to data loading from source"""
 
+import hashlib
+import json
 import os
+import tempfile
+import threading
+from typing import Callable, Dict
 
 import polars as pl
 
+CACHE_DIR = os.environ.get(
+    "INSIGHTS_CACHE_DIR", os.path.join(tempfile.gettempdir(), "insights_cache")
+)
+CACHE_MAX_SIZE_BYTES = int(
+    os.environ.get("INSIGHTS_CACHE_MAX_SIZE_BYTES", 10 * 1024 * 1024 * 1024)
+)
+FINGERPRINT_BLOCK_SIZE = 1024 * 1024
+SCHEMA_SAMPLE_ROWS = 1000
+# %Y also parses 2 digit years, a format parsing years before this one is rejected
+MIN_DATE_YEAR = 1900
+# candidate formats for string date columns, the first one is the legacy default
+DATE_FORMATS = [
+    "%-m/%-d/%y %k:%M",
+    "%Y-%m-%d",
+    "%Y/%m/%d",
+    "%m/%d/%Y",
+    "%d/%m/%Y",
+    "%m/%d/%y",
+    "%d-%m-%Y",
+    "%d-%m-%y",
+    "%Y%m%d",
+    "%Y-%m-%d %H:%M:%S",
+    "%m/%d/%Y %H:%M",
+]
 
-def load_df_from_csv(path: str, date_column: str = None):
+
+def load_df_from_csv(
+    path: str,
+    date_column: str = None,
+    dtypes: Dict[str, str] = None,
+    date_format: str = None,
+):
     """Loading dataframe from CSV and typecasting the dates
 
     Args:
         path (str): path of the files.
         date_column (str, optional): Date column name in the dataframe. Defaults to None.
+        dtypes (Dict[str, str], optional): Column dtypes sampled by inspect_csv_schema,
+            reused instead of inferring them again. Defaults to None.
+        date_format (str, optional): Format of a string date column. Defaults to the
+            legacy "%-m/%-d/%y %k:%M" format.
 
     Returns:
         pl.DataFrame: polars dataframe with proper date format
     """
-    df = pl.read_csv(path, try_parse_dates=True)
+    schema_overrides = get_schema_overrides(dtypes)
+    try:
+        df = pl.read_csv(path, try_parse_dates=True, schema_overrides=schema_overrides)
+    except pl.exceptions.ComputeError as e:
+        # the sampled dtypes did not hold for the rest of the file
+        print("Exception as exc ", e)
+        df = pl.read_csv(path, try_parse_dates=True)
 
     if date_column is not None and date_column in df.columns:
         d_type = df.dtypes[list(df.columns).index(date_column)]
@@ -27,7 +72,7 @@ def load_df_from_csv(path: str, date_column: str = None):
     if d_type == pl.Utf8:
         non_null_count = (
             df.filter(
-                pl.col(date_column).str.lengths().gt(0)
+                pl.col(date_column).str.len_chars().gt(0)
                 & pl.col(date_column).is_not_null()
             )
             .select(pl.col(date_column).count())
@@ -37,7 +82,7 @@ def load_df_from_csv(path: str, date_column: str = None):
             try:
                 df = df.with_columns(
                     pl.col(date_column)
-                    .str.to_date("%-m/%-d/%y %k:%M")
+                    .str.to_date(date_format or DATE_FORMATS[0])
                     .alias(date_column)
                 )
             except Exception as e:
@@ -45,12 +90,256 @@ def load_df_from_csv(path: str, date_column: str = None):
     return df
 
 
+def inspect_csv_schema(
+    path: str, date_column: str = None, sample_rows: int = SCHEMA_SAMPLE_ROWS
+) -> Dict:
+    """Inspect the schema of a CSV from its header and a bounded sample of rows
+
+    Args:
+        path (str): path of the files.
+        date_column (str, optional): Date column name in the dataframe. Defaults to None.
+        sample_rows (int, optional): Number of rows to sample. Defaults to SCHEMA_SAMPLE_ROWS.
+
+    Returns:
+        Dict: "columns" in file order, "dtypes" as dtype names per column and the
+            detected "date_format" of the date column, None when already typed.
+    """
+    sample_df = pl.read_csv(
+        path, n_rows=sample_rows, infer_schema_length=sample_rows, try_parse_dates=True
+    )
+
+    if date_column is not None and date_column not in sample_df.columns:
+        error_msg = "date_column not present in given CSV file!"
+        print(error_msg)
+        raise Exception(error_msg)
+
+    date_format = None
+    if date_column is not None and sample_df.schema[date_column] == pl.Utf8:
+        date_format = detect_date_format(sample_df.get_column(date_column))
+
+    return {
+        "columns": sample_df.columns,
+        "dtypes": {column: str(dtype) for column, dtype in sample_df.schema.items()},
+        "date_format": date_format,
+    }
+
+
+def detect_date_format(values: pl.Series) -> str | None:
+    """Detect the format of string dates from DATE_FORMATS
+
+    Args:
+        values (pl.Series): string dates to detect the format of.
+
+    Returns:
+        str | None: first format parsing every non empty value into years from
+            MIN_DATE_YEAR, None if none does.
+    """
+    values = values.filter(values.is_not_null() & values.str.len_chars().gt(0))
+    if values.len() == 0:
+        return None
+
+    for date_format in DATE_FORMATS:
+        try:
+            dates = values.str.to_date(date_format)
+        except Exception:
+            continue
+        # "1/2/23" parses with %m/%d/%Y as year 23, the %y format comes later
+        if dates.dt.year().min() < MIN_DATE_YEAR:
+            continue
+        return date_format
+    return None
+
+
+def get_schema_overrides(dtypes: Dict[str, str] = None) -> Dict | None:
+    """Convert dtype names from inspect_csv_schema back to polars dtypes. Names of
+    parametrized dtypes are skipped and left to inference.
+
+    Args:
+        dtypes (Dict[str, str], optional): dtype names per column.
+    """
+    if not dtypes:
+        return None
+
+    schema_overrides = {}
+    for column, dtype_name in dtypes.items():
+        dtype = getattr(pl, dtype_name, None)
+        if isinstance(dtype, type) and issubclass(dtype, pl.DataType):
+            schema_overrides[column] = dtype
+    return schema_overrides
+
+
+def get_file_fingerprint(path: str) -> str:
+    """Fingerprint of a source file built from its path, size, modification time and
+    a hash of its leading and trailing blocks
+
+    Args:
+        path (str): path of the file.
+
+    Returns:
+        str: hex digest identifying the current version of the file
+    """
+    stat = os.stat(path)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(os.path.abspath(path).encode())
+    digest.update(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+    with open(path, "rb") as file:
+        digest.update(file.read(FINGERPRINT_BLOCK_SIZE))
+        if stat.st_size > FINGERPRINT_BLOCK_SIZE:
+            file.seek(
+                max(stat.st_size - FINGERPRINT_BLOCK_SIZE, FINGERPRINT_BLOCK_SIZE)
+            )
+            digest.update(file.read(FINGERPRINT_BLOCK_SIZE))
+    return digest.hexdigest()
+
+
+def get_cache_key(
+    path: str,
+    date_column: str = None,
+    dtypes: Dict[str, str] = None,
+    date_format: str = None,
+) -> str:
+    """Key of the typed copy of a source file, changes whenever the file changes or
+    is typed differently
+
+    Args:
+        path (str): path of the CSV or Parquet file.
+        date_column (str, optional): Date column name in the dataframe. Defaults to None.
+        dtypes (Dict[str, str], optional): Column dtypes sampled by inspect_csv_schema.
+        date_format (str, optional): Format of a string date column.
+    """
+    cache_key = json.dumps(
+        [get_file_fingerprint(path), date_column, dtypes, date_format], sort_keys=True
+    )
+    return hashlib.blake2b(cache_key.encode(), digest_size=16).hexdigest()
+
+
+def get_cached_file(
+    path: str,
+    date_column: str = None,
+    cache_dir: str = CACHE_DIR,
+    max_cache_size: int = CACHE_MAX_SIZE_BYTES,
+    dtypes: Dict[str, str] = None,
+    date_format: str = None,
+) -> str:
+    """Get the Arrow IPC copy of a source file from the cache, converting it on the
+    first call. Dates are typecasted before the copy is written.
+
+    Args:
+        path (str): path of the CSV or Parquet file.
+        date_column (str, optional): Date column name in the dataframe. Defaults to None.
+        cache_dir (str, optional): directory holding the cached files.
+        max_cache_size (int, optional): size in bytes above which the least recently
+            used cached files are evicted.
+        dtypes (Dict[str, str], optional): Column dtypes sampled by inspect_csv_schema.
+        date_format (str, optional): Format of a string date column.
+
+    Returns:
+        str: path of the cached Arrow IPC file
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_file = os.path.join(
+        cache_dir, get_cache_key(path, date_column, dtypes, date_format) + ".arrow"
+    )
+
+    if os.path.isfile(cache_file):
+        # bump the modification time, it is the recency used by the eviction
+        os.utime(cache_file)
+        return cache_file
+
+    if path.endswith(".parquet"):
+        df = load_df_from_parquet(path, date_column=date_column)
+    else:
+        df = load_df_from_csv(
+            path, date_column=date_column, dtypes=dtypes, date_format=date_format
+        )
+
+    write_file_atomic(cache_file, df.write_ipc)
+
+    evict_cached_files(cache_dir, max_cache_size, keep=cache_file)
+    return cache_file
+
+
+def write_file_atomic(file_path: str, write: Callable[[str], None]):
+    """Write a file to a temporary file first, then move it in place so concurrent
+    readers never see a partial file
+
+    Args:
+        file_path (str): path of the file.
+        write (Callable[[str], None]): writes the content to the path it is given.
+    """
+    tmp_file = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    write(tmp_file)
+    os.replace(tmp_file, file_path)
+
+
+def evict_cached_files(
+    cache_dir: str, max_cache_size: int, keep: str = None, extension: str = ".arrow"
+):
+    """Evict least recently used files until the cache directory fits the size limit
+
+    Args:
+        cache_dir (str): directory holding the cached files.
+        max_cache_size (int): maximum size of the cache directory in bytes.
+        keep (str, optional): cached file which should never be evicted.
+        extension (str, optional): extension of the cached files.
+    """
+    cached_files = []
+    for file_name in os.listdir(cache_dir):
+        if not file_name.endswith(extension):
+            continue
+        file_path = os.path.join(cache_dir, file_name)
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            continue
+        cached_files.append((stat.st_mtime, stat.st_size, file_path))
+
+    total_size = sum(size for _, size, _ in cached_files)
+    for _, size, file_path in sorted(cached_files):
+        if total_size <= max_cache_size:
+            break
+        if file_path == keep:
+            continue
+        try:
+            os.remove(file_path)
+            total_size -= size
+        except OSError as e:
+            print("Exception as exc ", e)
+
+
+def load_df_from_cache(
+    path: str,
+    date_column: str = None,
+    cache_dir: str = CACHE_DIR,
+    max_cache_size: int = CACHE_MAX_SIZE_BYTES,
+    dtypes: Dict[str, str] = None,
+    date_format: str = None,
+):
+    """Loading dataframe through the columnar cache. The source is parsed only once,
+    later loads memory-map the typed Arrow IPC copy.
+
+    Args:
+        path (str): path of the CSV or Parquet file.
+        date_column (str, optional): Date column name in the dataframe. Defaults to None.
+        cache_dir (str, optional): directory holding the cached files.
+        max_cache_size (int, optional): size limit of the cache directory in bytes.
+        dtypes (Dict[str, str], optional): Column dtypes sampled by inspect_csv_schema.
+        date_format (str, optional): Format of a string date column.
+
+    Returns:
+        pl.DataFrame: polars dataframe with proper date format
+    """
+    cache_file = get_cached_file(
+        path, date_column, cache_dir, max_cache_size, dtypes, date_format
+    )
+    return pl.read_ipc(cache_file, memory_map=True)
+
+
 def load_df_from_parquet(
     path: str, date_column: str = None, is_api_response: bool = False
 ):
 
     df = pl.read_parquet(path)
-    print(df)
 
     if date_column is not None and date_column in df.columns:
         pass
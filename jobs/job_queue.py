@@ -0,0 +1,245 @@
+"""Bounded pool of background jobs running the insights outside of the requests"""
+
+import os
+import threading
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+from typing import Callable
+
+from base.jobs import JobStatus
+
+# jobs running at once, every running job holds its dataset and intermediate frames
+# in memory so this bounds the memory of the insights of the process
+JOB_MAX_WORKERS = int(os.environ.get("INSIGHTS_JOB_MAX_WORKERS", 2))
+# jobs queued or running at once, further submissions are rejected
+JOB_MAX_PENDING = int(os.environ.get("INSIGHTS_JOB_MAX_PENDING", 16))
+# seconds a finished job and its result are kept for retrieval
+JOB_TTL_SECONDS = float(os.environ.get("INSIGHTS_JOB_TTL_SECONDS", 3600))
+
+FINISHED_STATUSES = (JobStatus.SUCCEEDED, JobStatus.FAILED, JobStatus.CANCELLED)
+
+
+class JobCancelled(Exception):
+    """Raised inside a running job at its first checkpoint after a cancellation"""
+
+
+class JobQueueFull(RuntimeError):
+    """Raised when a job is submitted while too many jobs are pending"""
+
+
+class Job:
+    """Background job, its status, progress and result.
+
+    A running job cannot be interrupted, its function reports its progress with
+    report which raises JobCancelled once the job has been cancelled.
+    """
+
+    def __init__(self, name: str = None) -> None:
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.status = JobStatus.QUEUED
+        self.progress = 0.0
+        self.message = "Waiting for a free worker"
+        self.result = None
+        self.error = None
+        self.created_at = time()
+        self.started_at = None
+        self.finished_at = None
+        self._cancel_event = threading.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    @property
+    def cancel_requested(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def check_cancelled(self):
+        """Raise JobCancelled when the job has been cancelled"""
+        if self._cancel_event.is_set():
+            raise JobCancelled(self.id)
+
+    def report(self, progress: float, message: str = None):
+        """Report the progress of the job, a checkpoint of its cancellation
+
+        Args:
+            progress (float): share of the job done, between 0 and 1
+            message (str, optional): description of the current step
+        """
+        self.check_cancelled()
+        self.progress = min(max(progress, 0.0), 1.0)
+        if message is not None:
+            self.message = message
+
+    def to_dict(self) -> dict:
+        """Status of the job, without its result"""
+        return {
+            "id": self.id,
+            "name": self.name,
+            "status": self.status.value,
+            "progress": self.progress,
+            "message": self.message,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobQueue:
+    """Process-wide queue of background jobs run by a bounded pool of worker threads.
+
+    At most max_workers jobs run at once and at most max_pending jobs are queued or
+    running, the finished jobs are kept ttl_seconds for their results to be
+    retrieved and evicted on the next submission after that.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = JOB_MAX_WORKERS,
+        max_pending: int = JOB_MAX_PENDING,
+        ttl_seconds: float = JOB_TTL_SECONDS,
+    ) -> None:
+        self.max_workers = max(1, max_workers)
+        self.max_pending = max(self.max_workers, max_pending)
+        self.ttl_seconds = ttl_seconds
+        self._jobs: OrderedDict[str, Job] = OrderedDict()
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="insights-job"
+        )
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self) -> int:
+        """Number of jobs queued or running"""
+        return sum(not job.finished for job in self._jobs.values())
+
+    def submit(
+        self,
+        function: Callable,
+        *args,
+        name: str = None,
+        discard: Callable = None,
+        **kwargs,
+    ) -> Job:
+        """Queue a job calling the function with the job then the arguments
+
+        Args:
+            function (Callable): function of the job, called as
+                function(job, *args, **kwargs), its return value is the result
+            name (str, optional): name of the job shown with its status
+            discard (Callable, optional): called with the result of a job cancelled
+                after its function returned, to release what the result refers to
+
+        Raises:
+            JobQueueFull: when max_pending jobs are already queued or running
+
+        Returns:
+            Job: the queued job
+        """
+        with self._lock:
+            self.evict_expired()
+            if self.pending >= self.max_pending:
+                raise JobQueueFull(
+                    f"{self.pending} jobs are already queued or running, "
+                    "try again once some of them are finished"
+                )
+            job = Job(name=name)
+            self._jobs[job.id] = job
+        self._executor.submit(self.run, job, function, args, kwargs, discard)
+        return job
+
+    def run(
+        self,
+        job: Job,
+        function: Callable,
+        args: tuple,
+        kwargs: dict,
+        discard: Callable = None,
+    ):
+        """Run a job on a worker thread, recording its status and result"""
+        with self._lock:
+            # cancelled while queued
+            if job.finished:
+                return
+            job.status = JobStatus.RUNNING
+            job.started_at = time()
+            job.message = "Running"
+
+        try:
+            result = function(job, *args, **kwargs)
+        except JobCancelled:
+            self.finish(job, JobStatus.CANCELLED, message="Cancelled")
+        except Exception as e:
+            traceback.print_exc()
+            self.finish(job, JobStatus.FAILED, message="Failed", error=str(e))
+        else:
+            # checked holding the lock, a job is either cancelled or succeeded
+            with self._lock:
+                cancelled = job.cancel_requested
+                if not cancelled:
+                    job.result = result
+                    job.progress = 1.0
+                    self.finish_locked(job, JobStatus.SUCCEEDED, message="Done")
+                else:
+                    self.finish_locked(job, JobStatus.CANCELLED, message="Cancelled")
+            if cancelled and discard is not None:
+                discard(result)
+
+    def finish(self, job: Job, status: JobStatus, message: str, error: str = None):
+        with self._lock:
+            self.finish_locked(job, status, message, error)
+
+    def finish_locked(
+        self, job: Job, status: JobStatus, message: str, error: str = None
+    ):
+        """Record the end of a job, call holding the lock"""
+        job.status = status
+        job.message = message
+        job.error = error
+        job.finished_at = time()
+
+    def get(self, job_id: str) -> Job | None:
+        """Get a job by id, None when unknown or evicted"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Job | None:
+        """Cancel a job, a queued job never runs and a running one stops at its next
+        checkpoint
+
+        Args:
+            job_id (str): id of the job
+
+        Returns:
+            Job | None: the job, None when unknown or evicted
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.finished:
+                return job
+            job._cancel_event.set()
+            if job.status == JobStatus.QUEUED:
+                job.status = JobStatus.CANCELLED
+                job.message = "Cancelled"
+                job.finished_at = time()
+            else:
+                job.message = "Cancelling"
+        return job
+
+    def evict_expired(self):
+        """Remove the jobs finished more than ttl_seconds ago, call holding the lock"""
+        expired_before = time() - self.ttl_seconds
+        for job_id in [
+            job.id
+            for job in self._jobs.values()
+            if job.finished and job.finished_at < expired_before
+        ]:
+            del self._jobs[job_id]
+
+
+insight_job_queue = JobQueue()
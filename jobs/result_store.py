@@ -0,0 +1,176 @@
+"""Server-side store of the insight results, referenced by id from the session"""
+
+import json
+import os
+import re
+import uuid
+from time import time
+
+import polars as pl
+
+from data_source import utils as data_source_utils
+from data_source.spill_store import SpillStore
+
+RESULT_STORE_MAX_MEMORY_BYTES = int(
+    os.environ.get("INSIGHTS_RESULT_STORE_MAX_MEMORY_BYTES", 512 * 1024 * 1024)
+)
+RESULT_STORE_DIR = os.environ.get(
+    "INSIGHTS_RESULT_STORE_DIR", os.path.join(data_source_utils.CACHE_DIR, "results")
+)
+RESULT_STORE_MAX_SIZE_BYTES = int(
+    os.environ.get("INSIGHTS_RESULT_STORE_MAX_SIZE_BYTES", 2 * 1024 * 1024 * 1024)
+)
+# seconds a result can be retrieved after it is stored
+RESULT_TTL_SECONDS = float(os.environ.get("INSIGHTS_RESULT_TTL_SECONDS", 24 * 3600))
+
+# result ids come from the urls, anything else never reaches the file system
+RESULT_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+
+
+class ResultStore(SpillStore):
+    """Process-wide store of result frames and their metadata keyed by result id.
+
+    The values are tuples of the result frame, its metadata and the time it was
+    stored, the metadata is spilled to a JSON file next to the Parquet file of the
+    frame. A result expires ttl_seconds after it is stored, wherever it is kept.
+    """
+
+    def __init__(
+        self,
+        max_memory_bytes: int = RESULT_STORE_MAX_MEMORY_BYTES,
+        spill_dir: str = RESULT_STORE_DIR,
+        max_spill_bytes: int = RESULT_STORE_MAX_SIZE_BYTES,
+        ttl_seconds: float = RESULT_TTL_SECONDS,
+    ) -> None:
+        super().__init__(max_memory_bytes, spill_dir, max_spill_bytes)
+        self.ttl_seconds = ttl_seconds
+
+    def get_metadata_file(self, result_id: str) -> str:
+        """Path of the JSON file the metadata of a spilled result is written to, its
+        modification time is the time the result was stored"""
+        return os.path.join(self.spill_dir, f"{result_id}.json")
+
+    def get_size(self, value: tuple[pl.DataFrame, dict, float]) -> int:
+        return value[0].estimated_size()
+
+    def put(self, result_df: pl.DataFrame, metadata: dict = None) -> str:
+        """Store a result and spill the least recently used ones over budget
+
+        Args:
+            result_df (pl.DataFrame): result frame
+            metadata (dict, optional): JSON serializable values shown with the result
+
+        Returns:
+            str: id of the result
+        """
+        result_id = uuid.uuid4().hex
+        self.add(result_id, (result_df, metadata or {}, time()))
+        self.evict_expired()
+        return result_id
+
+    def get(self, result_id: str) -> tuple[pl.DataFrame, dict] | None:
+        """Get a result and its metadata from memory, or from its spilled files
+
+        Args:
+            result_id (str): id of the result from put
+
+        Returns:
+            tuple[pl.DataFrame, dict] | None: the result frame and its metadata, None
+                when the result is unknown, expired or evicted
+        """
+        if not RESULT_ID_PATTERN.fullmatch(result_id):
+            return None
+        value = super().get(result_id)
+        if value is None:
+            return None
+        result_df, metadata, stored_at = value
+        if stored_at < time() - self.ttl_seconds:
+            self.delete(result_id)
+            return None
+        return result_df, metadata
+
+    def write_spill(self, result_id: str, value: tuple[pl.DataFrame, dict, float]):
+        """Write a result to its Parquet file and its metadata to its JSON file, the
+        metadata last as a result is read only once its metadata file exists"""
+        result_df, metadata, stored_at = value
+        data_source_utils.write_file_atomic(
+            self.get_spill_file(result_id), result_df.write_parquet
+        )
+
+        def write_metadata(file_path: str):
+            with open(file_path, "w") as file:
+                json.dump(metadata, file)
+            os.utime(file_path, (stored_at, stored_at))
+
+        data_source_utils.write_file_atomic(
+            self.get_metadata_file(result_id), write_metadata
+        )
+
+    def read_spill(self, result_id: str) -> tuple[pl.DataFrame, dict, float] | None:
+        """Read a result and its metadata from their files, None when the result is
+        not spilled, expired or evicted"""
+        try:
+            stored_at = os.stat(self.get_metadata_file(result_id)).st_mtime
+            if stored_at < time() - self.ttl_seconds:
+                self.remove_files(result_id)
+                return None
+            with open(self.get_metadata_file(result_id)) as file:
+                metadata = json.load(file)
+        except (FileNotFoundError, OSError, ValueError):
+            return None
+        result_df = super().read_spill(result_id)
+        if result_df is None:
+            return None
+        return result_df, metadata, stored_at
+
+    def remove_files(self, result_id: str):
+        """Remove the spilled files of a result, if any"""
+        for file_path in [
+            self.get_spill_file(result_id),
+            self.get_metadata_file(result_id),
+        ]:
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print("Exception as exc ", e)
+
+    def evict_expired(self):
+        """Remove the results stored more than ttl_seconds ago, from memory and from
+        the spill directory along with the metadata of evicted Parquet files"""
+        expired_before = time() - self.ttl_seconds
+        with self._lock:
+            for result_id in [
+                result_id
+                for result_id, (_, _, stored_at) in self._values.items()
+                if stored_at < expired_before
+            ]:
+                self.pop(result_id)
+
+        if not os.path.isdir(self.spill_dir):
+            return
+        for file_name in os.listdir(self.spill_dir):
+            if not file_name.endswith(".json"):
+                continue
+            result_id = file_name.removesuffix(".json")
+            try:
+                stored_at = os.stat(self.get_metadata_file(result_id)).st_mtime
+            except FileNotFoundError:
+                continue
+            if stored_at < expired_before or not os.path.isfile(
+                self.get_spill_file(result_id)
+            ):
+                self.remove_files(result_id)
+
+    def delete(self, result_id: str):
+        """Remove a result from memory and its spilled files"""
+        if not RESULT_ID_PATTERN.fullmatch(result_id):
+            return
+        with self._lock:
+            if result_id in self._values:
+                self.pop(result_id)
+        self.remove_files(result_id)
+
+
+insight_result_store = ResultStore()
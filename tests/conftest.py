@@ -0,0 +1,154 @@
+"""Synthetic datasets, metrics and insights shared by the tests"""
+
+from datetime import date
+from typing import List, Sequence
+
+import numpy as np
+import polars as pl
+import pytest
+
+from base.general import CombineMethod, Filter, FilterOperator
+from base.insights import MetricsInsight
+from base.metrics import DualColumnMetric, Metric, SingleColumnMetric
+
+
+@pytest.fixture(scope="session")
+def build_dataframe():
+    def build(
+        rows: int,
+        cardinalities: Sequence[int],
+        segments: bool = False,
+        months: int = 1,
+    ) -> pl.DataFrame:
+        """Rows of random string dimensions dim_0, dim_1... with the given number of
+        distinct values each, revenue and orders measures and a date in one of the
+        given number of months from January 2024, the north or south segment too
+        when segments is set"""
+        rng = np.random.default_rng(0)
+        columns = {
+            f"dim_{index}": rng.integers(0, cardinality, rows).astype(str)
+            for index, cardinality in enumerate(cardinalities)
+        }
+        if segments:
+            columns["segment"] = rng.choice(["north", "south"], rows)
+        columns["revenue"] = rng.gamma(2.0, 50.0, rows)
+        columns["orders"] = rng.integers(1, 5, rows)
+        columns["month"] = rng.integers(1, months + 1, rows)
+        columns["day"] = rng.integers(1, 29, rows)
+        return pl.DataFrame(columns).select(
+            pl.exclude("month", "day"),
+            date=pl.date(2024, pl.col("month"), pl.col("day")),
+        )
+
+    return build
+
+
+@pytest.fixture(scope="session")
+def segment_dataframe(build_dataframe) -> pl.DataFrame:
+    return build_dataframe(5_000, [4, 6, 10, 16], segments=True, months=3)
+
+
+@pytest.fixture(scope="session")
+def periodic_dataframe(build_dataframe) -> pl.DataFrame:
+    return build_dataframe(5_000, [3, 4, 5, 6, 7], months=6)
+
+
+@pytest.fixture(scope="session")
+def build_dates_dataframe():
+    def build(rows: int, first_date: date, days: int) -> pl.DataFrame:
+        """Rows of random dates from first_date over the given number of days"""
+        offsets = np.random.default_rng(0).integers(0, days, rows)
+        return pl.DataFrame({"date": offsets}).select(
+            (pl.lit(first_date) + pl.duration(days=pl.col("date"))).alias("date")
+        )
+
+    return build
+
+
+@pytest.fixture(scope="session")
+def build_subgroup_trend():
+    def build(subgroups: int, periods: int) -> pl.DataFrame:
+        """Monthly revenue trend of every subgroup from January 2021"""
+        rng = np.random.default_rng(0)
+        first_period = (2021 - 1970) * 12
+        return pl.DataFrame(
+            {
+                "sub_group": np.repeat(np.arange(subgroups, dtype=np.uint64), periods),
+                "PeriodIndex": np.tile(
+                    np.arange(first_period, first_period + periods, dtype=np.int32),
+                    subgroups,
+                ),
+                "revenue": rng.gamma(2.0, 50.0, subgroups * periods),
+            }
+        )
+
+    return build
+
+
+@pytest.fixture(scope="session")
+def revenue_metric() -> SingleColumnMetric:
+    return SingleColumnMetric(
+        name="revenue", column="revenue", date_column="date", aggregation_method="sum"
+    )
+
+
+@pytest.fixture(scope="session")
+def revenue_per_order_metric() -> DualColumnMetric:
+    return DualColumnMetric(
+        name="revenue_per_order",
+        combine_method=CombineMethod.RATIO,
+        numerator_metric=SingleColumnMetric(
+            name="total_revenue",
+            column="revenue",
+            date_column="date",
+            aggregation_method="sum",
+        ),
+        denominator_metric=SingleColumnMetric(
+            name="total_orders",
+            column="orders",
+            date_column="date",
+            aggregation_method="sum",
+        ),
+    )
+
+
+@pytest.fixture(params=["revenue_metric", "revenue_per_order_metric"])
+def metric(request) -> Metric:
+    """Both the single column metric and the ratio"""
+    return request.getfixturevalue(request.param)
+
+
+@pytest.fixture(scope="session")
+def build_insight(revenue_metric):
+    def build(
+        dataframe: pl.DataFrame,
+        max_rca_depth: int,
+        metric: Metric = None,
+        segments: bool = False,
+        group_by_columns: List[str] = None,
+        **kwargs,
+    ) -> MetricsInsight:
+        """Insight of the metric, the revenue by default, over the dimensions of the
+        dataframe, the north segment compared with the south one when segments is
+        set"""
+        metric = metric or revenue_metric
+        if segments:
+            kwargs["baseline_segment"] = [
+                Filter(column="segment", operator=FilterOperator.EQ, values=["north"])
+            ]
+            kwargs["comparison_segment"] = [
+                Filter(column="segment", operator=FilterOperator.EQ, values=["south"])
+            ]
+        if group_by_columns is None:
+            group_by_columns = [
+                column for column in dataframe.columns if column.startswith("dim_")
+            ]
+        return MetricsInsight(
+            name=metric.name,
+            metrics=metric,
+            group_by_columns=group_by_columns,
+            max_rca_depth=max_rca_depth,
+            **kwargs,
+        )
+
+    return build
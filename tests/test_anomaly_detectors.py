@@ -0,0 +1,223 @@
+from datetime import date
+
+import numpy as np
+import polars as pl
+import pytest
+from polars.testing import assert_frame_equal, assert_series_equal
+
+from calculations.anomaly import repository as anomaly_repository
+from calculations.anomaly import services as anomaly_services
+from calculations.anomaly.utils import (
+    build_ewm_mean_agg_expr,
+    build_ewm_stddev_agg_expr,
+)
+from calculations.utils import PERIOD_WINDOW_SIZE, build_period_index_expr
+
+# revenue of the days of the week from thursday, the weekday of period index 0
+WEEKDAY_FACTORS = np.array([1.0, 1.1, 0.4, 0.3, 1.2, 1.0, 1.0])
+# daily period index of January 1st 2023
+FIRST_DAY = 19358
+
+
+@pytest.fixture
+def daily_trend() -> pl.DataFrame:
+    """Ten weeks of daily revenue with a weekly seasonality"""
+    periods = np.arange(FIRST_DAY, FIRST_DAY + 70, dtype=np.int32)
+    revenue = np.random.default_rng(0).normal(100.0, 1.0, 70)
+    return pl.DataFrame(
+        {"PeriodIndex": periods, "revenue": revenue * WEEKDAY_FACTORS[periods % 7]}
+    )
+
+
+def add_seasonal_baseline(trend_df: pl.DataFrame) -> pl.DataFrame:
+    return anomaly_repository.add_polars_seasonal_baseline(
+        trend_df, "revenue", "daily", "seasonal_baseline", "seasonal_stddev"
+    )
+
+
+def test_seasonal_flags_a_spike(daily_trend):
+    spike = 60
+    trend_df = daily_trend.with_columns(
+        pl.when(pl.int_range(pl.len()) == spike)
+        .then(pl.col("revenue") * 3)
+        .otherwise(pl.col("revenue"))
+    )
+
+    # the rolling window of 6 days holds the spike, bounding its z-score by
+    # 5 / sqrt(6) as for the zscore detector
+    anomalies_df = anomaly_services.calculate_anomalies(
+        trend_df, "revenue", "daily", 2.0, "in_memory", detector="seasonal"
+    )
+
+    flagged = anomalies_df.get_column("is_anomalous")
+    assert flagged[spike]
+    # the weekly highs and lows are not flagged once the profile has a season
+    assert not flagged[14:spike].any()
+
+
+def test_seasonal_baseline_does_not_look_ahead(daily_trend):
+    baseline_df = add_seasonal_baseline(daily_trend.head(69))
+    appended_df = add_seasonal_baseline(daily_trend)
+
+    assert_series_equal(
+        baseline_df.get_column("seasonal_baseline"),
+        appended_df.get_column("seasonal_baseline").head(69),
+    )
+
+
+def run_detectors(
+    trend_df: pl.DataFrame, threshold: float, sub_group: bool
+) -> pl.DataFrame:
+    for calculate in [
+        anomaly_services.calculate_anomaly,
+        anomaly_services.calculate_row_diff_anomaly,
+        anomaly_services.calculate_yoy_diff_anomaly,
+    ]:
+        trend_df = calculate(
+            trend_df, "revenue", "monthly", threshold, "in_memory", sub_group
+        )
+    return trend_df
+
+
+@pytest.mark.parametrize("sub_group", [False, True])
+@pytest.mark.parametrize("gaps", [False, True])
+def test_fused_pipeline_matches_the_detectors(build_subgroup_trend, sub_group, gaps):
+    trend_df = build_subgroup_trend(20 if sub_group else 1, 40)
+    if gaps:
+        trend_df = trend_df.filter(
+            pl.Series(np.random.default_rng(1).random(trend_df.height) > 0.2)
+        )
+    if not sub_group:
+        trend_df = trend_df.drop("sub_group")
+
+    # the fused rolling windows are summed exactly instead of incrementally
+    assert_frame_equal(
+        anomaly_services.calculate_anomalies(
+            trend_df, "revenue", "monthly", 1.0, "in_memory", sub_group
+        ),
+        run_detectors(trend_df, 1.0, sub_group),
+        rtol=1e-6,
+    )
+
+
+def add_yoy_values(trend_df: pl.DataFrame, yoy_method: str) -> pl.DataFrame:
+    return anomaly_repository.add_polars_yoy_values(
+        trend_df, "revenue", "monthly", True, yoy_method
+    )
+
+
+@pytest.mark.parametrize("yoy_method", ["shift", "search"])
+def test_yoy_methods_match_the_join_on_a_dense_grid(build_subgroup_trend, yoy_method):
+    trend_df = build_subgroup_trend(20, 40)
+
+    assert_frame_equal(
+        add_yoy_values(trend_df, yoy_method), add_yoy_values(trend_df, "join")
+    )
+
+
+def test_yoy_methods_across_gaps(build_subgroup_trend):
+    trend_df = build_subgroup_trend(20, 40).filter(
+        pl.Series(np.random.default_rng(1).random(800) > 0.2)
+    )
+    joined = add_yoy_values(trend_df, "join").get_column("revenue_YoY")
+    shifted = add_yoy_values(trend_df, "shift").get_column("revenue_YoY")
+
+    assert_series_equal(
+        add_yoy_values(trend_df, "search").get_column("revenue_YoY"), joined
+    )
+    # the shift only finds the periods with no gap in the year before them
+    assert shifted.is_null().sum() > joined.is_null().sum()
+    assert_series_equal(
+        shifted.filter(shifted.is_not_null()), joined.filter(shifted.is_not_null())
+    )
+
+
+@pytest.mark.parametrize("yoy_method", ["shift", "search"])
+def test_yoy_methods_match_the_join_across_a_53_week_year(yoy_method):
+    dates_df = pl.DataFrame(
+        {"date": pl.date_range(date(2019, 1, 7), date(2022, 12, 26), "1w", eager=True)}
+    )
+    trend_df = dates_df.select(
+        PeriodIndex=build_period_index_expr(pl.col("date"), "weekly"),
+        revenue=pl.int_range(pl.len()).cast(pl.Float64),
+    )
+
+    assert_frame_equal(
+        anomaly_repository.add_polars_yoy_values(
+            trend_df, "revenue", "weekly", yoy_method=yoy_method
+        ),
+        anomaly_repository.add_polars_yoy_values(trend_df, "revenue", "weekly"),
+    )
+
+
+def numpy_rolling_median_mad(values: np.ndarray, window_size: int):
+    medians = np.full(len(values), np.nan)
+    mads = np.full(len(values), np.nan)
+    for end in range(window_size, len(values) + 1):
+        window = values[end - window_size : end]
+        medians[end - 1] = np.median(window)
+        mads[end - 1] = np.median(np.abs(window - medians[end - 1])) * 1.4826
+    return medians, mads
+
+
+def numpy_ewm_mean_stddev(values: np.ndarray, window_size: int):
+    """Weighted mean and unbiased standard deviation of the previous periods"""
+    alpha = 2 / (window_size + 1)
+    means = np.full(len(values), np.nan)
+    stddevs = np.full(len(values), np.nan)
+    for end in range(window_size, len(values)):
+        window = values[:end]
+        weights = (1 - alpha) ** np.arange(end)[::-1]
+        mean = np.sum(weights * window) / weights.sum()
+        variance = np.sum(weights * (window - mean) ** 2) / weights.sum()
+        bias = weights.sum() ** 2 / (weights.sum() ** 2 - np.sum(weights**2))
+        means[end] = mean
+        stddevs[end] = np.sqrt(variance * bias)
+    return means, stddevs
+
+
+def assert_matches_numpy(trend_df, column_name, expected):
+    assert_series_equal(
+        trend_df.get_column(column_name).fill_null(np.nan),
+        pl.Series(column_name, np.concatenate(expected)),
+        check_exact=False,
+        rtol=1e-9,
+    )
+
+
+# the windows of 3 weeks and 6 months, odd and even
+@pytest.mark.parametrize("metric_trend_type", ["weekly", "monthly"])
+def test_rolling_median_mad_match_numpy(build_subgroup_trend, metric_trend_type):
+    trend_df = build_subgroup_trend(5, 30)
+    window_size = PERIOD_WINDOW_SIZE[metric_trend_type]
+
+    mad_df = anomaly_repository.add_polars_rolling_median_mad(
+        trend_df, "revenue", metric_trend_type, "median", "mad", sub_group=True
+    )
+
+    references = [
+        numpy_rolling_median_mad(group_df.get_column("revenue").to_numpy(), window_size)
+        for _, group_df in trend_df.group_by("sub_group", maintain_order=True)
+    ]
+    assert_matches_numpy(mad_df, "median", [median for median, _ in references])
+    assert_matches_numpy(mad_df, "mad", [mad for _, mad in references])
+
+
+@pytest.mark.parametrize("metric_trend_type", ["weekly", "monthly"])
+def test_ewm_mean_stddev_match_numpy(build_subgroup_trend, metric_trend_type):
+    trend_df = build_subgroup_trend(5, 30)
+    window_size = PERIOD_WINDOW_SIZE[metric_trend_type]
+
+    ewm_df = trend_df.with_columns(
+        build_ewm_mean_agg_expr("revenue", metric_trend_type, True).alias("ewm_mean"),
+        build_ewm_stddev_agg_expr("revenue", metric_trend_type, True).alias(
+            "ewm_stddev"
+        ),
+    )
+
+    references = [
+        numpy_ewm_mean_stddev(group_df.get_column("revenue").to_numpy(), window_size)
+        for _, group_df in trend_df.group_by("sub_group", maintain_order=True)
+    ]
+    assert_matches_numpy(ewm_df, "ewm_mean", [mean for mean, _ in references])
+    assert_matches_numpy(ewm_df, "ewm_stddev", [stddev for _, stddev in references])
@@ -0,0 +1,81 @@
+import numpy as np
+import polars as pl
+import pytest
+from polars.testing import assert_frame_equal
+
+from calculations.anomaly import incremental as anomaly_incremental
+from calculations.anomaly import services as anomaly_services
+from calculations.anomaly.incremental import AnomalyStateStore
+
+PERIODS = 40
+
+
+@pytest.fixture
+def state_store(tmp_path) -> AnomalyStateStore:
+    return AnomalyStateStore(str(tmp_path))
+
+
+def calculate_incremental(
+    state_store: AnomalyStateStore, trend_df: pl.DataFrame, sub_group: bool
+) -> pl.DataFrame:
+    key = state_store.get_key("data", "revenue", {}, "monthly", sub_group)
+    anomalies_df, state_df = anomaly_services.calculate_incremental_anomalies(
+        trend_df,
+        "revenue",
+        "monthly",
+        1.0,
+        "in_memory",
+        state_store.load(
+            key,
+            anomaly_incremental.get_required_state_periods(trend_df, "monthly"),
+        ),
+        sub_group,
+    )
+    state_store.save(key, state_df, "monthly")
+    return anomalies_df
+
+
+@pytest.mark.parametrize("sub_group", [False, True])
+@pytest.mark.parametrize("appended_periods", [1, 10])
+def test_incremental_matches_a_full_recompute(
+    build_subgroup_trend, state_store, sub_group, appended_periods
+):
+    trend_df = build_subgroup_trend(20 if sub_group else 1, PERIODS)
+    if not sub_group:
+        trend_df = trend_df.drop("sub_group")
+    first_period = trend_df.get_column("PeriodIndex").min()
+    is_previous = pl.col("PeriodIndex") < first_period + PERIODS - appended_periods
+
+    calculate_incremental(state_store, trend_df.filter(is_previous), sub_group)
+    anomalies_df = calculate_incremental(
+        state_store, trend_df.filter(~is_previous), sub_group
+    )
+
+    full_df = anomaly_services.calculate_anomalies(
+        trend_df, "revenue", "monthly", 1.0, "in_memory", sub_group, engine="matrix"
+    )
+    assert_frame_equal(anomalies_df, full_df.filter(~is_previous))
+
+
+@pytest.mark.parametrize("gaps", [False, True])
+def test_incremental_period_by_period(build_subgroup_trend, state_store, gaps):
+    trend_df = build_subgroup_trend(20, PERIODS)
+    if gaps:
+        trend_df = trend_df.filter(
+            pl.Series(np.random.default_rng(1).random(trend_df.height) > 0.2)
+        )
+
+    anomalies_df = pl.concat(
+        calculate_incremental(state_store, period_df, True)
+        for _, period_df in trend_df.sort("PeriodIndex").group_by(
+            "PeriodIndex", maintain_order=True
+        )
+    )
+
+    full_df = anomaly_services.calculate_anomalies(
+        trend_df, "revenue", "monthly", 1.0, "in_memory", True, engine="matrix"
+    )
+    assert_frame_equal(
+        anomalies_df.sort("sub_group", "PeriodIndex"),
+        full_df.sort("sub_group", "PeriodIndex"),
+    )
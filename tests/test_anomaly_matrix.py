@@ -0,0 +1,31 @@
+import pytest
+from polars.testing import assert_frame_equal
+
+from calculations.anomaly import matrix as anomaly_matrix
+from calculations.anomaly import repository as anomaly_repository
+
+
+@pytest.mark.parametrize("sub_group", [False, True])
+def test_matrix_matches_polars_on_a_dense_trend(build_subgroup_trend, sub_group):
+    trend_df = build_subgroup_trend(20 if sub_group else 1, 36)
+    if not sub_group:
+        trend_df = trend_df.drop("sub_group")
+
+    matrix_df = anomaly_matrix.calculate_matrix_anomalies(
+        trend_df, "revenue", "monthly", 1.0, sub_group
+    )
+    polars_df = anomaly_repository.calculate_polars_anomalies(
+        trend_df, "revenue", "monthly", 1.0, sub_group
+    )
+
+    assert_frame_equal(matrix_df, polars_df, rtol=1e-6, atol=1e-8)
+
+
+def test_matrix_over_max_cells(build_subgroup_trend, monkeypatch):
+    monkeypatch.setattr(anomaly_matrix, "ANOMALY_MATRIX_MAX_CELLS", 10)
+    trend_df = build_subgroup_trend(20, 36)
+
+    with pytest.raises(ValueError, match="polars engine"):
+        anomaly_matrix.calculate_matrix_anomalies(
+            trend_df, "revenue", "monthly", 1.0, True
+        )
@@ -0,0 +1,87 @@
+from datetime import date
+
+import polars as pl
+import pytest
+
+from calculations import utils as calculation_utils
+
+PERIODS = ["daily", "weekly", "monthly", "quarterly"]
+
+
+@pytest.mark.parametrize(
+    "label, period, first_date",
+    [
+        ("2025WK01", "weekly", date(2024, 12, 30)),
+        ("2024WK01", "weekly", date(2024, 1, 1)),
+        ("2020WK53", "weekly", date(2020, 12, 28)),
+        # legacy calendar year label of 2021-01-01, in week 53 of ISO year 2020
+        ("2021WK53", "weekly", date(2020, 12, 28)),
+        ("2024M02(February)", "monthly", date(2024, 2, 1)),
+        ("2024Q3", "quarterly", date(2024, 7, 1)),
+        ("20240229", "daily", date(2024, 2, 29)),
+    ],
+)
+def test_date_from_date_label(label, period, first_date):
+    parsed_df = calculation_utils.get_date_from_date_label(
+        pl.DataFrame({"DateLabel": [label]}), period
+    )
+
+    assert parsed_df.get_column("parsed_date").to_list() == [first_date]
+
+
+@pytest.mark.parametrize("period", PERIODS)
+def test_rendered_date_label_round_trip(period):
+    dates_df = pl.DataFrame(
+        {"date": pl.date_range(date(2019, 12, 1), date(2027, 1, 31), eager=True)}
+    )
+    labels_df = calculation_utils.render_date_label(
+        calculation_utils.get_time_period_index("date", dates_df, period), period
+    )
+
+    parsed_df = calculation_utils.get_date_from_date_label(
+        labels_df.drop("PeriodIndex"), period
+    )
+
+    assert (
+        parsed_df.get_column("parsed_date").to_list()
+        == labels_df.select(
+            calculation_utils.build_period_start_date_expr(
+                pl.col("PeriodIndex"), period
+            )
+        )
+        .to_series()
+        .to_list()
+    )
+
+
+def label_date(day: date, period: str) -> str:
+    if period == "weekly":
+        return f"{day.isocalendar().year:04d}WK{day.isocalendar().week:02d}"
+    elif period == "monthly":
+        return day.strftime("%YM%m(%B)")
+    elif period == "quarterly":
+        return f"{day.year:04d}Q{(day.month - 1) // 3 + 1}"
+    return day.strftime("%Y%m%d")
+
+
+@pytest.mark.parametrize("period", PERIODS)
+def test_date_label(build_dates_dataframe, period):
+    dates_df = build_dates_dataframe(5_000, date(2015, 1, 1), 365 * 10)
+
+    labels_df = calculation_utils.get_time_period_date_label("date", dates_df, period)
+
+    assert labels_df.get_column("DateLabel").to_list() == [
+        label_date(day, period) for day in dates_df.get_column("date")
+    ]
+
+
+def test_week_across_new_year_labels():
+    dates_df = pl.DataFrame({"date": [date(2024, 12, 30), date(2025, 1, 1)]})
+
+    labels_df = calculation_utils.get_time_period_date_label("date", dates_df, "weekly")
+    rendered_df = calculation_utils.render_date_label(
+        calculation_utils.get_time_period_index("date", dates_df, "weekly"), "weekly"
+    )
+
+    assert labels_df.get_column("DateLabel").to_list() == ["2025WK01", "2025WK01"]
+    assert rendered_df.get_column("DateLabel").to_list() == ["2025WK01", "2025WK01"]
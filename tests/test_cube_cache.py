@@ -0,0 +1,23 @@
+import os
+
+import polars as pl
+from polars.testing import assert_frame_equal
+
+from calculations.subgroup_insights.cube_cache import SubgroupCubeCache
+
+
+def build_partial(rows: int) -> pl.DataFrame:
+    return pl.DataFrame({"sub_group": [str(row) for row in range(rows)]})
+
+
+def test_cube_cache_spills_over_budget(tmp_path):
+    partial_df = build_partial(1000)
+    cache = SubgroupCubeCache(
+        max_memory_bytes=partial_df.estimated_size(), spill_dir=str(tmp_path)
+    )
+    cache.add("first", partial_df)
+    cache.add("second", partial_df)
+
+    assert os.listdir(tmp_path) == ["first.parquet"]
+    assert_frame_equal(cache.get("first"), partial_df)
+    assert os.path.isfile(cache.get_spill_file("second"))
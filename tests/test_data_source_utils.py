@@ -0,0 +1,68 @@
+from datetime import date
+
+import polars as pl
+import pytest
+
+from data_source import utils as data_source_utils
+
+
+@pytest.mark.parametrize(
+    "values, date_format, first_date",
+    [
+        (["1/2/23", "12/31/23"], "%m/%d/%y", date(2023, 1, 2)),
+        (["02-01-23", "31-12-23"], "%d-%m-%y", date(2023, 1, 2)),
+        (["2023-01-02", "2023-12-31"], "%Y-%m-%d", date(2023, 1, 2)),
+        (["1/2/2023", "12/31/2023"], "%m/%d/%Y", date(2023, 1, 2)),
+        (["31/12/2023", "1/2/2023"], "%d/%m/%Y", date(2023, 12, 31)),
+    ],
+)
+def test_detect_date_format(values, date_format, first_date):
+    detected = data_source_utils.detect_date_format(pl.Series(values))
+
+    assert detected == date_format
+    assert pl.Series(values).str.to_date(detected)[0] == first_date
+
+
+def test_detect_date_format_without_dates():
+    assert data_source_utils.detect_date_format(pl.Series(["", None])) is None
+    assert data_source_utils.detect_date_format(pl.Series(["not a date"])) is None
+
+
+def test_two_digit_year_csv(tmp_path):
+    path = tmp_path / "two_digit_years.csv"
+    path.write_text("date,revenue\n1/2/23,10\n12/31/23,20\n")
+
+    schema = data_source_utils.inspect_csv_schema(str(path), date_column="date")
+    df = data_source_utils.load_df_from_csv(
+        str(path),
+        date_column="date",
+        dtypes=schema["dtypes"],
+        date_format=schema["date_format"],
+    )
+
+    assert schema["date_format"] == "%m/%d/%y"
+    assert df.get_column("date").to_list() == [date(2023, 1, 2), date(2023, 12, 31)]
+
+
+def test_cached_copy_keyed_by_date_format(tmp_path):
+    path = tmp_path / "dates.csv"
+    path.write_text("date,revenue\n02/01/2023,10\n12/01/2023,20\n")
+    cache_dir = str(tmp_path / "cache")
+
+    month_first_df = data_source_utils.load_df_from_cache(
+        str(path),
+        date_column="date",
+        cache_dir=cache_dir,
+        dtypes={"date": "String"},
+        date_format="%m/%d/%Y",
+    )
+    day_first_df = data_source_utils.load_df_from_cache(
+        str(path),
+        date_column="date",
+        cache_dir=cache_dir,
+        dtypes={"date": "String"},
+        date_format="%d/%m/%Y",
+    )
+
+    assert month_first_df.get_column("date")[0] == date(2023, 2, 1)
+    assert day_first_df.get_column("date")[0] == date(2023, 1, 2)
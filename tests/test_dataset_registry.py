@@ -0,0 +1,39 @@
+from data_source.registry import DatasetRegistry
+
+
+def test_schema_inspected_once_per_version(tmp_path):
+    path = tmp_path / "dates.csv"
+    path.write_text("date,revenue\n2023-01-02,10\n")
+    registry = DatasetRegistry()
+
+    schema = registry.get_schema(str(path), date_column="date")
+    assert registry.get_schema(str(path), date_column="date") is schema
+
+    path.write_text("date,revenue,orders\n2023-01-02,10,1\n")
+    assert registry.get_schema(str(path), date_column="date")["columns"] == [
+        "date",
+        "revenue",
+        "orders",
+    ]
+
+
+def test_dataset_keyed_by_dtypes(tmp_path):
+    path = tmp_path / "dates.csv"
+    path.write_text("date,revenue\n2023-01-02,10\n")
+    registry = DatasetRegistry()
+
+    float_df = registry.get(
+        str(path),
+        date_column="date",
+        dtypes={"revenue": "Float64"},
+        cache_dir=str(tmp_path / "cache"),
+    )
+    int_df = registry.get(
+        str(path),
+        date_column="date",
+        dtypes={"revenue": "Int64"},
+        cache_dir=str(tmp_path / "cache"),
+    )
+
+    assert str(float_df.schema["revenue"]) == "Float64"
+    assert str(int_df.schema["revenue"]) == "Int64"
@@ -0,0 +1,152 @@
+import threading
+import time
+
+import pytest
+
+from base.jobs import JobStatus
+from jobs.job_queue import JobQueue, JobQueueFull
+
+# seconds a test waits for a worker before failing
+WAIT_SECONDS = 10
+
+
+def wait_finished(job):
+    for _ in range(WAIT_SECONDS * 100):
+        if job.finished:
+            return
+        time.sleep(0.01)
+    raise AssertionError(f"job {job.id} is still {job.status}")
+
+
+def blocking_job(started: threading.Event, release: threading.Event):
+    """Function of a job which reports its progress until it is released"""
+
+    def run(job, result):
+        job.report(0.5, "Started")
+        started.set()
+        while not release.wait(0.01):
+            job.report(0.5)
+        return result
+
+    return run
+
+
+@pytest.fixture
+def job_queue():
+    job_queue = JobQueue(max_workers=1, max_pending=2)
+    yield job_queue
+    job_queue._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def test_job_succeeds_with_its_result(job_queue):
+    started, release = threading.Event(), threading.Event()
+    job = job_queue.submit(blocking_job(started, release), "result", name="insight")
+
+    assert started.wait(WAIT_SECONDS)
+    assert job_queue.get(job.id) is job
+    assert job.to_dict()["status"] == JobStatus.RUNNING
+    assert job.progress == 0.5
+    release.set()
+    wait_finished(job)
+
+    assert job.status == JobStatus.SUCCEEDED
+    assert job.result == "result"
+    assert job.progress == 1.0
+    assert job.to_dict()["name"] == "insight"
+
+
+def test_job_fails_with_its_error(job_queue):
+    def fail(job):
+        raise ValueError("no rows")
+
+    job = job_queue.submit(fail)
+    wait_finished(job)
+
+    assert job.status == JobStatus.FAILED
+    assert job.error == "no rows"
+    assert job.result is None
+
+
+def test_cancelled_running_job_stops_at_its_checkpoint(job_queue):
+    started, release = threading.Event(), threading.Event()
+    job = job_queue.submit(blocking_job(started, release), "result")
+
+    assert started.wait(WAIT_SECONDS)
+    job_queue.cancel(job.id)
+    wait_finished(job)
+
+    assert job.status == JobStatus.CANCELLED
+    assert job.result is None
+    release.set()
+
+
+def test_cancelled_queued_job_never_runs(job_queue):
+    started, release = threading.Event(), threading.Event()
+    running_job = job_queue.submit(blocking_job(started, release), "result")
+    assert started.wait(WAIT_SECONDS)
+    calls = []
+    queued_job = job_queue.submit(lambda job: calls.append(job))
+
+    assert queued_job.status == JobStatus.QUEUED
+    job_queue.cancel(queued_job.id)
+    assert queued_job.status == JobStatus.CANCELLED
+    release.set()
+    wait_finished(running_job)
+    job_queue._executor.shutdown(wait=True)
+
+    assert queued_job.status == JobStatus.CANCELLED
+    assert calls == []
+
+
+def test_job_cancelled_after_its_function_discards_its_result(job_queue):
+    discarded = []
+
+    def run(job):
+        # cancelled once the result is built, past the last checkpoint
+        job_queue.cancel(job.id)
+        return "result"
+
+    job = job_queue.submit(run, discard=discarded.append)
+    wait_finished(job)
+
+    assert job.status == JobStatus.CANCELLED
+    assert job.result is None
+    assert discarded == ["result"]
+
+
+def test_finished_job_cannot_be_cancelled(job_queue):
+    job = job_queue.submit(lambda job: "result")
+    wait_finished(job)
+
+    assert job_queue.cancel(job.id).status == JobStatus.SUCCEEDED
+    assert job.result == "result"
+
+
+def test_unknown_job(job_queue):
+    assert job_queue.get("unknown") is None
+    assert job_queue.cancel("unknown") is None
+
+
+def test_full_queue_rejects_jobs(job_queue):
+    started, release = threading.Event(), threading.Event()
+    jobs = [
+        job_queue.submit(blocking_job(started, release), index) for index in range(2)
+    ]
+
+    with pytest.raises(JobQueueFull):
+        job_queue.submit(lambda job: None)
+    release.set()
+    for job in jobs:
+        wait_finished(job)
+    # the finished jobs free their places
+    wait_finished(job_queue.submit(lambda job: None))
+
+
+def test_expired_jobs_are_evicted():
+    job_queue = JobQueue(max_workers=1, ttl_seconds=-1)
+    job = job_queue.submit(lambda job: "result")
+    wait_finished(job)
+    job_queue.submit(lambda job: None)
+
+    assert job_queue.get(job.id) is None
+    job_queue._executor.shutdown(wait=True)
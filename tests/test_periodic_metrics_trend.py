@@ -0,0 +1,104 @@
+import polars as pl
+import pytest
+from polars.testing import assert_frame_equal
+
+from base.general import CombineMethod, Filter, FilterOperator
+from base.metrics import DualColumnMetric, SingleColumnMetric
+from calculations.trend.periodic_metrics_trend import PeriodicMetricsTrend
+
+METRICS_TRENDS = ["daily", "weekly", "monthly", "quarterly"]
+
+
+def build_single_metric(aggregation_method: str, column: str = "revenue"):
+    return SingleColumnMetric(
+        name=f"{column}_{aggregation_method}",
+        column=column,
+        date_column="date",
+        aggregation_method=aggregation_method,
+    )
+
+
+def build_ratio_metric(denominator_metric: SingleColumnMetric):
+    return DualColumnMetric(
+        name="revenue_ratio",
+        combine_method=CombineMethod.RATIO,
+        numerator_metric=build_single_metric("sum"),
+        denominator_metric=denominator_metric,
+    )
+
+
+@pytest.fixture(scope="module")
+def yearly_dataframe(build_dataframe) -> pl.DataFrame:
+    """A year of rows, dim_1 standing for the customers"""
+    return build_dataframe(5_000, [3, 200], months=12)
+
+
+@pytest.mark.parametrize(
+    "metric",
+    [
+        build_single_metric("sum"),
+        build_single_metric("average"),
+        build_single_metric("count_distinct", "dim_1"),
+        build_ratio_metric(build_single_metric("sum", "orders")),
+        build_ratio_metric(build_single_metric("count_distinct", "dim_1")),
+        build_ratio_metric(
+            SingleColumnMetric(
+                name="north_customers",
+                column="dim_1",
+                date_column="date",
+                aggregation_method="count_distinct",
+                filters=[
+                    Filter(column="dim_0", operator=FilterOperator.EQ, values=["1"])
+                ],
+            )
+        ),
+    ],
+    ids=lambda metric: metric.name,
+)
+@pytest.mark.parametrize(
+    "metrics_trends", [METRICS_TRENDS, ["weekly"], ["monthly", "quarterly"]]
+)
+def test_multi_period_matches_per_period(yearly_dataframe, metric, metrics_trends):
+    metrics_trend = PeriodicMetricsTrend()
+
+    trends = metrics_trend.calculate_multi_period(
+        yearly_dataframe, metric, metrics_trends
+    )
+
+    assert list(trends) == metrics_trends
+    for period, trend_df in trends.items():
+        expected_df, _ = metrics_trend.calculate(yearly_dataframe, metric, period)
+        # the partial sums are summed again, in another order
+        assert_frame_equal(trend_df, expected_df, check_exact=False, rtol=1e-9)
+
+
+@pytest.mark.parametrize("period", [None, "weekly", "monthly"])
+def test_batch_matches_per_metric(yearly_dataframe, period):
+    metrics = [
+        build_single_metric("sum"),
+        build_single_metric("average"),
+        build_single_metric("count_distinct", "dim_1"),
+        build_ratio_metric(build_single_metric("sum", "orders")),
+        SingleColumnMetric(
+            name="north_revenue",
+            column="revenue",
+            date_column="date",
+            aggregation_method="sum",
+            filters=[Filter(column="dim_0", operator=FilterOperator.EQ, values=["1"])],
+        ),
+    ]
+    metrics_trend = PeriodicMetricsTrend()
+
+    trends = metrics_trend.calculate_batch(yearly_dataframe, metrics, period)
+
+    assert list(trends) == [metric.name for metric in metrics]
+    for metric in metrics:
+        expected_df, _ = metrics_trend.calculate(yearly_dataframe, metric, period)
+        assert_frame_equal(trends[metric.name], expected_df)
+
+
+def test_batch_needs_unique_names(yearly_dataframe):
+    with pytest.raises(ValueError):
+        PeriodicMetricsTrend().calculate_batch(
+            yearly_dataframe, [build_single_metric("sum")] * 2, "monthly"
+        )
@@ -0,0 +1,93 @@
+import random
+
+import polars as pl
+import pytest
+from polars.testing import assert_frame_equal
+
+from base.insights import DimensionValuePair
+from calculations.subgroup_insights import services as subgroup_trend_services
+from calculations.subgroup_insights.periodic_subgroup_insights_trend import (
+    PeriodicSubgroupMetricsTrend,
+)
+from calculations.trend.periodic_metrics_trend import PeriodicMetricsTrend
+
+
+def test_cube(periodic_dataframe, build_insight, metric):
+    insight = build_insight(periodic_dataframe, 3, metric=metric)
+
+    results = {}
+    trend_df, filtered_df = PeriodicMetricsTrend().calculate(
+        periodic_dataframe, metric, "monthly"
+    )
+    for cube in [False, True]:
+        results[cube] = PeriodicSubgroupMetricsTrend(cube=cube).calculate(
+            trend_df=trend_df, dataframe=filtered_df, metric_details=insight
+        )
+
+    assert results[True].get_column("PeriodIndex").n_unique() == 6
+    assert_frame_equal(
+        results[False].sort("sub_group", "PeriodIndex"),
+        results[True].sort("sub_group", "PeriodIndex"),
+        rtol=1e-9,
+    )
+
+
+def test_subgroup_index(periodic_dataframe, build_insight, revenue_metric):
+    insight = build_insight(periodic_dataframe, 3)
+    trend_df, filtered_df = PeriodicMetricsTrend().calculate(
+        periodic_dataframe, revenue_metric, "monthly"
+    )
+    calculator = PeriodicSubgroupMetricsTrend()
+    subgroup_df = calculator.calculate(
+        trend_df=trend_df, dataframe=filtered_df, metric_details=insight
+    )
+    subgroup_dictionary = calculator.subgroup_dictionary
+    rendered_df = subgroup_dictionary.render(subgroup_df)
+    subgroup_index = subgroup_trend_services.build_subgroup_index(
+        subgroup_df, subgroup_dictionary
+    )
+
+    rng = random.Random(0)
+    for _ in range(50):
+        row = periodic_dataframe.row(
+            rng.randrange(periodic_dataframe.height), named=True
+        )
+        dimension_value_pairs = [
+            DimensionValuePair(dimension=dimension, value=row[dimension])
+            for dimension in rng.sample(insight.group_by_columns, rng.randint(1, 3))
+        ]
+        json_result = subgroup_trend_services.apply_filter_on_subgroup_impact_df(
+            rendered_df, dimension_value_pairs
+        )
+        index_result = subgroup_trend_services.apply_filter_on_subgroup_impact_df(
+            subgroup_df, dimension_value_pairs, subgroup_index=subgroup_index
+        )
+
+        # one row per period the subgroup has rows in
+        assert json_result.height >= 1
+        assert subgroup_dictionary.render(index_result).equals(json_result)
+
+
+@pytest.mark.parametrize("cube", [False, True])
+def test_pruning_matches_filtered_subgroups(periodic_dataframe, build_insight, cube):
+    trend_df, filtered_df = PeriodicMetricsTrend().calculate(
+        periodic_dataframe, build_insight(periodic_dataframe, 3).metrics, "monthly"
+    )
+
+    def calculate(**thresholds):
+        insight = build_insight(periodic_dataframe, 3, **thresholds)
+        subgroup_df = PeriodicSubgroupMetricsTrend(cube=cube).calculate(
+            trend_df=trend_df, dataframe=filtered_df, metric_details=insight
+        )
+        return subgroup_df.sort("sub_group", "PeriodIndex"), insight
+
+    all_df, _ = calculate()
+    pruned_df, insight = calculate(min_subgroup_support=20, min_subgroup_impact=1500)
+
+    # the support and the sums of positive revenue only shrink with the depth, so
+    # the subgroups skipped under a failing parent fail the thresholds too
+    passing = all_df.filter(
+        (pl.col("size") >= 20) & (pl.col("absolute_impact").abs() >= 1500)
+    ).get_column("sub_group")
+    assert insight.pruned_subgroups > 0
+    assert_frame_equal(pruned_df, all_df.filter(pl.col("sub_group").is_in(passing)))
@@ -0,0 +1,40 @@
+import os
+
+import polars as pl
+from polars.testing import assert_frame_equal
+
+from jobs.result_store import ResultStore
+
+
+def build_result(rows: int) -> pl.DataFrame:
+    return pl.DataFrame({"sub_group": [str(row) for row in range(rows)]})
+
+
+def test_result_store_spills_over_budget(tmp_path):
+    result_df = build_result(1000)
+    store = ResultStore(
+        max_memory_bytes=result_df.estimated_size() * 2, spill_dir=str(tmp_path)
+    )
+    result_ids = [store.put(result_df, {"name": str(index)}) for index in range(3)]
+
+    assert store.memory_bytes <= store.max_memory_bytes
+    assert os.path.isfile(store.get_metadata_file(result_ids[0]))
+    # a new store, as after a restart, only reads the spilled results
+    restarted_store = ResultStore(spill_dir=str(tmp_path))
+    spilled_df, metadata = restarted_store.get(result_ids[0])
+    assert_frame_equal(spilled_df, result_df)
+    assert metadata == {"name": "0"}
+
+
+def test_result_store_expires_results(tmp_path):
+    store = ResultStore(max_memory_bytes=0, spill_dir=str(tmp_path), ttl_seconds=-1)
+    result_id = store.put(build_result(10))
+
+    assert store.get(result_id) is None
+    assert os.listdir(tmp_path) == []
+
+
+def test_result_store_rejects_foreign_ids(tmp_path):
+    store = ResultStore(spill_dir=str(tmp_path))
+
+    assert store.get("../results") is None
@@ -0,0 +1,88 @@
+import polars as pl
+import pytest
+from polars.testing import assert_frame_equal
+
+from base.general import Filter, FilterOperator
+from calculations import utils as calculation_utils
+from calculations.trend.segment_comparision import SegmentComparison
+from data_source.registry import DatasetRegistry
+
+
+@pytest.mark.parametrize("single_pass", [False, True])
+def test_scanned_matches_eager(segment_dataframe, build_insight, tmp_path, single_pass):
+    insight = build_insight(segment_dataframe, 2, segments=True)
+    segment_dataframe.write_parquet(tmp_path / "segments.parquet")
+
+    eager_dfs = SegmentComparison(insights=insight, single_pass=single_pass).calculate(
+        segment_dataframe
+    )
+    scanned_dfs = SegmentComparison(
+        insights=insight, single_pass=single_pass
+    ).calculate(pl.scan_parquet(tmp_path / "segments.parquet"))
+
+    assert_frame_equal(eager_dfs[0], scanned_dfs[0])
+    # only the columns of the insight and the rows of the segments are read
+    for eager_df, scanned_df in zip(eager_dfs[1:], scanned_dfs[1:]):
+        assert_frame_equal(
+            eager_df.select(scanned_df.columns), scanned_df, check_row_order=False
+        )
+
+
+def test_registry_scans_over_budget(segment_dataframe, build_insight, tmp_path):
+    insight = build_insight(segment_dataframe, 2, segments=True)
+    path = str(tmp_path / "segments.csv")
+    segment_dataframe.write_csv(path)
+    registry = DatasetRegistry(max_memory_bytes=1024)
+
+    scanned_df = registry.get_or_scan(path, date_column="date")
+
+    assert isinstance(scanned_df, pl.LazyFrame)
+    assert_frame_equal(
+        SegmentComparison(insights=insight, single_pass=True).calculate(scanned_df)[0],
+        SegmentComparison(insights=insight, single_pass=True).calculate(
+            segment_dataframe
+        )[0],
+    )
+
+
+@pytest.mark.parametrize(
+    "baseline_values, comparison_values",
+    [(["0"], ["1", "2"]), (["0", "1"], ["1", "2"]), (["0"], ["missing"])],
+    ids=["disjoint", "overlapping", "empty"],
+)
+def test_single_pass_matches_two_passes(
+    segment_dataframe, build_insight, metric, baseline_values, comparison_values
+):
+    insight = build_insight(
+        segment_dataframe,
+        2,
+        metric=metric,
+        baseline_segment=[
+            Filter(column="dim_0", operator=FilterOperator.EQ, values=baseline_values)
+        ],
+        comparison_segment=[
+            Filter(column="dim_0", operator=FilterOperator.EQ, values=comparison_values)
+        ],
+    )
+
+    trend_df, baseline_df, comparison_df = SegmentComparison(
+        insights=insight
+    ).calculate(segment_dataframe)
+    single_pass_trend_df, tagged_df, _ = SegmentComparison(
+        insights=insight, single_pass=True
+    ).calculate(segment_dataframe)
+
+    assert_frame_equal(single_pass_trend_df, trend_df)
+    # the rows of a segment are the tagged rows with its bit, both bits where the
+    # segments overlap
+    for segment, segment_df in [
+        ("baseline", baseline_df),
+        ("comparison", comparison_df),
+    ]:
+        segment_bit = calculation_utils.SEGMENT_BITS[segment]
+        assert_frame_equal(
+            tagged_df.filter(
+                pl.col(calculation_utils.SEGMENT_MASK_COLUMN) & segment_bit > 0
+            ).select(segment_df.columns),
+            segment_df,
+        )
@@ -0,0 +1,176 @@
+import polars as pl
+import pytest
+from polars.testing import assert_frame_equal
+
+from calculations.subgroup_insights.cube_cache import SubgroupCubeCache
+from calculations.subgroup_insights.segment_subgroup_insights import (
+    SegmentSubgroupInsights,
+)
+from calculations.trend.segment_comparision import SegmentComparison
+
+
+def calculate_segment_trends(insight, dataframe):
+    return SegmentComparison(insights=insight, single_pass=True).calculate(dataframe)
+
+
+def test_top_k(segment_dataframe, build_insight):
+    insight = build_insight(segment_dataframe, 3, segments=True)
+    trend_dfs = calculate_segment_trends(insight, segment_dataframe)
+
+    all_subgroups = SegmentSubgroupInsights(insights=insight).calculate(*trend_dfs)
+    top_subgroups = SegmentSubgroupInsights(insights=insight, top_k=20).calculate(
+        *trend_dfs
+    )
+
+    expected = all_subgroups.sort(
+        [pl.col("absolute_impact_diff").abs(), pl.col("sub_group")],
+        descending=[True, False],
+        nulls_last=True,
+    ).head(20)
+    assert_frame_equal(expected, top_subgroups, rtol=1e-9)
+
+
+def test_cube_cache(segment_dataframe, build_insight, tmp_path):
+    cube_cache = SubgroupCubeCache(spill_dir=str(tmp_path))
+    dimensions = build_insight(segment_dataframe, 2).group_by_columns
+
+    # the second insight reuses the partials of the first, the third those of a
+    # superset of its dimensions
+    for group_by_columns in [dimensions, dimensions, dimensions[:2]]:
+        insight = build_insight(
+            segment_dataframe, 2, segments=True, group_by_columns=group_by_columns
+        )
+        trend_dfs = calculate_segment_trends(insight, segment_dataframe)
+        results = []
+        for calculator in [
+            SegmentSubgroupInsights(insights=insight, cube=True),
+            SegmentSubgroupInsights(insights=insight, cube=True, cube_cache=cube_cache),
+        ]:
+            result = calculator.calculate(*trend_dfs, data_fingerprint="test")
+            results.append(calculator.subgroup_dictionary.render(result))
+
+        assert_frame_equal(
+            results[0].sort("sub_group"), results[1].sort("sub_group"), rtol=1e-9
+        )
+
+
+@pytest.mark.parametrize("cube", [False, True])
+@pytest.mark.parametrize("top_k", [None, 10])
+def test_segments_without_rows(segment_dataframe, build_insight, cube, top_k):
+    insight = build_insight(segment_dataframe, 2, segments=True)
+    for segment in [insight.baseline_segment, insight.comparison_segment]:
+        segment[0].values = ["east"]
+    trend_dfs = calculate_segment_trends(insight, segment_dataframe)
+
+    subgroup_df = SegmentSubgroupInsights(
+        insights=insight, cube=cube, top_k=top_k
+    ).calculate(*trend_dfs)
+
+    assert subgroup_df.height == 0
+
+
+@pytest.mark.parametrize("cube", [False, True])
+def test_pruning_matches_filtered_subgroups(segment_dataframe, build_insight, cube):
+    def calculate(**thresholds):
+        insight = build_insight(segment_dataframe, 3, segments=True, **thresholds)
+        calculator = SegmentSubgroupInsights(insights=insight, cube=cube)
+        subgroup_df = calculator.calculate(
+            *calculate_segment_trends(insight, segment_dataframe)
+        )
+        return calculator.subgroup_dictionary.render(subgroup_df).sort("sub_group")
+
+    all_df = calculate()
+    pruned_df = calculate(min_subgroup_support=40)
+
+    # a subgroup passes with the support of either segment
+    passing = all_df.filter(
+        (pl.col("size_baseline") >= 40) | (pl.col("size_comparison") >= 40)
+    ).get_column("sub_group")
+    assert 0 < pruned_df.height < all_df.height
+    assert_frame_equal(pruned_df, all_df.filter(pl.col("sub_group").is_in(passing)))
+
+
+class CountingCubeCache(SubgroupCubeCache):
+    """Cube cache counting the partials aggregated and added to it"""
+
+    def __init__(self, spill_dir: str) -> None:
+        super().__init__(spill_dir=spill_dir)
+        self.added = 0
+
+    def add(self, key: str, value, spilled: bool = False):
+        if not spilled:
+            self.added += 1
+        super().add(key, value, spilled)
+
+
+def test_cube_cache_shared_across_segments_and_thresholds(
+    segment_dataframe, build_insight, tmp_path
+):
+    cube_cache = CountingCubeCache(str(tmp_path))
+    swapped = build_insight(segment_dataframe, 2, segments=True)
+    swapped.baseline_segment, swapped.comparison_segment = (
+        swapped.comparison_segment,
+        swapped.baseline_segment,
+    )
+    insights = [
+        build_insight(segment_dataframe, 2, segments=True),
+        swapped,
+        build_insight(segment_dataframe, 2, segments=True, min_subgroup_support=40),
+    ]
+
+    added = []
+    for insight in insights:
+        trend_dfs = calculate_segment_trends(insight, segment_dataframe)
+        results = []
+        for calculator in [
+            SegmentSubgroupInsights(insights=insight),
+            SegmentSubgroupInsights(insights=insight, cube=True, cube_cache=cube_cache),
+        ]:
+            result = calculator.calculate(
+                *trend_dfs, data_fingerprint="test", dataframe=segment_dataframe
+            )
+            results.append(calculator.subgroup_dictionary.render(result))
+        added.append(cube_cache.added)
+
+        assert_frame_equal(
+            results[0].sort("sub_group"), results[1].sort("sub_group"), rtol=1e-9
+        )
+
+    # the partials of the first insight serve the other segments and thresholds
+    assert added[0] > 0
+    assert added == [added[0]] * 3
+
+
+class Cancelled(Exception):
+    pass
+
+
+@pytest.mark.parametrize("cube", [False, True])
+def test_progress_stops_the_calculation(segment_dataframe, build_insight, cube):
+    insight = build_insight(segment_dataframe, 2, segments=True)
+    trend_dfs = calculate_segment_trends(insight, segment_dataframe)
+    reports = []
+
+    def progress(done, total):
+        reports.append((done, total))
+
+    SegmentSubgroupInsights(insights=insight, cube=cube, progress=progress).calculate(
+        *trend_dfs
+    )
+    # 4 dimensions taken 1 and 2 at a time, at least once each
+    assert len(reports) >= 10
+    assert all(0 <= done < total for done, total in reports)
+
+    calls = []
+
+    def cancel(done, total):
+        calls.append(done)
+        if len(calls) > 3:
+            raise Cancelled()
+
+    with pytest.raises(Cancelled):
+        SegmentSubgroupInsights(
+            insights=insight, cube=cube, max_threads=1, progress=cancel
+        ).calculate(*trend_dfs)
+    # no combination starts after the cancellation
+    assert len(calls) == 4
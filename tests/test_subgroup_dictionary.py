@@ -0,0 +1,28 @@
+import itertools
+import json
+
+import polars as pl
+
+from calculations.subgroup_insights.subgroup_dictionary import SubgroupDictionary
+
+
+def test_rendered_keys_are_the_json_of_the_dimension_values(build_dataframe):
+    dataframe = build_dataframe(2_000, [5, 15, 25, 35])
+    dimensions = [column for column in dataframe.columns if column.startswith("dim_")]
+    subgroup_dictionary = SubgroupDictionary.from_dataframes([dataframe], dimensions)
+
+    for combination in itertools.chain.from_iterable(
+        itertools.combinations(dimensions, depth) for depth in range(1, 4)
+    ):
+        subgroup_df = dataframe.select(combination).unique(maintain_order=True)
+        json_keys = pl.Series(
+            "sub_group",
+            [json.dumps(item) for item in subgroup_df.to_dicts()],
+            dtype=pl.Utf8,
+        )
+
+        keys = subgroup_df.select(subgroup_dictionary.build_key_exp(combination))
+
+        assert (
+            subgroup_dictionary.render(keys).get_column("sub_group").equals(json_keys)
+        )